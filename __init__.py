@@ -4,6 +4,10 @@
 # copyright notices and license terms.
 from trytond.pool import Pool
 from .survey import *
+from .response import *
+from .result import *
+from .archive import *
+from .instrument import *
 
 
 def register():
@@ -11,8 +15,18 @@ def register():
         Configuration,
         Survey,
         SurveyField,
+        SurveyIndex,
         ActWindow,
         View,
         Menu,
         DynamicModel,
+        SurveyResponse,
+        SurveyImport,
+        SurveyResultContext,
+        SurveyResult,
+        SurveyCrossContext,
+        SurveyCross,
+        SurveySummary,
+        SurveyArchive,
+        SurveyTiming,
         module='survey', type_='model')
@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+# This file is part of the survey module for Tryton.
+# The COPYRIGHT file at the top level of this repository contains the full
+# copyright notices and license terms.
+from trytond.model import ModelSQL, ModelView, fields
+from trytond.pool import Pool
+from trytond.pyson import Eval
+from trytond.transaction import Transaction
+from trytond.tools import reduce_ids, grouped_slice
+from trytond.protocols.jsonrpc import JSONEncoder, JSONDecoder
+from trytond import backend
+from sql import Table, Column, Literal
+from itertools import islice
+import gzip
+import json
+import logging
+import os
+
+__all__ = ['SurveyArchive']
+logger = logging.getLogger(__name__)
+
+
+class SurveyArchive(ModelSQL, ModelView):
+    'Survey Archive'
+    __name__ = 'survey.archive'
+    survey = fields.Many2One('survey.survey', 'Survey', required=True,
+        ondelete='CASCADE', select=True, readonly=True)
+    cutoff = fields.DateTime('Cutoff', required=True, readonly=True,
+        help='The responses created before are archived.')
+    storage = fields.Selection([
+            ('table', 'Table'),
+            ('file', 'Compressed File'),
+            ], 'Storage', required=True, readonly=True)
+    path = fields.Char('Path', readonly=True,
+        states={
+            'invisible': Eval('storage') != 'file',
+            }, depends=['storage'])
+    count = fields.Integer('Count', readonly=True,
+        help='Number of archived responses.')
+    state = fields.Selection([
+            ('running', 'Running'),
+            ('archived', 'Archived'),
+            ('restored', 'Restored'),
+            ], 'State', readonly=True, required=True)
+
+    @classmethod
+    def __setup__(cls):
+        super(SurveyArchive, cls).__setup__()
+        cls._order.insert(0, ('id', 'DESC'))
+        cls._buttons.update({
+                'restore': {
+                    'invisible': Eval('state') == 'restored',
+                    },
+                })
+        cls._error_messages.update({
+                'missing_archive_path': 'An archive path must be '
+                    'configured to archive the responses of survey '
+                    '"%(survey)s" in a file.',
+                'shared_survey': 'The responses of survey "%(survey)s" '
+                    'can not be archived because they are shared.',
+                })
+
+    @staticmethod
+    def default_count():
+        return 0
+
+    @staticmethod
+    def default_state():
+        return 'running'
+
+    @staticmethod
+    def table_columns(table_name):
+        'Return the column names of the table'
+        cursor = Transaction().connection.cursor()
+        cursor.execute(*Table(table_name).select(limit=0))
+        return [c[0] for c in cursor.description]
+
+    @classmethod
+    def archive_table(cls, survey_id):
+        '''Return the archive table of the survey
+        The table is created or the columns of the new fields are added.
+        '''
+        Survey = Pool().get('survey.survey')
+        TableHandler = backend.get('TableHandler')
+        cursor = Transaction().connection.cursor()
+        table_name = 'survey_%s__archive' % survey_id
+
+        if not TableHandler.table_exist(table_name):
+            cursor.execute('CREATE TABLE "%s" ('
+                'id INTEGER NOT NULL, '
+                'archive INTEGER NOT NULL, '
+                'create_date TIMESTAMP, '
+                'write_date TIMESTAMP, '
+                'create_uid INTEGER, '
+                'write_uid INTEGER)' % table_name)
+            cursor.execute('CREATE INDEX "%s_archive_idx" ON "%s" (archive)'
+                % (table_name, table_name))
+        existing = cls.table_columns(table_name)
+        for name, (type_, _) in Survey.table_definition(
+                survey_id).iteritems():
+            if name not in existing:
+                cursor.execute('ALTER TABLE "%s" ADD COLUMN "%s" %s'
+                    % (table_name, name, type_))
+        return Table(table_name)
+
+    @classmethod
+    def archive(cls, survey, cutoff, batch_size=1000):
+        '''Move the responses of the survey created before the cutoff to
+        the archive storage of the survey
+        The responses are copied then deleted by batches, each one
+        committed, so the table is never locked for long.
+        :return: the archive or None if no response is expired
+        '''
+        pool = Pool()
+        Configuration = pool.get('survey.configuration')
+        Summary = pool.get('survey.summary')
+        transaction = Transaction()
+        cursor = transaction.connection.cursor()
+
+        if survey.storage == 'shared':
+            cls.raise_user_error('shared_survey', {
+                    'survey': survey.rec_name,
+                    })
+        table = Table('survey_%s' % survey.id)
+        archive = cls(survey=survey, cutoff=cutoff,
+            storage=survey.archive_storage)
+        if archive.storage == 'file':
+            directory = Configuration(1).archive_path
+            if not directory:
+                cls.raise_user_error('missing_archive_path', {
+                        'survey': survey.rec_name,
+                        })
+            archive.save()
+            archive.path = os.path.join(directory,
+                'survey_%s_%s.jsonl.gz' % (survey.id, archive.id))
+        else:
+            archive_table = cls.archive_table(survey.id)
+        archive.save()
+        transaction.commit()
+
+        columns = cls.table_columns(table._name)
+        summarized = Summary.summarized(survey.id)
+        while True:
+            cursor.execute(*table.select(table.id,
+                    where=table.create_date < cutoff,
+                    order_by=table.id.asc, limit=batch_size))
+            ids = [i for i, in cursor.fetchall()]
+            if not ids:
+                break
+            if archive.storage == 'file':
+                archive.write_file(table, columns, ids)
+            else:
+                for sub_ids in grouped_slice(ids):
+                    cursor.execute(*archive_table.insert(
+                            [Column(archive_table, c) for c in columns]
+                            + [archive_table.archive],
+                            table.select(
+                                *([Column(table, c) for c in columns]
+                                    + [Literal(archive.id)]),
+                                where=reduce_ids(table.id, sub_ids))))
+            if summarized:
+                Summary.add_responses(survey.id, ids, sign=-1)
+            for sub_ids in grouped_slice(ids):
+                cursor.execute(*table.delete(
+                        where=reduce_ids(table.id, sub_ids)))
+            archive.count += len(ids)
+            archive.save()
+            transaction.commit()
+            logger.info('survey archive %s: %s responses archived',
+                archive.id, archive.count)
+
+        if not archive.count:
+            cls.delete([archive])
+            return None
+        archive.state = 'archived'
+        archive.save()
+        return archive
+
+    def write_file(self, table, columns, ids):
+        '''Append the responses to the compressed file
+        Each call writes a complete gzip member so the file stays readable
+        if a later batch fails.
+        '''
+        cursor = Transaction().connection.cursor()
+        with gzip.open(self.path, 'ab') as fileobj:
+            for sub_ids in grouped_slice(ids):
+                cursor.execute(*table.select(
+                        *[Column(table, c) for c in columns],
+                        where=reduce_ids(table.id, sub_ids),
+                        order_by=table.id.asc))
+                for row in cursor.fetchall():
+                    fileobj.write(json.dumps(dict(zip(columns, row)),
+                            cls=JSONEncoder, separators=(',', ':')))
+                    fileobj.write('\n')
+
+    def read_file(self):
+        'Yield the responses of the compressed file'
+        with gzip.open(self.path, 'rb') as fileobj:
+            for line in fileobj:
+                if line.strip():
+                    yield json.loads(line, object_hook=JSONDecoder())
+
+    @classmethod
+    @ModelView.button
+    def restore(cls, archives):
+        'Restore the archived responses in the table of the survey'
+        for archive in archives:
+            archive.restore_responses()
+
+    def restore_responses(self, batch_size=1000):
+        '''Insert back the archived responses by batches, each one
+        committed
+        The responses already in the table are skipped so an interrupted
+        restore can be run again.
+        '''
+        pool = Pool()
+        Summary = pool.get('survey.summary')
+        transaction = Transaction()
+        database = transaction.database
+        cursor = transaction.connection.cursor()
+
+        table = Table('survey_%s' % self.survey.id)
+        columns = self.table_columns(table._name)
+        summarized = Summary.summarized(self.survey.id)
+
+        def existing_ids(ids):
+            existing = set()
+            for sub_ids in grouped_slice(ids):
+                cursor.execute(*table.select(table.id,
+                        where=reduce_ids(table.id, sub_ids)))
+                existing.update(i for i, in cursor.fetchall())
+            return existing
+
+        if self.storage == 'file':
+            if not database.has_multirow_insert():
+                batch_size = 1
+            elif backend.name() == 'sqlite':
+                # SQLite limits the number of parameters of a query
+                batch_size = min(batch_size, 999 // len(columns))
+            responses = self.read_file()
+            while True:
+                batch = list(islice(responses, batch_size))
+                if not batch:
+                    break
+                existing = existing_ids([r['id'] for r in batch])
+                batch = [r for r in batch if r['id'] not in existing]
+                if batch:
+                    cursor.execute(*table.insert(
+                            [Column(table, c) for c in columns],
+                            [[r.get(c) for c in columns] for r in batch]))
+                    if summarized:
+                        Summary.add_responses(self.survey.id,
+                            [r['id'] for r in batch])
+                transaction.commit()
+        else:
+            archive_table = self.archive_table(self.survey.id)
+            while True:
+                cursor.execute(*archive_table.select(archive_table.id,
+                        where=archive_table.archive == self.id,
+                        order_by=archive_table.id.asc, limit=batch_size))
+                ids = [i for i, in cursor.fetchall()]
+                if not ids:
+                    break
+                existing = existing_ids(ids)
+                new_ids = [i for i in ids if i not in existing]
+                for sub_ids in grouped_slice(new_ids):
+                    cursor.execute(*table.insert(
+                            [Column(table, c) for c in columns],
+                            archive_table.select(
+                                *[Column(archive_table, c) for c in columns],
+                                where=reduce_ids(archive_table.id, sub_ids)
+                                & (archive_table.archive == self.id))))
+                if summarized:
+                    Summary.add_responses(self.survey.id, new_ids)
+                for sub_ids in grouped_slice(ids):
+                    cursor.execute(*archive_table.delete(
+                            where=reduce_ids(archive_table.id, sub_ids)
+                            & (archive_table.archive == self.id)))
+                transaction.commit()
+
+        self.state = 'restored'
+        self.save()
+        if self.storage == 'file' and os.path.exists(self.path):
+            os.remove(self.path)
+        logger.info('survey archive %s: %s responses restored',
+            self.id, self.count)
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+# This file is part of the survey module for Tryton.
+# The COPYRIGHT file at the top level of this repository contains the full
+# copyright notices and license terms.
+from trytond.model import ModelSQL, ModelView, fields
+from trytond.pool import Pool
+from trytond.transaction import Transaction
+from trytond.config import config
+from trytond import backend
+from sql.aggregate import Count, Sum, Max
+from importlib import import_module
+import datetime
+import logging
+import threading
+import time
+
+__all__ = ['SurveyTiming', 'phase']
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+_pending = []
+_pending_lock = threading.Lock()
+# Timings kept in memory until a writable transaction stores them
+_PENDING_SIZE = 10000
+
+
+class SurveyTiming(ModelSQL, ModelView):
+    'Survey Timing'
+    __name__ = 'survey.timing'
+    phase = fields.Char('Phase', readonly=True, select=True)
+    parent_phase = fields.Char('Parent Phase', readonly=True)
+    survey = fields.Integer('Survey', readonly=True)
+    duration = fields.Float('Duration', digits=(16, 6), readonly=True,
+        help='In seconds.')
+    queries = fields.Integer('Queries', readonly=True,
+        help='Number of SQL queries executed by the phase.')
+
+    @classmethod
+    def __setup__(cls):
+        super(SurveyTiming, cls).__setup__()
+        cls._order.insert(0, ('id', 'DESC'))
+
+    @classmethod
+    def flush(cls):
+        '''Store the pending timings
+        Nothing is done in read-only transactions or before the table is
+        created.
+        '''
+        TableHandler = backend.get('TableHandler')
+        transaction = Transaction()
+        table_name = getattr(cls, '_table', None)
+        if (transaction.readonly or not _pending or not table_name
+                or not TableHandler.table_exist(table_name)):
+            return
+        database_name = transaction.database.name
+        with _pending_lock:
+            records = [r for r in _pending if r['database'] == database_name]
+            _pending[:] = [r for r in _pending
+                if r['database'] != database_name]
+        cursor = transaction.connection.cursor()
+        table = cls.__table__()
+        columns = [table.create_date, table.create_uid, table.phase,
+            table.parent_phase, table.survey, table.duration, table.queries]
+        # SQLite limits the number of parameters of a query
+        for i in range(0, len(records), 100):
+            cursor.execute(*table.insert(columns, [[
+                            r['date'], transaction.user, r['phase'],
+                            r['parent_phase'], r['survey'], r['duration'],
+                            r['queries']]
+                        for r in records[i:i + 100]]))
+
+    @classmethod
+    def summary(cls, domain=None):
+        '''Return a dict of phase and the count, total and maximum duration
+        and the number of queries of the stored timings
+        '''
+        cursor = Transaction().connection.cursor()
+        table = cls.__table__()
+        where = None
+        if domain:
+            query = cls.search(domain, query=True)
+            where = table.id.in_(query)
+        cursor.execute(*table.select(table.phase, Count(table.id),
+                Sum(table.duration), Max(table.duration), Sum(table.queries),
+                where=where, group_by=[table.phase]))
+        return dict((phase, {
+                    'count': count,
+                    'duration': duration,
+                    'max_duration': max_duration,
+                    'queries': queries,
+                    }) for phase, count, duration, max_duration, queries
+            in cursor.fetchall())
+
+
+def enabled():
+    'Return True if the instrumentation is enabled by the configuration'
+    return config.getboolean('survey', 'instrument', default=False)
+
+
+def phase(name, survey_id=None):
+    '''Return a context manager recording the duration and the number of
+    queries of the phase when the instrumentation is enabled
+    '''
+    if not enabled():
+        return _null_phase
+    return _Phase(name, survey_id)
+
+
+_CURSORS = {
+    'sqlite': 'SQLiteCursor',
+    'postgresql': 'LoggingCursor',
+    }
+# Number of running phases and the cursor class counting the queries
+_counting = {
+    'phases': 0,
+    'cursor': None,
+    }
+
+
+def _start_counting():
+    '''Count in the thread the queries executed by the cursors of the
+    backend until the end of the last running phase'''
+    with _pending_lock:
+        _counting['phases'] += 1
+        if _counting['phases'] > 1:
+            return
+        Cursor = getattr(import_module('trytond.backend.%s.database'
+                % backend.name()), _CURSORS.get(backend.name(), ''), None)
+        if Cursor is None:
+            return
+        execute = Cursor.execute
+
+        def counting_execute(self, *args, **kwargs):
+            _local.queries = _local.__dict__.get('queries', 0) + 1
+            return execute(self, *args, **kwargs)
+        _counting['cursor'] = Cursor
+        _counting['execute'] = Cursor.__dict__.get('execute')
+        Cursor.execute = counting_execute
+
+
+def _stop_counting():
+    'Restore the cursor class once no phase is running'
+    with _pending_lock:
+        _counting['phases'] -= 1
+        Cursor = _counting['cursor']
+        if _counting['phases'] or Cursor is None:
+            return
+        execute = _counting.pop('execute')
+        if execute is None:
+            # The method is inherited
+            del Cursor.execute
+        else:
+            Cursor.execute = execute
+        _counting['cursor'] = None
+
+
+class _NullPhase(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, type, value, traceback):
+        pass
+
+
+_null_phase = _NullPhase()
+
+
+class _Phase(object):
+
+    def __init__(self, name, survey_id):
+        self.name = name
+        self.survey_id = survey_id
+        self.children = []
+
+    def __enter__(self):
+        _start_counting()
+        stack = _local.__dict__.setdefault('stack', [])
+        self.start_queries = _local.__dict__.get('queries', 0)
+        stack.append(self)
+        self.start = time.time()
+
+    def __exit__(self, type, value, traceback):
+        duration = time.time() - self.start
+        stack = _local.stack
+        stack.pop()
+        parent = stack[-1] if stack else None
+        database = getattr(Transaction(), 'database', None)
+        record = {
+            'database': database.name if database else None,
+            'date': datetime.datetime.now(),
+            'phase': self.name,
+            'parent_phase': parent.name if parent else None,
+            'survey': self.survey_id,
+            'duration': duration,
+            'queries': _local.__dict__.get('queries', 0) - self.start_queries,
+            }
+        _stop_counting()
+        with _pending_lock:
+            if len(_pending) < _PENDING_SIZE:
+                _pending.append(record)
+        if parent:
+            parent.children.append(record)
+            return
+        self.log(record)
+        if type is None:
+            try:
+                Timing = Pool().get('survey.timing')
+            except KeyError:
+                return
+            Timing.flush()
+
+    def log(self, record):
+        'Log the summary of the phase and of its children'
+        children = {}
+        for child in self.children:
+            total = children.setdefault(child['phase'], [0, 0., 0])
+            total[0] += 1
+            total[1] += child['duration']
+            total[2] += child['queries']
+        logger.info('%s%s: %.1f ms, %s queries%s', self.name,
+            ' survey %s' % self.survey_id if self.survey_id else '',
+            record['duration'] * 1000, record['queries'],
+            ''.join(' | %s x%s: %.1f ms, %s queries' % (
+                    name, count, duration * 1000, queries)
+                for name, (count, duration, queries)
+                in sorted(children.iteritems())))
@@ -0,0 +1,407 @@
+#!/usr/bin/env python
+# This file is part of the survey module for Tryton.
+# The COPYRIGHT file at the top level of this repository contains the full
+# copyright notices and license terms.
+from trytond.model import ModelSQL, ModelView, fields
+from trytond.pool import Pool
+from trytond.pyson import Eval
+from trytond.transaction import Transaction
+from trytond.protocols.jsonrpc import JSONDecoder
+from trytond import backend
+from itertools import islice
+import csv
+import json
+import logging
+
+from .survey import slugify, field_name
+
+__all__ = ['SurveyResponse', 'SurveyImport']
+logger = logging.getLogger(__name__)
+
+_STATES = {
+    'readonly': Eval('state') != 'draft',
+    }
+_DEPENDS = ['state']
+
+
+class SurveyResponse(ModelSQL, ModelView):
+    'Survey Response'
+    __name__ = 'survey.response'
+    survey = fields.Many2One('survey.survey', 'Survey', required=True,
+        ondelete='CASCADE', select=True,
+        domain=[
+            ('storage', '=', 'shared'),
+            ])
+    answers = fields.Dict('survey.field', 'Answers',
+        domain=[
+            ('survey', '=', Eval('survey', -1)),
+            ],
+        depends=['survey'])
+
+    @classmethod
+    def __setup__(cls):
+        super(SurveyResponse, cls).__setup__()
+        cls._order.insert(0, ('id', 'DESC'))
+
+    @classmethod
+    def __register__(cls, module_name):
+        super(SurveyResponse, cls).__register__(module_name)
+        cursor = Transaction().connection.cursor()
+        if backend.name() == 'postgresql':
+            # The answers are stored as JSON text
+            cursor.execute('CREATE INDEX IF NOT EXISTS '
+                '"survey_response_answers_gin" ON "%s" '
+                'USING gin ((answers::jsonb) jsonb_path_ops)' % cls._table)
+
+    @staticmethod
+    def default_survey():
+        return Transaction().context.get('survey')
+
+    @classmethod
+    def create(cls, vlist):
+        Summary = Pool().get('survey.summary')
+        vlist = [cls.convert_answers(v) for v in vlist]
+        responses = super(SurveyResponse, cls).create(vlist)
+        for survey_id, ids in cls.group_by_survey(responses).iteritems():
+            Summary.add_responses(survey_id, ids)
+        return responses
+
+    @classmethod
+    def write(cls, *args):
+        Summary = Pool().get('survey.summary')
+        surveys = cls.group_by_survey(sum(args[::2], []))
+        for survey_id, ids in surveys.iteritems():
+            Summary.add_responses(survey_id, ids, sign=-1)
+        args = list(args)
+        args[1::2] = [cls.convert_answers(v) for v in args[1::2]]
+        super(SurveyResponse, cls).write(*args)
+        for survey_id, ids in surveys.iteritems():
+            Summary.add_responses(survey_id, ids)
+
+    @classmethod
+    def delete(cls, responses):
+        Summary = Pool().get('survey.summary')
+        for survey_id, ids in cls.group_by_survey(responses).iteritems():
+            Summary.add_responses(survey_id, ids, sign=-1)
+        super(SurveyResponse, cls).delete(responses)
+
+    @staticmethod
+    def convert_answers(values):
+        '''Return the values with the keys of the answers converted to the
+        field names stored by the responses of the surveys'''
+        if values.get('answers'):
+            values = values.copy()
+            values['answers'] = dict((field_name(unicode(k)), v)
+                for k, v in values['answers'].iteritems())
+        return values
+
+    @staticmethod
+    def group_by_survey(responses):
+        'Return a dict of survey id and the ids of its responses'
+        surveys = {}
+        for response in responses:
+            surveys.setdefault(response.survey.id, []).append(response.id)
+        return surveys
+
+    @classmethod
+    def answers_responses(cls, keys, rows):
+        '''Return the responses as dicts of keys and values
+        :param keys: id, create_date then the field names
+        :param rows: id, create_date and answers of each response
+        '''
+        responses = []
+        for id_, create_date, answers in rows:
+            if answers:
+                answers = json.loads(answers, object_hook=JSONDecoder())
+            else:
+                answers = {}
+            response = {'id': id_, 'create_date': create_date}
+            for key in keys[2:]:
+                response[key] = answers.get(key)
+            responses.append(response)
+        return responses
+
+    @classmethod
+    def search_answers(cls, survey, answers):
+        '''Return the responses of the survey having the answers
+        The GIN index of the answers is used on PostgreSQL.
+        :param answers: dict of field name and char, selection, integer,
+            boolean or many2one value
+        '''
+        cursor = Transaction().connection.cursor()
+        if backend.name() == 'postgresql':
+            cursor.execute('SELECT id FROM "%s" '
+                'WHERE survey = %%s AND answers::jsonb @> %%s::jsonb '
+                'ORDER BY id' % cls._table,
+                (survey.id, cls.answers.sql_format(answers)))
+        else:
+            query = 'SELECT id FROM "%s" WHERE survey = ?' % cls._table
+            params = [survey.id]
+            for name, value in sorted(answers.iteritems()):
+                query += ' AND json_extract(answers, ?) = ?'
+                params.extend(['$.%s' % name, value])
+            cursor.execute(query + ' ORDER BY id', params)
+        return cls.browse([i for i, in cursor.fetchall()])
+
+
+class SurveyImport(ModelSQL, ModelView):
+    'Survey Import'
+    __name__ = 'survey.import'
+    survey = fields.Many2One('survey.survey', 'Survey', required=True,
+        ondelete='CASCADE', states=_STATES, depends=_DEPENDS)
+    path = fields.Char('Path', required=True, states=_STATES,
+        depends=_DEPENDS, help='Path of the file on the server.')
+    format = fields.Selection([
+            ('csv', 'CSV'),
+            ('jsonl', 'JSON Lines'),
+            ], 'Format', required=True, states=_STATES, depends=_DEPENDS)
+    delimiter = fields.Char('Delimiter', size=1,
+        states={
+            'readonly': Eval('state') != 'draft',
+            'invisible': Eval('format') != 'csv',
+            'required': Eval('format') == 'csv',
+            }, depends=['state', 'format'])
+    chunk_size = fields.Integer('Chunk Size', required=True,
+        states=_STATES, depends=_DEPENDS,
+        help='Number of responses committed at once.')
+    processed = fields.Integer('Processed', readonly=True,
+        help='Number of responses already committed.')
+    state = fields.Selection([
+            ('draft', 'Draft'),
+            ('running', 'Running'),
+            ('done', 'Done'),
+            ('failed', 'Failed'),
+            ], 'State', readonly=True, required=True)
+    message = fields.Text('Message', readonly=True)
+
+    @classmethod
+    def __setup__(cls):
+        super(SurveyImport, cls).__setup__()
+        cls._order.insert(0, ('id', 'DESC'))
+        cls._buttons.update({
+                'run': {
+                    'invisible': Eval('state') == 'done',
+                    },
+                })
+        cls._error_messages.update({
+                'unknown_column': 'The column "%(column)s" does not match '
+                    'any field of survey "%(survey)s".',
+                'unknown_selection': 'The value "%(value)s" is not an '
+                    'option of the field "%(field)s".',
+                'unknown_record': 'The value "%(value)s" of the field '
+                    '"%(field)s" does not match one record.',
+                'chunk_failed': 'The chunk starting after response '
+                    '%(processed)s failed:\n%(error)s',
+                'invalid_responses': '%(errors)s',
+                })
+
+    @staticmethod
+    def default_format():
+        return 'csv'
+
+    @staticmethod
+    def default_delimiter():
+        return ','
+
+    @staticmethod
+    def default_chunk_size():
+        return 1000
+
+    @staticmethod
+    def default_processed():
+        return 0
+
+    @staticmethod
+    def default_state():
+        return 'draft'
+
+    @classmethod
+    @ModelView.button
+    def run(cls, imports):
+        'Import the file or resume it from the last committed chunk'
+        for import_ in imports:
+            with open(import_.path, 'rb') as fileobj:
+                import_.import_file(fileobj)
+
+    def import_file(self, fileobj):
+        '''Import the responses of the file committing each chunk
+        The responses already processed by a previous run are skipped.
+        '''
+        pool = Pool()
+        Survey = pool.get('survey.survey')
+        DynamicModel = pool.get('DynamicModel')
+        transaction = Transaction()
+
+        definitions = DynamicModel.load_schemas([self.survey.id]).get(
+            self.survey.id, [])
+        rows = self.read_rows(fileobj)
+        headers = next(rows, None)
+        if headers is None:
+            return
+        columns = self.map_columns(headers, definitions)
+        lookups = {}
+        rows = islice(rows, self.processed or 0, None)
+
+        self.state = 'running'
+        self.message = None
+        self.save()
+        transaction.commit()
+
+        processed = self.processed or 0
+        while True:
+            chunk = list(islice(rows, self.chunk_size))
+            if not chunk:
+                break
+            try:
+                responses = self.convert_rows(chunk, columns, lookups)
+                errors = []
+                Survey.save_data(self.survey, responses,
+                    batch_size=self.chunk_size, errors=errors)
+                if errors:
+                    # Report all the invalid responses of the chunk
+                    self.raise_user_error('invalid_responses', {
+                            'errors': '\n'.join(e['message'] for e in errors),
+                            })
+                processed += len(chunk)
+                self.processed = processed
+                self.save()
+                transaction.commit()
+            except Exception as exception:
+                self.fail(exception, processed)
+                raise
+            logger.info('survey import %s: %s responses committed',
+                self.id, processed)
+        self.state = 'done'
+        self.save()
+
+    def fail(self, exception, processed):
+        'Rollback the current chunk and store the failure'
+        transaction = Transaction()
+        transaction.rollback()
+        error = getattr(exception, 'message', None) or unicode(exception)
+        message = self.raise_user_error('chunk_failed', {
+                'processed': processed,
+                'error': error,
+                }, raise_exception=False)
+        self.write([self.__class__(self.id)], {
+                'state': 'failed',
+                'message': message,
+                })
+        transaction.commit()
+
+    def read_rows(self, fileobj):
+        '''Yield the headers then the values of each row of the file
+        Values of JSON Lines are ordered like the keys of the first line.
+        '''
+        if self.format == 'csv':
+            reader = csv.reader(fileobj, delimiter=str(self.delimiter))
+            for row in reader:
+                yield [v.decode('utf-8') for v in row]
+        elif self.format == 'jsonl':
+            headers = None
+            for line in fileobj:
+                if not line.strip():
+                    continue
+                values = json.loads(line)
+                if headers is None:
+                    headers = list(values.keys())
+                    yield headers
+                yield [values.get(h) for h in headers]
+
+    def map_columns(self, headers, definitions):
+        'Return the field definition of each column'
+        by_name = {}
+        for definition in definitions:
+            by_name[definition['name']] = definition
+            by_name.setdefault(
+                slugify(definition['kwargs']['string']), definition)
+        columns = []
+        for header in headers:
+            definition = by_name.get(slugify(header))
+            if not definition:
+                self.raise_user_error('unknown_column', {
+                        'column': header,
+                        'survey': self.survey.rec_name,
+                        })
+            columns.append(definition)
+        return columns
+
+    def convert_rows(self, rows, columns, lookups):
+        '''Return the responses of the rows
+        Selection labels and many2one names are resolved with lookup tables
+        that are shared by all the chunks of the import.
+        '''
+        pool = Pool()
+        for column in columns:
+            key = column['name']
+            if key in lookups:
+                continue
+            kwargs = column['kwargs']
+            if column['type'] == 'selection':
+                lookup = {}
+                for value, label in kwargs['selection']:
+                    if value is None:
+                        continue
+                    lookup[value] = value
+                    lookup.setdefault(label.lower(), value)
+                lookups[key] = lookup
+            elif column['type'] == 'many2one':
+                lookups[key] = {}
+
+        # Resolve in one search per target model the names of the chunk
+        for i, column in enumerate(columns):
+            if column['type'] != 'many2one':
+                continue
+            lookup = lookups[column['name']]
+            names = set()
+            for row in rows:
+                value = row[i]
+                if not isinstance(value, basestring):
+                    continue
+                value = value.strip()
+                if value and not value.isdigit() and value not in lookup:
+                    names.add(value)
+            if names:
+                Target = pool.get(column['kwargs']['model_name'])
+                for record in Target.search([
+                            ('rec_name', 'in', list(names)),
+                            ]):
+                    if record.rec_name in lookup:
+                        # Ambiguous name
+                        lookup[record.rec_name] = None
+                    else:
+                        lookup[record.rec_name] = record.id
+
+        responses = []
+        for row in rows:
+            response = {}
+            for column, value in zip(columns, row):
+                name = column['name']
+                if isinstance(value, basestring):
+                    value = value.strip()
+                if value is None or value == '':
+                    response[name] = None
+                elif column['type'] == 'selection':
+                    value = unicode(value)
+                    lookup = lookups[name]
+                    key = lookup.get(value, lookup.get(value.lower()))
+                    if key is None:
+                        self.raise_user_error('unknown_selection', {
+                                'value': value,
+                                'field': column['kwargs']['string'],
+                                })
+                    response[name] = key
+                elif (column['type'] == 'many2one'
+                        and isinstance(value, basestring)
+                        and not value.isdigit()):
+                    record_id = lookups[name].get(value)
+                    if record_id is None:
+                        self.raise_user_error('unknown_record', {
+                                'value': value,
+                                'field': column['kwargs']['string'],
+                                })
+                    response[name] = record_id
+                else:
+                    response[name] = value
+            responses.append(response)
+        return responses
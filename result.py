@@ -0,0 +1,785 @@
+#!/usr/bin/env python
+# This file is part of the survey module for Tryton.
+# The COPYRIGHT file at the top level of this repository contains the full
+# copyright notices and license terms.
+from trytond.model import ModelSQL, ModelView, fields
+from trytond.pool import Pool
+from trytond.pyson import Eval
+from trytond.transaction import Transaction
+from trytond.tools import reduce_ids, grouped_slice
+from trytond import backend
+from sql import Table, Column, Literal, Null, Window, Union, Cast
+from sql.aggregate import Count, Min, Max, Avg, Sum
+from sql.functions import RowNumber, DateTrunc, CurrentTimestamp
+from sql.operators import Or, Equal, NotEqual, Less, LessEqual, Greater, \
+    GreaterEqual, In, NotIn, Like, ILike
+from collections import OrderedDict
+from decimal import Decimal
+import datetime
+
+from .survey import field_name
+
+__all__ = ['SurveyResultContext', 'SurveyResult', 'SurveyCrossContext',
+    'SurveyCross', 'SurveySummary']
+
+DISTRIBUTION_TYPES = ('boolean', 'selection', 'many2one')
+NUMERIC_TYPES = ('integer', 'float', 'numeric')
+DATE_TYPES = ('date', 'datetime')
+_OPERATORS = {
+    '=': Equal,
+    '!=': NotEqual,
+    '<': Less,
+    '<=': LessEqual,
+    '>': Greater,
+    '>=': GreaterEqual,
+    'in': In,
+    'not in': NotIn,
+    'like': Like,
+    'ilike': ILike,
+    }
+
+
+class SurveyResultContext(ModelView):
+    'Survey Result Context'
+    __name__ = 'survey.result.context'
+    survey = fields.Many2One('survey.survey', 'Survey', required=True)
+    group_field = fields.Many2One('survey.field', 'Group By',
+        domain=[
+            ('survey', '=', Eval('survey')),
+            ], depends=['survey'])
+
+
+class SurveyResult(ModelSQL, ModelView):
+    'Survey Result'
+    __name__ = 'survey.result'
+    field = fields.Char('Field')
+    value = fields.Char('Value')
+    group_value = fields.Char('Group')
+    count = fields.Integer('Count')
+
+    @classmethod
+    def __setup__(cls):
+        super(SurveyResult, cls).__setup__()
+        cls._order = [
+            ('field', 'ASC'),
+            ('group_value', 'ASC'),
+            ('count', 'DESC'),
+            ]
+        cls._error_messages.update({
+                'invalid_interval': 'The interval "%s" is not supported.',
+                'shared_survey': 'The statistics of survey "%s" can not be '
+                    'computed because its responses are shared, use its '
+                    'live summary instead.',
+                })
+
+    @classmethod
+    def table_query(cls):
+        'Return the distribution of the choice fields of the context survey'
+        pool = Pool()
+        DynamicModel = pool.get('DynamicModel')
+        SurveyField = pool.get('survey.field')
+        TableHandler = backend.get('TableHandler')
+        context = Transaction().context
+        sql_type = cls.value.sql_type().base
+
+        survey_id = context.get('survey')
+        queries = []
+        if survey_id and TableHandler.table_exist('survey_%s' % survey_id):
+            table = Table('survey_%s' % survey_id)
+            group = Literal(None)
+            group_by = []
+            if context.get('group_field'):
+                group = Column(table,
+                    field_name(SurveyField(context['group_field']).name))
+                group_by = [group]
+            definitions = DynamicModel.load_schemas([survey_id]).get(
+                survey_id, [])
+            for definition in definitions:
+                if definition['type'] not in DISTRIBUTION_TYPES:
+                    continue
+                column = Column(table, definition['name'])
+                queries.append(table.select(
+                        Literal(definition['name']).as_('field'),
+                        Cast(column, sql_type).as_('value'),
+                        Cast(group, sql_type).as_('group_value'),
+                        Count(Literal('*')).as_('count'),
+                        group_by=group_by + [column]))
+        if not queries:
+            survey = Table('survey_survey')
+            queries.append(survey.select(
+                    Cast(Literal(None), sql_type).as_('field'),
+                    Cast(Literal(None), sql_type).as_('value'),
+                    Cast(Literal(None), sql_type).as_('group_value'),
+                    Literal(0).as_('count'),
+                    where=Literal(False)))
+        if len(queries) > 1:
+            query = Union(*queries, **{'all_': True})
+        else:
+            query = queries[0]
+        return query.select(
+            RowNumber(window=Window([], order_by=[
+                        query.field, query.group_value, query.value])
+                ).as_('id'),
+            Literal(0).as_('create_uid'),
+            CurrentTimestamp().as_('create_date'),
+            Literal(None).as_('write_uid'),
+            Literal(None).as_('write_date'),
+            query.field,
+            query.value,
+            query.group_value,
+            query.count)
+
+    @classmethod
+    def compute(cls, survey, names=None, group_by=None,
+            percentiles=(25, 50, 75), interval='month'):
+        '''Return a dict of field name and its statistics
+        The statistics are computed by the database which only returns the
+        aggregated rows:
+            - boolean, selection and many2one: count and distribution
+            - integer, float and numeric: count, min, max, mean, sum and
+              percentiles (nearest rank)
+            - date and datetime: count, min, max and histogram by interval
+        :param survey: obj
+        :param names: list of field names or None for all fields
+        :param group_by: field name, the statistics become a dict of group
+            value and statistics
+        :param percentiles: integers between 1 and 100
+        :param interval: day, month or year of the histograms
+        '''
+        pool = Pool()
+        DynamicModel = pool.get('DynamicModel')
+        if interval not in ('day', 'month', 'year'):
+            cls.raise_user_error('invalid_interval', (interval,))
+        if survey.storage == 'shared':
+            cls.raise_user_error('shared_survey', (survey.rec_name,))
+
+        table = Table('survey_%s' % survey.id)
+        groups = [Column(table, group_by)] if group_by else []
+        result = {}
+        for definition in DynamicModel.load_schemas([survey.id]).get(
+                survey.id, []):
+            name = definition['name']
+            if (names is not None and name not in names) or name == group_by:
+                continue
+            column = Column(table, name)
+            if definition['type'] in DISTRIBUTION_TYPES:
+                statistics = cls._distribution(table, column, groups)
+            elif definition['type'] in NUMERIC_TYPES:
+                statistics = cls._numeric(table, column, groups, percentiles)
+            elif definition['type'] in DATE_TYPES:
+                statistics = cls._histogram(table, column, groups, interval,
+                    definition['type'])
+            else:
+                continue
+            if not group_by:
+                statistics = statistics.get(None, cls._empty_statistics(
+                        definition['type']))
+            result[name] = statistics
+        return result
+
+    @staticmethod
+    def _empty_statistics(type_):
+        if type_ in DISTRIBUTION_TYPES:
+            return {'count': 0, 'distribution': {}}
+        elif type_ in NUMERIC_TYPES:
+            return {
+                'count': 0,
+                'min': None,
+                'max': None,
+                'mean': None,
+                'sum': None,
+                'percentiles': {},
+                }
+        return {'count': 0, 'min': None, 'max': None, 'histogram': []}
+
+    @classmethod
+    def _distribution(cls, table, column, groups):
+        cursor = Transaction().connection.cursor()
+        cursor.execute(*table.select(*(groups + [column,
+                        Count(Literal('*'))]),
+                group_by=groups + [column]))
+        result = {}
+        for row in cursor.fetchall():
+            group = row[0] if groups else None
+            value, count = row[-2:]
+            statistics = result.setdefault(group,
+                cls._empty_statistics('selection'))
+            statistics['count'] += count
+            statistics['distribution'][value] = count
+        return result
+
+    @classmethod
+    def _numeric(cls, table, column, groups, percentiles):
+        cursor = Transaction().connection.cursor()
+        cursor.execute(*table.select(*(groups + [
+                        Count(column), Min(column), Max(column),
+                        Avg(column), Sum(column)]),
+                where=column != Null,
+                group_by=groups or None))
+        result = {}
+        for row in cursor.fetchall():
+            group = row[0] if groups else None
+            count, min_, max_, mean, sum_ = row[-5:]
+            result[group] = {
+                'count': count,
+                'min': min_,
+                'max': max_,
+                'mean': mean,
+                'sum': sum_,
+                'percentiles': {},
+                }
+        if not percentiles or not result:
+            return result
+
+        # Rank the values of each group and only return the ranks of the
+        # percentiles
+        ranked = table.select(*([g.as_('group_value') for g in groups] + [
+                    column.as_('value'),
+                    RowNumber(window=Window(groups,
+                            order_by=[column.asc])).as_('rank'),
+                    Count(Literal('*'), window=Window(groups)).as_('total'),
+                    ]),
+            where=column != Null)
+        cursor.execute(*ranked.select(
+                *([ranked.group_value] if groups else []) + [
+                    ranked.value, ranked.rank, ranked.total],
+                where=Or([ranked.rank == (ranked.total * p + 99) / 100
+                        for p in percentiles])))
+        for row in cursor.fetchall():
+            group = row[0] if groups else None
+            value, rank, total = row[-3:]
+            for percentile in percentiles:
+                if rank == (total * percentile + 99) // 100:
+                    result[group]['percentiles'][percentile] = value
+        return result
+
+    @classmethod
+    def _histogram(cls, table, column, groups, interval, type_):
+        cursor = Transaction().connection.cursor()
+        cursor.execute(*table.select(*(groups + [
+                        Count(column), Min(column), Max(column)]),
+                where=column != Null,
+                group_by=groups or None))
+        result = {}
+        for row in cursor.fetchall():
+            group = row[0] if groups else None
+            count, min_, max_ = row[-3:]
+            result[group] = {
+                'count': count,
+                'min': _parse_date(min_, type_),
+                'max': _parse_date(max_, type_),
+                'histogram': [],
+                }
+
+        period = DateTrunc(interval, column)
+        cursor.execute(*table.select(*(groups + [period,
+                        Count(Literal('*'))]),
+                where=column != Null,
+                group_by=groups + [period],
+                order_by=groups + [period]))
+        for row in cursor.fetchall():
+            group = row[0] if groups else None
+            value, count = row[-2:]
+            result[group]['histogram'].append(
+                (_parse_date(value, type_), count))
+        return result
+
+
+class SurveyCrossContext(ModelView):
+    'Survey Cross Context'
+    __name__ = 'survey.cross.context'
+    surveys = fields.Many2Many('survey.survey', None, None, 'Surveys',
+        domain=[
+            ('storage', '=', 'table'),
+            ])
+    field = fields.Char('Field',
+        help='Name of a field of the same type in all the surveys.')
+
+
+class SurveyCross(ModelSQL, ModelView):
+    'Survey Cross Response'
+    __name__ = 'survey.cross'
+    survey = fields.Many2One('survey.survey', 'Survey')
+    response = fields.Integer('Response')
+    value = fields.Char('Value')
+    number = fields.Numeric('Number')
+
+    @classmethod
+    def __setup__(cls):
+        super(SurveyCross, cls).__setup__()
+        cls._order = [
+            ('survey', 'ASC'),
+            ('response', 'ASC'),
+            ]
+        cls._error_messages.update({
+                'uncommon_field': 'The field "%(field)s" does not have the '
+                    'same type in all the surveys.',
+                'invalid_operator': 'The operator "%s" is not supported.',
+                'shared_survey': 'The responses of survey "%s" can not be '
+                    'queried with the other surveys because they are '
+                    'shared.',
+                })
+
+    @classmethod
+    def table_query(cls):
+        '''Return the values of the context field in the responses of the
+        context surveys
+        '''
+        pool = Pool()
+        Survey = pool.get('survey.survey')
+        context = Transaction().context
+        sql_type = cls.value.sql_type().base
+        number_type = cls.number.sql_type().base
+
+        surveys = Survey.browse(context.get('surveys') or [])
+        name = context.get('field')
+        types = cls.common_fields(surveys)
+        if name in types:
+            query = cls.union(surveys, [name])
+            value = Column(query, name)
+            if types[name] in NUMERIC_TYPES:
+                number = Cast(value, number_type)
+            else:
+                number = Cast(Literal(None), number_type)
+            value = Cast(value, sql_type)
+            response = query.id
+        else:
+            query = Table('survey_survey')
+            value = Cast(Literal(None), sql_type)
+            number = Cast(Literal(None), number_type)
+            response = Literal(None)
+            query = query.select(
+                Literal(None).as_('survey'),
+                Literal(None).as_('id'),
+                Literal(None).as_('create_date'),
+                where=Literal(False))
+        return query.select(
+            RowNumber(window=Window([], order_by=[
+                        query.survey, query.id])).as_('id'),
+            Literal(0).as_('create_uid'),
+            query.create_date,
+            Literal(None).as_('write_uid'),
+            Literal(None).as_('write_date'),
+            query.survey,
+            response.as_('response'),
+            value.as_('value'),
+            number.as_('number'))
+
+    @classmethod
+    def common_fields(cls, surveys):
+        '''Return an ordered dict of the field names with the same type in
+        all the surveys and their type
+        '''
+        DynamicModel = Pool().get('DynamicModel')
+        schemas = DynamicModel.load_schemas([s.id for s in surveys])
+        common = None
+        for survey in surveys:
+            types = OrderedDict((d['name'], d['type'])
+                for d in schemas.get(survey.id, []))
+            if common is None:
+                common = types
+            else:
+                common = OrderedDict((n, t) for n, t in common.iteritems()
+                    if types.get(n) == t)
+        return common or OrderedDict()
+
+    @classmethod
+    def union(cls, surveys, names):
+        '''Return the UNION ALL of the responses of the surveys
+        The columns are survey, id, create_date and the field names.
+        The surveys without table are skipped.
+        '''
+        pool = Pool()
+        Survey = pool.get('survey.survey')
+        common = cls.common_fields(surveys)
+        for name in names:
+            if name not in common:
+                cls.raise_user_error('uncommon_field', {
+                        'field': name,
+                        })
+        queries = []
+        for survey in surveys:
+            if survey.storage == 'shared':
+                cls.raise_user_error('shared_survey', (survey.rec_name,))
+            if Survey.table_columns(survey.id) is None:
+                continue
+            table = Table('survey_%s' % survey.id)
+            queries.append(table.select(
+                    Literal(survey.id).as_('survey'),
+                    table.id,
+                    table.create_date,
+                    *[Column(table, n).as_(n) for n in names]))
+        if not queries:
+            table = Table('survey_survey')
+            queries.append(table.select(
+                    Literal(None).as_('survey'),
+                    Literal(None).as_('id'),
+                    Literal(None).as_('create_date'),
+                    *[Literal(None).as_(n) for n in names],
+                    where=Literal(False)))
+        if len(queries) > 1:
+            return Union(*queries, **{'all_': True})
+        return queries[0]
+
+    @classmethod
+    def _where(cls, query, domain):
+        'Return the condition of the domain on the query columns'
+        condition = Literal(True)
+        for name, operator, value in domain or []:
+            if operator not in _OPERATORS:
+                cls.raise_user_error('invalid_operator', (operator,))
+            if operator in ('in', 'not in') and not value:
+                condition &= Literal(operator == 'not in')
+                continue
+            condition &= _OPERATORS[operator](Column(query, name), value)
+        return condition
+
+    @classmethod
+    def _columns(cls, domain, order=None, group_by=None):
+        'Return the field names used by the domain, order and group by'
+        names = [d[0] for d in domain or []]
+        names += [o[0] for o in order or []]
+        names += list(group_by or [])
+        return [n for n in names if n not in ('survey', 'id', 'create_date')]
+
+    @classmethod
+    def search_responses(cls, surveys, names, domain=None, order=None,
+            offset=0, limit=None):
+        '''Return the responses of the surveys as dicts of survey, id,
+        create_date and the field names
+        The filter, the order and the pagination run in the database.
+        :param domain: list of (name, operator, value) combined with AND
+        :param order: list of (name, 'ASC' or 'DESC')
+        '''
+        cursor = Transaction().connection.cursor()
+        union = cls.union(surveys, list(OrderedDict.fromkeys(
+                    list(names) + cls._columns(domain, order))))
+        columns = ['survey', 'id', 'create_date'] + list(names)
+        order_by = []
+        for name, direction in order or [('survey', 'ASC'), ('id', 'ASC')]:
+            column = Column(union, name)
+            order_by.append(
+                column.desc if direction.upper() == 'DESC' else column.asc)
+        cursor.execute(*union.select(
+                *[Column(union, c) for c in columns],
+                where=cls._where(union, domain), order_by=order_by,
+                offset=offset or None, limit=limit))
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    @classmethod
+    def aggregate(cls, surveys, names, group_by=('survey',), domain=None):
+        '''Return the statistics of the fields for each group as dicts of
+        the group by values, the number of responses and the count, min,
+        max, mean and sum of each field
+        Only the aggregated rows are returned by the database.
+        :param group_by: list of names among survey and the fields
+        :param domain: list of (name, operator, value) combined with AND
+        '''
+        cursor = Transaction().connection.cursor()
+        union = cls.union(surveys, list(OrderedDict.fromkeys(
+                    list(names) + cls._columns(domain, group_by=group_by))))
+        groups = [Column(union, g) for g in group_by]
+        aggregates = [Count(Literal('*'))]
+        for name in names:
+            column = Column(union, name)
+            aggregates += [Count(column), Min(column), Max(column),
+                Avg(column), Sum(column)]
+        cursor.execute(*union.select(*(groups + aggregates),
+                where=cls._where(union, domain),
+                group_by=groups or None, order_by=groups or None))
+        result = []
+        for row in cursor.fetchall():
+            values = dict(zip(group_by, row))
+            row = row[len(groups):]
+            values['count'] = row[0]
+            for i, name in enumerate(names):
+                count, min_, max_, mean, sum_ = row[1 + 5 * i:6 + 5 * i]
+                values[name] = {
+                    'count': count,
+                    'min': min_,
+                    'max': max_,
+                    'mean': mean,
+                    'sum': sum_,
+                    }
+            result.append(values)
+        return result
+
+
+class SurveySummary(ModelSQL):
+    'Survey Summary'
+    __name__ = 'survey.summary'
+    survey = fields.Many2One('survey.survey', 'Survey', required=True,
+        ondelete='CASCADE', select=True)
+    field = fields.Char('Field', required=True)
+    key = fields.Char('Key')
+    count = fields.Integer('Count', required=True)
+    total = fields.Numeric('Total')
+
+    @staticmethod
+    def default_count():
+        return 0
+
+    @classmethod
+    def __register__(cls, module_name):
+        super(SurveySummary, cls).__register__(module_name)
+        cursor = Transaction().connection.cursor()
+        table = cls.__table__()
+
+        # Merge the rows created by concurrent first increments
+        cursor.execute(*table.select(table.survey, table.field, table.key,
+                Min(table.id), Sum(table.count), Sum(table.total),
+                group_by=[table.survey, table.field, table.key],
+                having=Count(table.id) > 1))
+        for survey, field, key, id_, count, total in cursor.fetchall():
+            cursor.execute(*table.update([table.count, table.total],
+                    [count, total], where=table.id == id_))
+            cursor.execute(*table.delete(
+                    where=(table.survey == survey) & (table.field == field)
+                    & (table.key == key) & (table.id != id_)))
+        # The null keys must be unique too
+        cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS '
+            '"survey_summary_key_uniq" ON "survey_summary" '
+            '(survey, field, COALESCE(key, \'\'))')
+
+    @classmethod
+    def summarized(cls, survey_id):
+        'Return True if the summary of the survey is maintained'
+        Survey = Pool().get('survey.survey')
+        return bool(Survey(survey_id).summary)
+
+    @classmethod
+    def get_summary(cls, survey):
+        '''Return the live summary of the survey
+        Only the summary rows are read so the time does not depend on the
+        number of responses:
+            - responses: number of responses
+            - days: dict of creation day and number of responses
+            - boolean, selection and many2one fields: count and distribution
+            - integer, float and numeric fields: count, sum and mean
+        '''
+        pool = Pool()
+        DynamicModel = pool.get('DynamicModel')
+        cursor = Transaction().connection.cursor()
+        table = cls.__table__()
+
+        definitions = dict((d['name'], d) for d in DynamicModel.load_schemas(
+                [survey.id]).get(survey.id, []))
+        result = {'responses': 0, 'days': {}}
+        for name, definition in definitions.iteritems():
+            if definition['type'] in DISTRIBUTION_TYPES:
+                result[name] = {'count': 0, 'distribution': {}}
+            elif definition['type'] in NUMERIC_TYPES:
+                result[name] = {'count': 0, 'sum': None, 'mean': None}
+        cursor.execute(*table.select(table.field, table.key, table.count,
+                table.total,
+                where=(table.survey == survey.id) & (table.count != 0)))
+        for field, key, count, total in cursor.fetchall():
+            if field == '_responses':
+                day = _parse_date(key, 'date')
+                result['responses'] += count
+                result['days'][day] = result['days'].get(day, 0) + count
+                continue
+            definition = definitions.get(field)
+            if definition is None:
+                # The field has been removed since the last rebuild
+                continue
+            statistics = result[field]
+            statistics['count'] += count
+            if definition['type'] in DISTRIBUTION_TYPES:
+                distribution = statistics['distribution']
+                key = _parse_key(key, definition['type'])
+                distribution[key] = distribution.get(key, 0) + count
+            else:
+                statistics['sum'] = ((statistics['sum'] or 0)
+                    + Decimal(str(total or 0)))
+                statistics['mean'] = statistics['sum'] / statistics['count']
+        return result
+
+    @classmethod
+    def count_responses(cls, survey_id):
+        'Return the number of responses of the survey from the summary'
+        cursor = Transaction().connection.cursor()
+        table = cls.__table__()
+        cursor.execute(*table.select(Sum(table.count),
+                where=(table.survey == survey_id)
+                & (table.field == '_responses')))
+        count, = cursor.fetchone()
+        return int(count or 0)
+
+    @classmethod
+    def add_responses(cls, survey_id, ids, sign=1):
+        '''Add to the summary the responses stored in the database
+        :param ids: list of response ids
+        :param sign: -1 to remove them from the summary
+        '''
+        pool = Pool()
+        DynamicModel = pool.get('DynamicModel')
+        Survey = pool.get('survey.survey')
+        SurveyResponse = pool.get('survey.response')
+        cursor = Transaction().connection.cursor()
+
+        if not ids or not cls.summarized(survey_id):
+            return
+        definitions = DynamicModel.load_schemas([survey_id]).get(
+            survey_id, [])
+        keys = ['id', 'create_date'] + [d['name'] for d in definitions]
+        shared = Survey(survey_id).storage == 'shared'
+        if shared:
+            table = SurveyResponse.__table__()
+            columns = [table.id, table.create_date, table.answers]
+        else:
+            table = Table('survey_%s' % survey_id)
+            columns = [Column(table, k) for k in keys]
+        deltas = {}
+        for sub_ids in grouped_slice(ids):
+            cursor.execute(*table.select(*columns,
+                    where=reduce_ids(table.id, sub_ids)))
+            if shared:
+                responses = SurveyResponse.answers_responses(keys,
+                    cursor.fetchall())
+            else:
+                responses = (dict(zip(keys, r)) for r in cursor.fetchall())
+            cls.get_deltas(definitions, responses, sign, deltas)
+        cls.apply_deltas(survey_id, deltas)
+
+    @classmethod
+    def get_deltas(cls, definitions, responses, sign=1, deltas=None):
+        '''Return a dict of (field, key) and [count, total] increments
+        :param responses: iterable of dicts of column name and value
+        '''
+        if deltas is None:
+            deltas = {}
+
+        def add(field, key, total=None):
+            delta = deltas.setdefault((field, key), [0, None])
+            delta[0] += sign
+            if total is not None:
+                delta[1] = (delta[1] or 0) + sign * Decimal(str(total))
+
+        for response in responses:
+            create_date = _parse_date(response.get('create_date'),
+                'date')
+            add('_responses', create_date.isoformat()
+                if create_date else None)
+            for definition in definitions:
+                name = definition['name']
+                value = response.get(name)
+                if definition['type'] in DISTRIBUTION_TYPES:
+                    add(name, _format_key(value, definition['type']))
+                elif (definition['type'] in NUMERIC_TYPES
+                        and value is not None):
+                    add(name, None, value)
+        return deltas
+
+    @classmethod
+    def apply_deltas(cls, survey_id, deltas):
+        '''Increment the summary rows of the survey
+        The rows are inserted or incremented by one statement so concurrent
+        first increments are added to the same row.
+        '''
+        transaction = Transaction()
+        cursor = transaction.connection.cursor()
+        param = '?' if backend.name() == 'sqlite' else '%s'
+        query = ('INSERT INTO "survey_summary" '
+            '(create_date, create_uid, survey, field, key, count, total) '
+            'VALUES (%s) '
+            'ON CONFLICT (survey, field, COALESCE(key, \'\')) DO UPDATE '
+            'SET count = "survey_summary".count + EXCLUDED.count, '
+            'total = COALESCE("survey_summary".total, 0) '
+            '+ COALESCE(EXCLUDED.total, 0)' % ', '.join([param] * 7))
+        now = datetime.datetime.now()
+        for (field, key), (count, total) in deltas.iteritems():
+            if not count and not total:
+                continue
+            cursor.execute(query, (now, transaction.user, survey_id, field,
+                    key, count, total))
+
+    @classmethod
+    def rebuild(cls, surveys):
+        'Recompute from scratch the summary of the surveys'
+        pool = Pool()
+        DynamicModel = pool.get('DynamicModel')
+        Survey = pool.get('survey.survey')
+        TableHandler = backend.get('TableHandler')
+        cursor = Transaction().connection.cursor()
+        summary = cls.__table__()
+
+        for survey in surveys:
+            cursor.execute(*summary.delete(
+                    where=summary.survey == survey.id))
+            if not survey.summary:
+                continue
+            if survey.storage == 'shared':
+                # The answers can not be grouped by the database
+                definitions = DynamicModel.load_schemas(
+                    [survey.id]).get(survey.id, [])
+                deltas = {}
+                for responses in Survey.read_data(survey, labels=False):
+                    cls.get_deltas(definitions, responses, 1, deltas)
+                cls.apply_deltas(survey.id, deltas)
+                continue
+            if not TableHandler.table_exist('survey_%s' % survey.id):
+                continue
+            table = Table('survey_%s' % survey.id)
+            deltas = {}
+
+            day = DateTrunc('day', table.create_date)
+            cursor.execute(*table.select(day, Count(Literal('*')),
+                    group_by=[day]))
+            for value, count in cursor.fetchall():
+                value = _parse_date(value, 'date')
+                deltas[('_responses', value.isoformat()
+                        if value else None)] = [count, None]
+            for definition in DynamicModel.load_schemas(
+                    [survey.id]).get(survey.id, []):
+                name = definition['name']
+                column = Column(table, name)
+                if definition['type'] in DISTRIBUTION_TYPES:
+                    cursor.execute(*table.select(column,
+                            Count(Literal('*')), group_by=[column]))
+                    for value, count in cursor.fetchall():
+                        key = _format_key(value, definition['type'])
+                        deltas[(name, key)] = [count, None]
+                elif definition['type'] in NUMERIC_TYPES:
+                    cursor.execute(*table.select(Count(column),
+                            Sum(column)))
+                    count, total = cursor.fetchone()
+                    if count:
+                        deltas[(name, None)] = [count,
+                            Decimal(str(total))]
+            cls.apply_deltas(survey.id, deltas)
+
+
+def _format_key(value, type_):
+    'Return the summary key of a value'
+    if value is None:
+        return None
+    if type_ == 'boolean':
+        return 'true' if value else 'false'
+    return unicode(value)
+
+
+def _parse_key(key, type_):
+    'Return the value of a summary key'
+    if key is None:
+        return None
+    if type_ == 'boolean':
+        return key == 'true'
+    elif type_ == 'many2one':
+        return int(key)
+    return key
+
+
+def _parse_date(value, type_):
+    'Return the date or datetime of a value returned by the database'
+    if isinstance(value, basestring):
+        for format_ in ('%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S',
+                '%Y-%m-%d'):
+            try:
+                value = datetime.datetime.strptime(value, format_)
+                break
+            except ValueError:
+                continue
+    if type_ == 'date' and isinstance(value, datetime.datetime):
+        value = value.date()
+    return value
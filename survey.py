@@ -4,19 +4,51 @@
 # copyright notices and license terms.
 from trytond.model import ModelSingleton, ModelSQL, ModelStorage, ModelView, \
     DictSchemaMixin, fields, Unique
+from trytond.model.modelstorage import cache_size
+from trytond.model.modelsql import convert_from
 from trytond.pool import Pool, PoolMeta
-from trytond.tools import cursor_dict
-from trytond.pyson import Eval
+from trytond.tools import cursor_dict, reduce_ids, grouped_slice
+from trytond.pyson import Eval, Bool, PYSONEncoder
 from trytond.transaction import Transaction
+from trytond.config import config
+from trytond.cache import Cache, LRUDict, LRUDictTransaction
+from trytond import backend
+from sql import Table, Column, Literal, Null, Cast
+from sql.aggregate import Max
+from sql.conditionals import Coalesce
+from sql.functions import CurrentTimestamp
+from collections import OrderedDict
+from decimal import Decimal, InvalidOperation
+from StringIO import StringIO
+from itertools import islice
+import csv
+import datetime
 import re
+import json
 import unicodedata
+import hashlib
+import logging
 import os
+import threading
 
+from .instrument import phase
 
-__all__ = ['Configuration', 'Survey', 'SurveyField', 'View', 'Menu',
-    'ActWindow', 'DynamicModel']
+
+__all__ = ['Configuration', 'Survey', 'SurveyField', 'SurveyIndex', 'View',
+    'Menu', 'ActWindow', 'DynamicModel']
+logger = logging.getLogger(__name__)
 _slugify_strip_re = re.compile(r'[^\w\s-]')
 _slugify_underscore_re = re.compile(r'[-\s]+')
+_survey_model_re = re.compile(r'^survey\.[0-9]+$')
+_sql_type_re = re.compile(r'\([0-9, ]*\)')
+_partition_re = re.compile(r'^survey_[0-9]+_p([0-9]{8})$')
+_email_re = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s.]+$')
+_url_re = re.compile(r'^[a-z][a-z0-9+.-]*://[^\s/?#]+\S*$', re.I)
+# Format of the compiled schema snapshot
+_SCHEMA_FORMAT = 2
+# Seconds waited for the lock of a survey table altered by a migration
+_LOCK_TIMEOUT = 10
+_keysets_lock = threading.Lock()
 
 
 def remove_accents(value):
@@ -36,21 +68,514 @@ def slugify(value):
     return value
 
 
+def field_name(name):
+    'Return the column name of a survey field name'
+    return remove_accents('%s' % slugify(name))
+
+
+def convert_value(type_, value):
+    'Convert value to the python type of a survey field type'
+    if type_ == 'boolean':
+        if isinstance(value, basestring):
+            return value.strip().lower() in ('1', 't', 'true', 'y', 'yes')
+        return bool(value)
+    elif type_ in ('integer', 'many2one'):
+        if isinstance(value, float) and not value.is_integer():
+            raise ValueError
+        return int(value)
+    elif type_ == 'float':
+        return float(value)
+    elif type_ == 'numeric':
+        if isinstance(value, float):
+            value = repr(value)
+        return Decimal(value)
+    elif type_ == 'date':
+        if isinstance(value, datetime.datetime):
+            return value.date()
+        elif isinstance(value, datetime.date):
+            return value
+        return datetime.datetime.strptime(value.strip(), '%Y-%m-%d').date()
+    elif type_ == 'datetime':
+        if isinstance(value, datetime.datetime):
+            return value
+        elif isinstance(value, datetime.date):
+            return datetime.datetime.combine(value, datetime.time())
+        return datetime.datetime.strptime(
+            value.strip().replace('T', ' '), '%Y-%m-%d %H:%M:%S')
+    elif isinstance(value, str):
+        return value.decode('utf-8')
+    return unicode(value)
+
+
+def copy_format(value):
+    'Format value for the text format of PostgreSQL COPY'
+    if value is None:
+        return u'\\N'
+    elif isinstance(value, bool):
+        return u't' if value else u'f'
+    elif isinstance(value, datetime.datetime):
+        return value.isoformat(' ').decode('utf-8')
+    elif isinstance(value, datetime.date):
+        return value.isoformat().decode('utf-8')
+    elif isinstance(value, float):
+        # unicode keeps only 12 significant digits
+        return repr(value).decode('utf-8')
+    elif isinstance(value, str):
+        value = value.decode('utf-8')
+    value = unicode(value)
+    return (value.replace(u'\\', u'\\\\').replace(u'\t', u'\\t')
+        .replace(u'\n', u'\\n').replace(u'\r', u'\\r'))
+
+
+def json_default(value):
+    'Serialize the values that json does not support'
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    elif isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(repr(value))
+
+
+def csv_format(value):
+    'Format value for a CSV cell'
+    if value is None:
+        return ''
+    elif isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+
+class ResponseValidator(object):
+    '''Validate and convert batches of responses of a survey
+    It is compiled once from the field definitions of a schema version.
+    '''
+
+    def __init__(self, definitions):
+        self.names = [d['name'] for d in definitions]
+        self.columns = []
+        self.defaults = {}
+        for definition in definitions:
+            type_ = definition['type']
+            kwargs = definition['kwargs']
+            default = None
+            if definition.get('default') not in (None, ''):
+                try:
+                    default = convert_value(type_, definition['default'])
+                except (ValueError, TypeError, InvalidOperation):
+                    pass
+            if default is not None:
+                self.defaults[definition['name']] = default
+            keys = None
+            if type_ == 'selection':
+                keys = frozenset(k for k, _ in kwargs['selection']
+                    if k is not None)
+            pattern = None
+            if definition.get('email'):
+                pattern = ('email', _email_re)
+            elif definition.get('url'):
+                pattern = ('url', _url_re)
+            self.columns.append((definition['name'], type_,
+                    bool(kwargs.get('required')), default, keys, pattern))
+
+    def validate(self, responses, start=1):
+        '''Return the column values of the valid responses and the error
+        reports of the invalid ones
+        The missing values get their default. Each report is a dict of
+        response number, field name, value and error: unknown, missing,
+        invalid, email or url.
+        :param responses: list of dicts of field name and value
+        :param start: number of the first response
+        '''
+        errors = []
+        invalid = set()
+
+        def error(i, name, value, code):
+            errors.append({
+                    'response': start + i,
+                    'field': name,
+                    'value': value,
+                    'error': code,
+                    })
+            invalid.add(i)
+
+        known = set(self.names)
+        for i, response in enumerate(responses):
+            for name in response:
+                if name not in known:
+                    error(i, name, response[name], 'unknown')
+
+        # Convert column by column with the checks of the field
+        columns = []
+        for name, type_, required, default, keys, pattern in self.columns:
+            column = []
+            for i, value in enumerate(r.get(name) for r in responses):
+                if value == '' and type_ not in ('char', 'selection'):
+                    value = None
+                if value is None:
+                    value = default
+                if value is None:
+                    if required:
+                        error(i, name, value, 'missing')
+                    column.append(None)
+                    continue
+                try:
+                    converted = convert_value(type_, value)
+                    if keys is not None and converted not in keys:
+                        raise ValueError
+                except (ValueError, TypeError, InvalidOperation):
+                    error(i, name, value, 'invalid')
+                    column.append(None)
+                    continue
+                if pattern and not pattern[1].match(converted):
+                    error(i, name, value, pattern[0])
+                column.append(converted)
+            columns.append(column)
+
+        if columns:
+            rows = [list(r) for r in zip(*columns)]
+        else:
+            rows = [[] for _ in responses]
+        rows = [r for i, r in enumerate(rows) if i not in invalid]
+        errors.sort(key=lambda e: e['response'])
+        return rows, errors
+
+
+class SurveyResponseMixin(object):
+    '''Keep the live summary of the survey up to date and page the
+    responses without offset or exact count
+    '''
+    _survey_id = None
+    # Key of the record ending each page, per search, set on each model
+    _keysets = None
+
+    @classmethod
+    def read(cls, ids, fields_names=None):
+        '''Read the record names of the many2one fields with one read per
+        target model
+        '''
+        DynamicModel = Pool().get('DynamicModel')
+        related = dict((n, n.split('.')[0]) for n in fields_names or []
+            if n.count('.') == 1 and n.endswith('.rec_name')
+            and getattr(cls._fields.get(n.split('.')[0]), '_type', None)
+            == 'many2one')
+        if not related:
+            return super(SurveyResponseMixin, cls).read(ids,
+                fields_names=fields_names)
+        names = [n for n in fields_names if n not in related]
+        added = set(related.values()) - set(names)
+        rows = super(SurveyResponseMixin, cls).read(ids,
+            fields_names=names + list(added))
+        targets = {}
+        for fname in related.itervalues():
+            targets.setdefault(cls._fields[fname].model_name, set()).update(
+                r[fname] for r in rows if r[fname] is not None)
+        rec_names = DynamicModel.rec_names(targets)
+        for row in rows:
+            for name, fname in related.iteritems():
+                row[name] = rec_names.get(
+                    (cls._fields[fname].model_name, row[fname]))
+            for fname in added:
+                del row[fname]
+        return rows
+
+    @classmethod
+    def validate(cls, records):
+        super(SurveyResponseMixin, cls).validate(records)
+        pool = Pool()
+        DynamicModel = pool.get('DynamicModel')
+        Survey = pool.get('survey.survey')
+        validator = DynamicModel.get_validator(cls._survey_id)
+        rows = cls.read([r.id for r in records], validator.names)
+        _, errors = validator.validate([
+                dict((n, r[n]) for n in validator.names) for r in rows])
+        if errors:
+            Survey.response_error(Survey(cls._survey_id), errors[0])
+
+    @classmethod
+    def keyset_order(cls, order):
+        '''Return the field names and the direction of the order if it can
+        be paged by keys, otherwise None
+        The create_date order is completed by id to be unique.
+        '''
+        if order is None:
+            order = cls._order
+        names = [o[0] for o in order]
+        directions = set(o[1].upper() if o[1] else 'ASC' for o in order)
+        if (names not in (['id'], ['create_date'], ['create_date', 'id'])
+                or len(directions) != 1
+                or not directions <= {'ASC', 'DESC'}):
+            return None
+        if names == ['create_date']:
+            names.append('id')
+        return names, directions.pop() == 'DESC'
+
+    @classmethod
+    def keyset_domain(cls, order, key):
+        'Return the domain of the records following the key in the order'
+        names, descending = cls.keyset_order(order)
+        operator = '<' if descending else '>'
+        if names == ['id']:
+            return [('id', operator, key[0])]
+        create_date, id_ = key
+        return ['OR',
+            ('create_date', operator, create_date),
+            [
+                ('create_date', '=', create_date),
+                ('id', operator, id_),
+                ],
+            ]
+
+    @classmethod
+    def search_keyset(cls, domain, after=None, limit=None, order=None):
+        '''Return the records of the domain following the key of the last
+        record of the previous page and the key of the last record
+        :param after: (id,) or (create_date, id) depending on the order
+        '''
+        keyset = cls.keyset_order(order)
+        if keyset is None:
+            raise ValueError('Order can not be paged by keys: %r' % order)
+        names, descending = keyset
+        direction = 'DESC' if descending else 'ASC'
+        if after is not None:
+            domain = [domain, cls.keyset_domain(order, after)]
+        records = super(SurveyResponseMixin, cls).search(domain, limit=limit,
+            order=[(n, direction) for n in names])
+        key = None
+        if records:
+            key = tuple(getattr(records[-1], n) for n in names)
+        return records, key
+
+    @classmethod
+    def search(cls, domain, offset=0, limit=None, order=None, count=False,
+            query=False):
+        '''Search the next pages of the same search after the key of the
+        previous page instead of skipping an offset
+        '''
+        keyset = cls.keyset_order(order)
+        if count or query or not limit or keyset is None:
+            return super(SurveyResponseMixin, cls).search(domain,
+                offset=offset, limit=limit, order=order, count=count,
+                query=query)
+        transaction = Transaction()
+        # The records found depend on the context, like active_test
+        context = sorted((k, v) for k, v in transaction.context.iteritems()
+            if k not in ('_request', '_timestamp'))
+        search_key = (transaction.database.name, transaction.user,
+            repr(context), repr(domain), repr(order), limit)
+        after = None
+        if offset:
+            with _keysets_lock:
+                after = cls._keysets.get(search_key + (offset,))
+        if after is not None:
+            records, key = cls.search_keyset(domain, after=after,
+                limit=limit, order=order)
+        else:
+            records = super(SurveyResponseMixin, cls).search(domain,
+                offset=offset, limit=limit, order=order)
+            key = None
+            if records:
+                key = tuple(getattr(records[-1], n) for n in keyset[0])
+        if len(records) == limit and None not in key:
+            with _keysets_lock:
+                cls._keysets[search_key + (offset + limit,)] = key
+        return records
+
+    @classmethod
+    def clear_keysets(cls):
+        'Forget the keys of the pages as the records changed'
+        with _keysets_lock:
+            cls._keysets.clear()
+
+    @classmethod
+    def search_count(cls, domain):
+        '''Return the estimated number of records without domain when the
+        context has estimated_count, like the list view of the survey,
+        unless an exact count is requested by the context
+        '''
+        Rule = Pool().get('ir.rule')
+        context = Transaction().context
+        if (not domain and context.get('estimated_count')
+                and not context.get('exact_count')
+                and not Rule.domain_get(cls.__name__, mode='read')):
+            count = cls.estimated_count()
+            if count is not None:
+                return count
+        return super(SurveyResponseMixin, cls).search_count(domain)
+
+    @classmethod
+    def estimated_count(cls):
+        '''Return the number of responses from the live summary or from the
+        statistics of the PostgreSQL planner, None if not available
+        '''
+        Summary = Pool().get('survey.summary')
+        if Summary.summarized(cls._survey_id):
+            return Summary.count_responses(cls._survey_id)
+        if backend.name() != 'postgresql':
+            return None
+        cursor = Transaction().connection.cursor()
+        # The partitions hold the rows of a partitioned table
+        cursor.execute('SELECT SUM(GREATEST(c.reltuples, 0)) '
+            'FROM pg_class c '
+            'WHERE c.relname = %s '
+            'OR c.oid IN (SELECT i.inhrelid FROM pg_inherits i '
+                'JOIN pg_class p ON p.oid = i.inhparent '
+                'WHERE p.relname = %s)', (cls._table, cls._table))
+        count, = cursor.fetchone()
+        if not count:
+            # Never analyzed
+            return None
+        return int(count)
+
+    @classmethod
+    def create(cls, vlist):
+        Summary = Pool().get('survey.summary')
+        cls.clear_keysets()
+        if ('submission_key' in cls._fields
+                and any(v.get('submission_key') for v in vlist)):
+            return cls.create_submissions(vlist)
+        records = super(SurveyResponseMixin, cls).create(vlist)
+        Summary.add_responses(cls._survey_id, [r.id for r in records])
+        return records
+
+    @classmethod
+    def create_submissions(cls, vlist):
+        '''Create the responses ignoring those with a submission key already
+        stored, for which the stored response is returned
+        The responses are inserted by batch with multi-row INSERTs and the
+        conflicts are detected by the unique index without reading first.
+        '''
+        pool = Pool()
+        Rule = pool.get('ir.rule')
+        Summary = pool.get('survey.summary')
+        Survey = pool.get('survey.survey')
+        transaction = Transaction()
+        database = transaction.database
+        cursor = transaction.connection.cursor()
+        table = cls.__table__()
+
+        # Check the access like ModelSQL.create
+        super(ModelSQL, cls).create(vlist)
+
+        magic = ('create_uid', 'create_date', 'write_uid', 'write_date',
+            'id')
+        names = sorted(n for n, f in cls._fields.iteritems()
+            if n not in magic and not hasattr(f, 'set'))
+        missing = [n for n in cls._fields if n not in magic]
+        defaults = cls._clean_defaults(
+            cls.default_get(missing, with_rec_name=False))
+        columns = [table.create_uid, table.create_date]
+        columns += [Column(table, n) for n in names]
+        rows = []
+        for values in vlist:
+            values = dict(defaults, **values)
+            rows.append([transaction.user, CurrentTimestamp()]
+                + [cls._fields[n].sql_format(values.get(n)) for n in names])
+
+        if not database.has_multirow_insert():
+            batch_size = 1
+        elif backend.name() == 'sqlite':
+            # SQLite limits the number of parameters of a query
+            batch_size = 999 // len(columns)
+        else:
+            batch_size = cache_size()
+        new = []
+        for sub_rows in grouped_slice(rows, batch_size):
+            sub_rows = list(sub_rows)
+            if database.has_returning():
+                new += Survey._insert_ignore(table, columns, sub_rows,
+                    returning=[table.id, table.submission_key]).fetchall()
+            else:
+                # The inserted responses follow the last one
+                cursor.execute(*table.select(Max(table.id)))
+                last, = cursor.fetchone()
+                Survey._insert_ignore(table, columns, sub_rows)
+                cursor.execute(*table.select(table.id, table.submission_key,
+                        where=table.id > (last or 0)))
+                new += cursor.fetchall()
+        new.sort()
+        new_ids = [i for i, _ in new]
+
+        created = dict((k, i) for i, k in new if k is not None)
+        keyless = iter(i for i, k in new if k is None)
+        keys = [v.get('submission_key') or None for v in vlist]
+        stored = {}
+        for sub_keys in grouped_slice(
+                [k for k in set(keys) if k and k not in created]):
+            cursor.execute(*table.select(table.id, table.submission_key,
+                    where=table.submission_key.in_(list(sub_keys))))
+            stored.update((k, i) for i, k in cursor.fetchall())
+        # The stored response may not be visible yet to the transaction
+        ids = [created.get(k, stored.get(k)) if k else next(keyless)
+            for k in keys]
+
+        domain = Rule.domain_get(cls.__name__, mode='create')
+        if domain:
+            tables = {None: (table, None)}
+            tables, expression = cls.search_domain(domain,
+                active_test=False, tables=tables)
+            from_ = convert_from(None, tables)
+            for sub_ids in grouped_slice(new_ids):
+                sub_ids = list(sub_ids)
+                cursor.execute(*from_.select(table.id,
+                        where=reduce_ids(table.id, sub_ids) & expression))
+                if len(cursor.fetchall()) != len(sub_ids):
+                    cls.raise_user_error('access_error', cls.__name__)
+
+        transaction.create_records.setdefault(cls.__name__,
+            set()).update(new_ids)
+        new_records = cls.browse(new_ids)
+        for sub_records in grouped_slice(new_records, cache_size()):
+            cls._validate(sub_records)
+        cls.trigger_create(new_records)
+        Summary.add_responses(cls._survey_id, new_ids)
+        return cls.browse([i for i in ids if i is not None])
+
+    @classmethod
+    def write(cls, *args):
+        Summary = Pool().get('survey.summary')
+        ids = [r.id for r in sum(args[::2], [])]
+        Summary.add_responses(cls._survey_id, ids, sign=-1)
+        super(SurveyResponseMixin, cls).write(*args)
+        Summary.add_responses(cls._survey_id, ids)
+        cls.clear_keysets()
+
+    @classmethod
+    def delete(cls, records):
+        Summary = Pool().get('survey.summary')
+        Summary.add_responses(cls._survey_id, [r.id for r in records],
+            sign=-1)
+        super(SurveyResponseMixin, cls).delete(records)
+        cls.clear_keysets()
+
+
 class DynamicModel(ModelStorage):
     'Dynamic Model'
+    _schemas = {}
+    # Model of each survey per database
+    _models = {}
+    _fields_view_get_cache = Cache('survey.fields_view_get', context=False)
+    _model_versions_cache = Cache('survey.model_versions', context=False)
+    # Validator of each survey schema version
+    _validators = LRUDict(1024)
 
     @classmethod
     def __setup__(cls):
         pool = Pool()
-        if cls.module_survey_installed():
-            Survey = pool.get('survey.survey')
-            cursor = Transaction().connection.cursor()
-            survey = Survey.__table__()
-            cursor.execute(*survey.select(survey.id))
-            for survey_id in cursor.fetchall():
-                Class = cls.__create_class__(survey_id[0])
+        schemas = {}
+        models = cls._models[pool.database_name] = {}
+        # Lazy models are built on first access by get_model
+        if (not config.getboolean('survey', 'lazy_models', default=False)
+                and cls.module_survey_installed()):
+            versions = cls.model_versions()
+            schemas = cls.load_schemas(sorted(versions))
+            for survey_id, definitions in schemas.iteritems():
+                Class = cls.__create_class__(survey_id, definitions,
+                    versions.get(survey_id))
                 cls.__setup_class__(Class)
-            cls._fields = {}
+                pool.add(Class, type='model')
+                models[survey_id] = Class
+        cls._schemas[pool.database_name] = schemas
+        cls._fields = {}
         super(DynamicModel, cls).__setup__()
         cls._error_messages.update({
                 'context_has_not_any_survey': 'Context has not any survey '
@@ -60,121 +585,487 @@ class DynamicModel(ModelStorage):
     @classmethod
     def __post_setup__(cls):
         pool = Pool()
-        if cls.module_survey_installed():
-            Survey = pool.get('survey.survey')
-            cursor = Transaction().connection.cursor()
-            survey = Survey.__table__()
-            cursor.execute(*survey.select(survey.id))
-            for survey_id in cursor.fetchall():
-                Class = pool.get('survey.%s' % survey_id)
-                cls.__post_setup_class__(Class)
+        for survey_id in cls._schemas.get(pool.database_name, {}):
+            Class = cls._models[pool.database_name][survey_id]
+            cls.__post_setup_class__(Class)
         super(DynamicModel, cls).__post_setup__()
 
     @classmethod
     def __register__(cls, module_name):
         pool = Pool()
-        if cls.module_survey_installed():
-            Survey = pool.get('survey.survey')
-            cursor = Transaction().connection.cursor()
-            survey = Survey.__table__()
-            cursor.execute(*survey.select(survey.id))
-            for survey_id in cursor.fetchall():
-                Class = pool.get('survey.%s' % survey_id)
-                cls.__register_class__(Class, module_name)
+        survey_ids = cls._schemas.get(pool.database_name, {}).keys()
+        if config.getboolean('survey', 'lazy_models', default=False):
+            survey_ids = sorted(cls.model_versions())
+        for survey_id in survey_ids:
+            Class = cls.get_model(survey_id)
+            cls.__register_class__(Class, module_name)
         super(DynamicModel, cls).__register__(module_name)
 
+        if cls._schema_cache_available():
+            # Store the snapshots missing or of a previous format
+            cls.store_schemas([i for i, d in
+                    cls._read_snapshots().iteritems() if d is None])
+
     @classmethod
     def module_survey_installed(cls):
+        cursor = Transaction().connection.cursor()
+        module = Table('ir_module')
+        cursor.execute(*module.select(module.id,
+                where=(module.name == 'survey')
+                & (module.state == 'activated'),
+                limit=1))
+        return bool(cursor.fetchone())
+
+    @classmethod
+    def load_schemas(cls, survey_ids=None):
+        '''Return an ordered dict of survey id and its compiled fields
+        The snapshot stored on each survey is reused while it matches the
+        schema version of the survey. The other surveys are compiled again
+        from their field rows, nothing is written.
+        :param survey_ids: list of survey ids or None to load all surveys
+        '''
+        if survey_ids is not None and not survey_ids:
+            return OrderedDict()
+        if not cls._schema_cache_available():
+            # The module is being upgraded
+            return OrderedDict((survey_id, cls.compile_schema(rows))
+                for survey_id, rows in cls.load_field_rows(
+                    survey_ids).iteritems())
+
+        schemas = cls._read_snapshots(survey_ids)
+        stale = [i for i, d in schemas.iteritems() if d is None]
+        if stale:
+            field_rows = cls.load_field_rows(stale)
+            for survey_id in stale:
+                schemas[survey_id] = cls.compile_schema(
+                    field_rows.get(survey_id, []))
+        return schemas
+
+    @classmethod
+    def _read_snapshots(cls, survey_ids=None):
+        '''Return an ordered dict of survey id and the fields of its
+        snapshot or None if the snapshot is missing or stale'''
+        cursor = Transaction().connection.cursor()
+        survey = Table('survey_survey')
+
+        query = survey.select(survey.id, survey.schema_version,
+            survey.schema_cache, order_by=survey.id.asc)
+        if survey_ids is not None:
+            query.where = reduce_ids(survey.id, survey_ids)
+        cursor.execute(*query)
+
+        snapshots = OrderedDict()
+        for survey_id, version, cache in cursor.fetchall():
+            snapshot = json.loads(cache) if cache else None
+            if (snapshot and snapshot['version'] == (version or 0)
+                    and snapshot.get('format') == _SCHEMA_FORMAT):
+                snapshots[survey_id] = snapshot['fields']
+            else:
+                snapshots[survey_id] = None
+        return snapshots
+
+    @classmethod
+    def store_schemas(cls, survey_ids):
+        '''Compile and store the schema snapshot of the surveys at their
+        current schema version
+        It is called when the schema changes so that loading the schemas
+        never writes.
+        '''
+        cursor = Transaction().connection.cursor()
+        survey = Table('survey_survey')
+
+        survey_ids = sorted(survey_ids)
+        if not survey_ids or not cls._schema_cache_available():
+            return
+        versions = {}
+        for sub_ids in grouped_slice(survey_ids):
+            cursor.execute(*survey.select(survey.id, survey.schema_version,
+                    where=reduce_ids(survey.id, sub_ids)))
+            versions.update(cursor.fetchall())
+        field_rows = cls.load_field_rows(survey_ids)
+        # Update in id order to lock the rows always in the same order
+        for survey_id in sorted(versions):
+            snapshot = json.dumps({
+                    'format': _SCHEMA_FORMAT,
+                    'version': versions[survey_id] or 0,
+                    'fields': cls.compile_schema(
+                        field_rows.get(survey_id, [])),
+                    }, separators=(',', ':'))
+            cursor.execute(*survey.update(
+                    [survey.schema_cache], [snapshot],
+                    where=survey.id == survey_id))
+
+    @classmethod
+    def _schema_cache_available(cls):
+        return 'schema_cache' in cls._survey_columns()
+
+    @staticmethod
+    def _survey_columns():
+        cursor = Transaction().connection.cursor()
+        survey = Table('survey_survey')
+        cursor.execute(*survey.select(limit=0))
+        return [c[0] for c in cursor.description]
+
+    @classmethod
+    def model_versions(cls):
+        '''Return a dict of survey id and the version of its model
+        Only the surveys stored in their own table have a model. The dict is
+        cached and the cache is cleared in all the processes when a survey
+        model changes.
+        '''
+        versions = cls._model_versions_cache.get(None)
+        if versions is None:
+            versions = cls._load_model_versions()[0]
+        return versions
+
+    @classmethod
+    def submission_keys(cls):
+        '''Return the ids of the surveys whose responses have a submission
+        key
+        They are read and cached with the model versions.
+        '''
+        keys = cls._model_versions_cache.get('submission_keys')
+        if keys is None:
+            keys = cls._load_model_versions()[1]
+        return keys
+
+    @classmethod
+    def _load_model_versions(cls):
+        'Read and cache the model versions and the submission keys'
+        cursor = Transaction().connection.cursor()
+        survey = Table('survey_survey')
+        columns = cls._survey_columns()
+        where = None
+        # The columns are missing while the module is being upgraded
+        if 'model_version' in columns:
+            version = survey.model_version
+        else:
+            version = Literal(None)
+        if 'submission_key' in columns:
+            submission_key = survey.submission_key
+        else:
+            submission_key = Literal(False)
+        if 'storage' in columns:
+            where = (survey.storage != 'shared') | (survey.storage == Null)
+        cursor.execute(*survey.select(survey.id, version, submission_key,
+                where=where))
+        versions, keys = {}, set()
+        for survey_id, version, submission_key in cursor.fetchall():
+            versions[survey_id] = version or 0
+            if submission_key:
+                keys.add(survey_id)
+        cls._model_versions_cache.set(None, versions)
+        cls._model_versions_cache.set('submission_keys', keys)
+        return versions, keys
+
+    @classmethod
+    def load_field_rows(cls, survey_ids=None):
+        '''Return an ordered dict of survey id and its field rows
+        Surveys, fields and many2one target models are read in one query.
+        :param survey_ids: list of survey ids or None to load all surveys
+        '''
+        cursor = Transaction().connection.cursor()
+        survey = Table('survey_survey')
+        survey_field = Table('survey_field')
+        model = Table('ir_model')
+
+        query = survey.join(survey_field, 'LEFT',
+            condition=survey_field.survey == survey.id
+            ).join(model, 'LEFT',
+            condition=model.id == survey_field.target_model
+            ).select(
+                survey.id.as_('survey'),
+                survey_field.name,
+                survey_field.string,
+                survey_field.type_,
+                survey_field.required,
+                survey_field.help_,
+                survey_field.digits,
+                survey_field.selection,
+                survey_field.tree_view,
+                survey_field.email,
+                survey_field.url,
+                survey_field.default_value,
+                model.model.as_('model_name'),
+                order_by=[survey.id.asc, survey_field.sequence.asc,
+                    survey_field.id.asc])
+        if survey_ids is not None:
+            if not survey_ids:
+                return OrderedDict()
+            query.where = reduce_ids(survey.id, survey_ids)
+        cursor.execute(*query)
+
+        schemas = OrderedDict()
+        for row in cursor_dict(cursor):
+            rows = schemas.setdefault(row['survey'], [])
+            if row['name'] is not None:
+                rows.append(row)
+        return schemas
+
+    @classmethod
+    def compile_schema(cls, rows):
+        '''Return the serializable field definitions of the field rows
+        :param rows: field rows as returned by load_field_rows
+        '''
+        definitions = []
+        for field in rows:
+            name = field_name(field['name'])
+            kvargs = {'string': field['string']}
+            if field['required']:
+                kvargs['required'] = True
+            if field['help_']:
+                kvargs['help'] = field['help_']
+            if field['type_'] in ('float', 'numeric'):
+                kvargs['digits'] = (16, field['digits'])
+            elif field['type_'] == 'many2one':
+                kvargs['model_name'] = field['model_name']
+                kvargs['ondelete'] = 'SET NULL'
+            elif field['type_'] == 'selection':
+                kvargs['selection'] = [tuple([w.strip()
+                                for w in v.split(':', 1)])
+                        for v in field['selection'].splitlines() if v]
+                if not field['required']:
+                    kvargs['selection'].append((None, ''))
+            definitions.append({
+                    'name': name,
+                    'type': field['type_'],
+                    'tree_view': bool(field['tree_view']),
+                    'email': bool(field['email']),
+                    'url': bool(field['url']),
+                    'default': field['default_value'],
+                    'kwargs': kvargs,
+                    })
+        return definitions
+
+    @classmethod
+    def get_validator(cls, survey_id):
+        '''Return the validator of the responses of the survey
+        It is compiled once per schema version of the survey.
+        '''
+        transaction = Transaction()
+        cursor = transaction.connection.cursor()
+        survey = Table('survey_survey')
+        cursor.execute(*survey.select(survey.schema_version,
+                where=survey.id == survey_id))
+        row = cursor.fetchone()
+        key = (transaction.database.name, survey_id, row and row[0])
+        validator = cls._validators.get(key)
+        if validator is None:
+            validator = ResponseValidator(
+                cls.load_schemas([survey_id]).get(survey_id, []))
+            cls._validators[key] = validator
+        return validator
+
+    @classmethod
+    def rec_names(cls, targets):
+        '''Return a dict of (model name, id) and record name of the targets
+        with one read per target model
+        The names are kept in the cache of the transaction until a write.
+        :param targets: dict of model name and ids
+        '''
         pool = Pool()
-        Module = pool.get('ir.module')
-        return Module.search([
-                ('name', '=', 'survey'),
-                ('state', '=', 'installed'),
-                ])
+        transaction = Transaction()
+        cache = transaction.get_cache().setdefault('survey.rec_names',
+            LRUDictTransaction(cache_size()))
+        cache.refresh()
+        result = {}
+        for model_name, ids in targets.iteritems():
+            missing = []
+            for id_ in ids:
+                if (model_name, id_) in cache:
+                    result[(model_name, id_)] = cache[(model_name, id_)]
+                else:
+                    missing.append(id_)
+            if not missing:
+                continue
+            Target = pool.get(model_name)
+            # Missing or not readable records have no name
+            with transaction.set_context(active_test=False):
+                records = []
+                for sub_ids in grouped_slice(missing):
+                    records += Target.search([('id', 'in', list(sub_ids))])
+            for values in Target.read([r.id for r in records],
+                    ['rec_name']):
+                result[(model_name, values['id'])] = values['rec_name']
+            for id_ in missing:
+                cache[(model_name, id_)] = result.get((model_name, id_))
+        return result
 
     @classmethod
     def fields_view_get(cls, view_id=None, view_type='form'):
         pool = Pool()
         View = pool.get('ir.ui.view')
-        Survey = pool.get('survey.survey')
+        transaction = Transaction()
 
+        survey_id = None
         if not view_id:
-            context = Transaction().context
-            survey_id = context.get('survey', None)
+            survey_id = transaction.context.get('survey', None)
             if not survey_id:
                 cls.raise_user_error('context_has_not_any_survey')
-            view, = View.search([
-                    ('model', '=', 'survey.%s' % survey_id),
-                    ('type', '=', view_type),
-                    ], limit=1)
-        else:
-            view = View(view_id)
-        Model = pool.get(view.model)
-        survey = Survey(int(Model.__name__.split('.')[-1]))
+        # fields_get depends on the language and on the field access rights
+        key = (view_id, survey_id, view_type, transaction.language,
+            transaction.user)
+        result = cls._fields_view_get_cache.get(key)
+        if result is not None:
+            return result
 
-        result = {}
-        result['type'] = view_type
-        result['view_id'] = view_id
-        result['field_childs'] = None
-        exclude_fields = ('id', 'create_date', 'write_date', 'create_uid',
-            'write_uid')
-        fields = [f for f in survey.fields_ if f not in exclude_fields]
-        if view_type == 'tree':
-            xml = '<tree>\n' % survey.name
-            for field in fields:
-                if field.tree_view:
-                    xml += '<field name="%s"/>\n' % slugify(field.name)
-            xml += '</tree>\n'
-            result['arch'] = xml
-        elif view_type == 'form':
-            xml = '<form col="2" colspan="4">\n' % survey.name
-            for field in fields:
-                xml += '<label name="%s"/>\n' % slugify(field.name)
-                xml += '<field name="%s"/>\n' % slugify(field.name)
-            xml += '</form>\n'
-            result['arch'] = xml
-        else:
-            assert False
-        fields = [slugify(f.name) for f in fields]
-        result['fields'] = Model.fields_get(fields)
+        with phase('fields_view_get', survey_id):
+            if not view_id:
+                view, = View.search([
+                        ('model', '=', 'survey.%s' % survey_id),
+                        ('type', '=', view_type),
+                        ], limit=1)
+            else:
+                view = View(view_id)
+            survey_id = int(view.model.split('.')[-1])
+            # The model is built again if it changed in another process
+            Model = cls.get_model(survey_id)
+            definitions = cls.load_schemas([survey_id]).get(survey_id, [])
+
+            result = {}
+            result['model'] = Model.__name__
+            result['type'] = view_type
+            result['view_id'] = view_id
+            result['field_childs'] = None
+            exclude_fields = ('id', 'create_date', 'write_date', 'create_uid',
+                'write_uid')
+            names = [d['name'] for d in definitions
+                if d['name'] not in exclude_fields]
+            if view_type == 'tree':
+                tree_names = set(d['name'] for d in definitions
+                    if d['tree_view'])
+                xml = '<tree>\n'
+                for name in names:
+                    if name in tree_names:
+                        xml += '<field name="%s"/>\n' % name
+                xml += '</tree>\n'
+                result['arch'] = xml
+            elif view_type == 'form':
+                xml = '<form col="2" colspan="4">\n'
+                for name in names:
+                    xml += '<label name="%s"/>\n' % name
+                    xml += '<field name="%s"/>\n' % name
+                xml += '</form>\n'
+                result['arch'] = xml
+            else:
+                assert False
+            result['fields'] = Model.fields_get(names)
+        cls._fields_view_get_cache.set(key, result)
         return result
 
     @classmethod
-    def __create_class__(cls, survey_id):
+    def __create_class__(cls, survey_id, definitions=None, version=None):
         body = {
             '__doc__': 'Survey %s' % survey_id,
             '__name__': 'survey.%s' % survey_id,
+            '_survey_id': survey_id,
+            '_model_version': version,
+            '_keysets': LRUDict(1024),
             '_defaults': {},
             'fields_view_get': cls.fields_view_get,
             }
-        body.update(cls.get_fields(survey_id))
-        return type('survey.%s' % survey_id, (ModelSQL, ModelView), body)
+        with phase('create_class', survey_id):
+            if definitions is None:
+                with phase('load_schema', survey_id):
+                    definitions = cls.load_schemas([survey_id]).get(
+                        survey_id, [])
+            body.update(cls.get_fields(survey_id, definitions))
+            if survey_id in cls.submission_keys():
+                body['submission_key'] = fields.Char('Submission Key',
+                    readonly=True)
+            for name, default in ResponseValidator(
+                    definitions).defaults.iteritems():
+                body['default_%s' % name] = staticmethod(
+                    lambda default=default: default)
+            return type('survey.%s' % survey_id,
+                (SurveyResponseMixin, ModelSQL, ModelView), body)
 
     @classmethod
     def __setup_class__(cls, Class):
-        'Register class an return model'
-        Pool.register(Class, module='survey', type_='model')
-        super(Class, Class).__setup__()
+        with phase('setup', Class._survey_id):
+            Class.__setup__()
 
     @classmethod
     def __post_setup_class__(cls, Class):
-        super(Class, Class).__post_setup__()
+        with phase('post_setup', Class._survey_id):
+            Class.__post_setup__()
 
     @classmethod
     def __register_class__(cls, Class, module_name):
-        super(Class, Class).__register__(module_name)
+        with phase('register', Class._survey_id):
+            Class.__register__(module_name)
 
     @classmethod
-    def get_fields(cls, survey_id):
-        'Create field of new model'
+    def get_model(cls, survey_id):
+        '''Return the model of the survey
+        The model is built if it is not in the pool yet and built again if
+        its version changed, for example in another process. A KeyError is
+        raised for a deleted survey.
+        '''
         pool = Pool()
-        SurveyField = pool.get('survey.field')
-        Model = pool.get('ir.model')
+        models = cls._models.setdefault(pool.database_name, {})
 
-        cursor = Transaction().connection.cursor()
-        survey_field = SurveyField.__table__()
-        query = survey_field.select(where=(survey_field.survey == survey_id))
-        cursor.execute(*query)
+        def current():
+            Model = models.get(survey_id)
+            if Model is not None and Model._model_version == version:
+                return Model
+
+        version = cls.model_versions().get(survey_id)
+        Model = current()
+        if Model is not None:
+            return Model
+        with pool.lock:
+            Model = current()
+            if Model is not None:
+                return Model
+            if version is None:
+                models.pop(survey_id, None)
+                raise KeyError('survey.%s' % survey_id)
+            return cls.build_model(survey_id)
+
+    @classmethod
+    def build_model(cls, survey_id, definitions=None):
+        '''Build the model of the survey, setup it and add it to the pool
+        :param definitions: field definitions as returned by load_schemas
+        '''
+        pool = Pool()
+        if definitions is None:
+            definitions = cls.load_schemas([survey_id]).get(survey_id)
+            if definitions is None:
+                raise KeyError('survey.%s' % survey_id)
+        Class = cls.__create_class__(survey_id, definitions,
+            cls.model_versions().get(survey_id))
+        cls.__setup_class__(Class)
+        cls.__post_setup_class__(Class)
+        pool.add(Class, type='model')
+        cls._models.setdefault(pool.database_name, {})[survey_id] = Class
+        return Class
+
+    @classmethod
+    def remove_model(cls, survey_id):
+        '''Forget the model of the survey
+        It is built again by the next get_model.
+        '''
+        pool = Pool()
+        with pool.lock:
+            cls._models.get(pool.database_name, {}).pop(survey_id, None)
+
+    @classmethod
+    def clear_keysets(cls, survey_id):
+        'Forget the keys of the pages of the survey model if it is built'
+        Model = cls._models.get(Pool().database_name, {}).get(survey_id)
+        if Model is not None:
+            Model.clear_keysets()
+
+    @classmethod
+    def get_fields(cls, survey_id, definitions=None):
+        '''Create field of new model
+        :param definitions: field definitions as returned by load_schemas
+        '''
+        with phase('get_fields', survey_id):
+            if definitions is None:
+                definitions = cls.load_schemas([survey_id]).get(survey_id,
+                    [])
         field_type = {
             'boolean': fields.Boolean,
             'integer': fields.Integer,
@@ -188,32 +1079,45 @@ class DynamicModel(ModelStorage):
             }
         result = {}
 
-        for field in cursor_dict(cursor):
-            name = remove_accents('%s' % slugify(field['name']))
-            label = field['string']
-            kvargs = {'string': label}
-            if field['required']:
-                kvargs['required'] = True
-            if field['help_']:
-                kvargs['help'] = field['help_']
-            if field['type_'] in ('float', 'numeric'):
-                kvargs['digits'] = (16, field['digits'])
-            elif field['type_'] == 'many2one':
-                kvargs['model_name'] = Model(field['target_model']).model
-                kvargs['ondelete'] = 'SET NULL'
-            elif field['type_'] == 'selection':
-                kvargs['selection'] = [tuple([w.strip()
-                                for w in v.split(':', 1)])
-                        for v in field['selection'].splitlines() if v]
-                if not field['required']:
-                    kvargs['selection'].append((None, ''))
-            result[name] = field_type[field['type_']](**kvargs)
+        for definition in definitions:
+            kvargs = dict((str(k), v)
+                for k, v in definition['kwargs'].iteritems())
+            if 'digits' in kvargs:
+                kvargs['digits'] = tuple(kvargs['digits'])
+            if 'selection' in kvargs:
+                kvargs['selection'] = [tuple(v) for v in kvargs['selection']]
+            name = str(definition['name'])
+            result[name] = field_type[definition['type']](**kvargs)
         return result
 
 
 class Configuration(ModelSingleton, ModelSQL, ModelView):
     'Survey Configuration'
     __name__ = 'survey.configuration'
+    sequence_cache = fields.Integer('Sequence Cache', required=True,
+        domain=[('sequence_cache', '>=', 1)],
+        help='Number of ids of the responses preallocated by each '
+        'database session on PostgreSQL.\n'
+        'Higher values reduce the contention of concurrent inserts but '
+        'leave gaps in the ids.')
+    archive_path = fields.Char('Archive Path',
+        help='Directory on the server of the archive files of the '
+        'responses.')
+
+    @staticmethod
+    def default_sequence_cache():
+        return 1
+
+    @classmethod
+    def write(cls, *args):
+        Survey = Pool().get('survey.survey')
+        super(Configuration, cls).write(*args)
+        values = {}
+        for value in args[1::2]:
+            values.update(value)
+        if 'sequence_cache' in values:
+            with Transaction().set_context(active_test=False):
+                Survey.update_sequence_cache(Survey.search([]))
 
 
 class Survey(ModelSQL, ModelView):
@@ -223,12 +1127,82 @@ class Survey(ModelSQL, ModelView):
     code = fields.Char('Code')
     active = fields.Boolean('Active')
     fields_ = fields.One2Many('survey.field', 'survey', 'Fields')
+    indexes = fields.One2Many('survey.index', 'survey', 'Indexes')
     menus = fields.One2Many('ir.ui.menu', 'survey', 'Menus',
         readonly=True)
     action_windows = fields.One2Many('ir.action.act_window', 'survey',
         'Actions', readonly=True)
     views = fields.One2Many('ir.ui.view', 'survey', 'Views',
         readonly=True)
+    schema_version = fields.Integer('Schema Version', readonly=True)
+    schema_cache = fields.Text('Schema Cache', readonly=True)
+    model_version = fields.Integer('Model Version', readonly=True)
+    storage = fields.Selection([
+            ('table', 'Table'),
+            ('shared', 'Shared'),
+            ], 'Storage', required=True,
+        states={
+            'readonly': Bool(Eval('menus')),
+            }, depends=['menus'],
+        help='Store the responses in a table and a model of the survey or '
+        'in the answers of the responses shared by all the surveys.')
+    summary = fields.Boolean('Live Summary',
+        help='Maintain the counters and sums of the responses.')
+    submission_key = fields.Boolean('Submission Key',
+        states={
+            'readonly': Bool(Eval('menus')),
+            'invisible': Eval('storage') != 'table',
+            }, depends=['menus', 'storage'],
+        help='Store the key of each submission in a unique index so the '
+        'retried submissions are ignored.')
+    partitioning = fields.Selection([
+            (None, ''),
+            ('month', 'Monthly'),
+            ('week', 'Weekly'),
+            ], 'Partitioning',
+        states={
+            'readonly': Bool(Eval('menus')),
+            'invisible': Eval('storage') != 'table',
+            }, depends=['menus', 'storage'],
+        help='Partition the table of the responses by creation date on '
+        'PostgreSQL.')
+    partitions_kept = fields.Integer('Partitions Kept',
+        domain=['OR',
+            ('partitions_kept', '=', None),
+            ('partitions_kept', '>=', 1),
+            ],
+        states={
+            'invisible': ~Eval('partitioning'),
+            }, depends=['partitioning'],
+        help='Number of past partitions kept in the table, all if empty.')
+    partition_expiry = fields.Selection([
+            ('detach', 'Detach'),
+            ('drop', 'Drop'),
+            ], 'Partition Expiry', required=True,
+        states={
+            'invisible': ~Eval('partitions_kept'),
+            }, depends=['partitions_kept'],
+        help='Detach the expired partitions as standalone tables or drop '
+        'them with their responses.')
+    retention_days = fields.Integer('Retention Days',
+        domain=['OR',
+            ('retention_days', '=', None),
+            ('retention_days', '>=', 1),
+            ],
+        states={
+            'invisible': Eval('storage') != 'table',
+            }, depends=['storage'],
+        help='Number of days the responses are kept in the table before '
+        'being archived, forever if empty.')
+    archive_storage = fields.Selection([
+            ('table', 'Table'),
+            ('file', 'Compressed File'),
+            ], 'Archive Storage', required=True,
+        states={
+            'invisible': ~Eval('retention_days'),
+            }, depends=['retention_days'],
+        help='Store the archived responses in an archive table of the '
+        'survey or in a compressed file of the archive path.')
 
     @classmethod
     def __setup__(cls):
@@ -237,6 +1211,10 @@ class Survey(ModelSQL, ModelView):
         cls._buttons.update({
                 'create_menus': {},
                 'remove_menus': {},
+                'migrate_tables': {},
+                'rebuild_summary': {
+                    'invisible': ~Eval('summary'),
+                    },
                 })
         cls._sql_constraints = [
             ('name_uniq',  Unique(t, t.name),
@@ -245,17 +1223,151 @@ class Survey(ModelSQL, ModelView):
         cls._error_messages.update({
                 'survey_with_data': 'Survey %s has data and so cannot be '
                     'dropped.',
+                'unknown_response_field': 'Response %(response)s has the '
+                    'unknown field "%(field)s" for survey "%(survey)s".',
+                'missing_response_value': 'Response %(response)s has no '
+                    'value for the required field "%(field)s" of survey '
+                    '"%(survey)s".',
+                'invalid_response_value': 'Response %(response)s has the '
+                    'invalid value "%(value)s" for the field "%(field)s" of '
+                    'survey "%(survey)s".',
+                'invalid_response_email': 'Response %(response)s has the '
+                    'invalid email "%(value)s" for the field "%(field)s" of '
+                    'survey "%(survey)s".',
+                'invalid_response_url': 'Response %(response)s has the '
+                    'invalid URL "%(value)s" for the field "%(field)s" of '
+                    'survey "%(survey)s".',
+                'invalid_column_type': 'The responses of the column '
+                    '"%(column)s" of survey "%(survey)s" can not be '
+                    'converted to "%(type)s".',
+                'table_locked': 'The table of survey "%(survey)s" can not '
+                    'be altered because it is used by another transaction, '
+                    'try again later.',
+                'required_column_with_null': 'The column "%(column)s" of '
+                    'survey "%(survey)s" can not be required because some '
+                    'responses have no value.',
+                'partitioned_submission_key': 'Survey "%(survey)s" can not '
+                    'have a submission key because its responses are '
+                    'partitioned.',
                 })
 
+    @classmethod
+    def validate(cls, surveys):
+        super(Survey, cls).validate(surveys)
+        for survey in surveys:
+            survey.check_submission_key()
+            if survey.storage == 'shared':
+                for field in survey.fields_:
+                    field.check_shared_name()
+
+    def check_submission_key(self):
+        'Check the submission key is unique in the whole table'
+        if self.submission_key and self.partitioning:
+            # A unique index of a partitioned table must contain the
+            # partition key
+            self.raise_user_error('partitioned_submission_key', {
+                    'survey': self.rec_name,
+                    })
+
+    @staticmethod
+    def default_schema_version():
+        return 1
+
+    @staticmethod
+    def default_storage():
+        return 'table'
+
+    @staticmethod
+    def default_summary():
+        return False
+
+    @staticmethod
+    def default_model_version():
+        return 1
+
+    @staticmethod
+    def default_partition_expiry():
+        return 'detach'
+
+    @staticmethod
+    def default_archive_storage():
+        return 'table'
+
+    @classmethod
+    def create(cls, vlist):
+        DynamicModel = Pool().get('DynamicModel')
+        surveys = super(Survey, cls).create(vlist)
+        DynamicModel._model_versions_cache.clear()
+        return surveys
+
+    @classmethod
+    def write(cls, *args):
+        DynamicModel = Pool().get('DynamicModel')
+        super(Survey, cls).write(*args)
+        cls.update_schema_version(sum(args[::2], []))
+        actions = iter(args)
+        to_rebuild = []
+        for surveys, values in zip(actions, actions):
+            if 'summary' in values:
+                to_rebuild.extend(surveys)
+            if 'submission_key' in values:
+                DynamicModel._model_versions_cache.clear()
+        if to_rebuild:
+            cls.rebuild_summary(to_rebuild)
+
+    @classmethod
+    def copy(cls, surveys, default=None):
+        if default is None:
+            default = {}
+        default = default.copy()
+        default.setdefault('schema_cache', None)
+        default.setdefault('model_version', 1)
+        return super(Survey, cls).copy(surveys, default=default)
+
     @classmethod
     def delete(cls, surveys):
+        DynamicModel = Pool().get('DynamicModel')
+        cursor = Transaction().connection.cursor()
         super(Survey, cls).delete(surveys)
         cls.drop_table(surveys)
+        for survey in surveys:
+            cursor.execute('DROP TABLE IF EXISTS "survey_%s__archive"'
+                % survey.id)
+        DynamicModel._fields_view_get_cache.clear()
 
-    def create_table(self):
-        transaction = Transaction()
-        cursor = transaction.connection.cursor()
-        field_type = {
+    @classmethod
+    def update_schema_version(cls, surveys):
+        '''Increase the schema version of the surveys and store their
+        compiled schema snapshot
+        '''
+        DynamicModel = Pool().get('DynamicModel')
+        cursor = Transaction().connection.cursor()
+        table = cls.__table__()
+        survey_ids = sorted({s.id for s in surveys})
+        for sub_ids in grouped_slice(survey_ids):
+            cursor.execute(*table.update(
+                    [table.schema_version],
+                    [Coalesce(table.schema_version, 0) + 1],
+                    where=reduce_ids(table.id, sub_ids)))
+        DynamicModel.store_schemas(survey_ids)
+        DynamicModel._fields_view_get_cache.clear()
+
+    @classmethod
+    def column_types(cls):
+        'Return the SQL type of each field type for the backend'
+        if backend.name() == 'sqlite':
+            return {
+                'boolean': 'BOOLEAN',
+                'integer': 'INTEGER',
+                'char': 'VARCHAR',
+                'float': 'FLOAT',
+                'numeric': 'NUMERIC',
+                'date': 'DATE',
+                'datetime': 'TIMESTAMP',
+                'selection': 'VARCHAR',
+                'many2one': 'INTEGER',
+                }
+        return {
             'boolean': 'boolean',
             'integer': 'integer',
             'char': 'character varying',
@@ -266,34 +1378,594 @@ class Survey(ModelSQL, ModelView):
             'selection': 'character varying',
             'many2one': 'integer',
             }
+
+    @classmethod
+    def update_model_version(cls, surveys):
+        '''Increase the model version of the surveys
+        All the processes build again the model of the surveys on next use.
+        '''
+        DynamicModel = Pool().get('DynamicModel')
+        cursor = Transaction().connection.cursor()
+        table = cls.__table__()
+        for sub_ids in grouped_slice(list({s.id for s in surveys})):
+            cursor.execute(*table.update(
+                    [table.model_version],
+                    [Coalesce(table.model_version, 0) + 1],
+                    where=reduce_ids(table.id, sub_ids)))
+        DynamicModel._model_versions_cache.clear()
+
+    def create_table(self):
+        pool = Pool()
+        Configuration = pool.get('survey.configuration')
+        transaction = Transaction()
+        cursor = transaction.connection.cursor()
+        configuration = Configuration(1)
+        field_type = self.column_types()
         table_name = 'survey_%s' % self.id
         sequence_name = table_name + '_id_seq'
-        sequence = ('CREATE SEQUENCE %s '
-            'START WITH 1 '
-            'INCREMENT BY 1 '
-            'NO MINVALUE '
-            'NO MAXVALUE '
-            'CACHE 1;' % sequence_name)
-        cursor.execute(sequence)
-        query = ('CREATE TABLE %s ('
-            'id integer DEFAULT nextval(\'%s\'::regclass) '
-                'NOT NULL, '
-            'create_date timestamp(6) without time zone, '
-            'write_date timestamp(6) without time zone, '
-            'create_uid integer, '
-            'write_uid integer' % (table_name, sequence_name))
+        with phase('create_table', self.id):
+            if backend.name() == 'sqlite':
+                # SQLite doesn't have sequences
+                query = ('CREATE TABLE "%s" ('
+                    'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                    'create_date TIMESTAMP, '
+                    'write_date TIMESTAMP, '
+                    'create_uid INTEGER, '
+                    'write_uid INTEGER' % table_name)
+            else:
+                sequence = ('CREATE SEQUENCE %s '
+                    'START WITH 1 '
+                    'INCREMENT BY 1 '
+                    'NO MINVALUE '
+                    'NO MAXVALUE '
+                    'CACHE %s;' % (sequence_name,
+                        configuration.sequence_cache))
+                cursor.execute(sequence)
+                query = ('CREATE TABLE %s ('
+                    'id integer DEFAULT nextval(\'%s\'::regclass) '
+                        'NOT NULL, '
+                    'create_date timestamp(6) without time zone, '
+                    'write_date timestamp(6) without time zone, '
+                    'create_uid integer, '
+                    'write_uid integer' % (table_name, sequence_name))
+            partitioned = (self.partitioning
+                and backend.name() == 'postgresql')
+            if self.submission_key:
+                query += ', submission_key %s' % field_type['char']
+            for field in self.fields_:
+                if field.type_ == 'one2many':
+                    continue
+                else:
+                    query += ', "%s" %s' % (field_name(field.name),
+                        field_type[field.type_])
+                if field.required:
+                    query += ' NOT NULL'
+                if field.type_ == 'many2one':
+                    self.add_dependency(field)
+            query += ')'
+            if partitioned:
+                query += ' PARTITION BY RANGE (create_date)'
+            cursor.execute(query)
+            if partitioned:
+                cursor.execute('CREATE TABLE "%s_default" PARTITION OF "%s" '
+                    'DEFAULT' % (table_name, table_name))
+                self.update_partitions([self])
+            # The new table is empty and not visible to other transactions
+            self.update_indexes([self], concurrently=False)
+
+    @classmethod
+    def update_sequence_cache(cls, surveys):
+        '''Set the cache of the id sequence of the survey tables to the
+        value of the configuration
+        Only the sequences are altered, the tables are not locked.
+        '''
+        pool = Pool()
+        Configuration = pool.get('survey.configuration')
+        transaction = Transaction()
+        cursor = transaction.connection.cursor()
+        cache = Configuration(1).sequence_cache
+
+        if backend.name() == 'sqlite':
+            # SQLite doesn't have sequences
+            return
+        for survey in surveys:
+            sequence_name = 'survey_%s_id_seq' % survey.id
+            if transaction.database.sequence_exist(transaction.connection,
+                    sequence_name):
+                cursor.execute('ALTER SEQUENCE "%s" CACHE %s'
+                    % (sequence_name, cache))
+
+    @classmethod
+    def table_definition(cls, survey_id):
+        '''Return an ordered dict of the field columns of the survey table
+        and their SQL type and not null constraint or None if the table is
+        missing
+        '''
+        TableHandler = backend.get('TableHandler')
+        cursor = Transaction().connection.cursor()
+        table_name = 'survey_%s' % survey_id
+        if not TableHandler.table_exist(table_name):
+            return None
+        if backend.name() == 'sqlite':
+            cursor.execute('PRAGMA table_info("%s")' % table_name)
+            columns = [(r[1], r[2], bool(r[3])) for r in cursor.fetchall()]
+        else:
+            cursor.execute('SELECT column_name, data_type, is_nullable '
+                'FROM information_schema.columns '
+                'WHERE table_name = %s ORDER BY ordinal_position',
+                (table_name,))
+            columns = [(n, t, nullable == 'NO')
+                for n, t, nullable in cursor.fetchall()]
+        return OrderedDict((name, (type_, not_null))
+            for name, type_, not_null in columns
+            if name not in ('id', 'create_date', 'write_date', 'create_uid',
+                'write_uid')
+            # Column of a type conversion in progress
+            and not name.endswith('__migrate'))
+
+    def migrate_table(self, batch_size=10000):
+        '''Alter the survey table to match the fields keeping the responses
+        Only the missing, removed or changed columns are altered and only the
+        model of the survey is registered again.
+        :param batch_size: number of responses converted per transaction
+            when the type of a column changes
+        '''
+        pool = Pool()
+        DynamicModel = pool.get('DynamicModel')
+        Summary = pool.get('survey.summary')
+        SurveyField = pool.get('survey.field')
+        cursor = Transaction().connection.cursor()
+        table_name = 'survey_%s' % self.id
+
+        if self.storage == 'shared':
+            # The responses are stored in survey_response
+            return
+        existing = self.table_definition(self.id)
+        if existing is None:
+            self.create_table()
+        else:
+            column_types = self.column_types()
+            expected = OrderedDict()
+            # New name of the columns of the renamed fields
+            renames = {}
+            for field in self.fields_:
+                if field.type_ == 'one2many':
+                    continue
+                name = field_name(field.name)
+                expected[name] = (
+                    column_types[field.type_], bool(field.required))
+                if (field.previous_column in existing
+                        and name not in existing):
+                    renames[field.previous_column] = name
+                if field.type_ == 'many2one':
+                    self.add_dependency(field)
+            if self.submission_key:
+                expected['submission_key'] = (column_types['char'], False)
+
+            types = {}
+            if backend.name() != 'sqlite':
+                # SQLite columns are not typed
+                for column, (type_, _) in existing.iteritems():
+                    name = renames.get(column, column)
+                    if name in expected and (
+                            _sql_type_re.sub('', type_)
+                            != _sql_type_re.sub('', expected[name][0])):
+                        types[column] = expected[name][0]
+            # Convert first as the conversion runs in other transactions
+            self.alter_column_types(types, batch_size)
+            for column, name in renames.iteritems():
+                self.rename_column(column, name)
+            existing = OrderedDict((renames.get(c, c), d)
+                for c, d in existing.iteritems())
+            converted = set(renames.get(c, c) for c in types)
+
+            # Drop first the indexes of the removed columns
+            self.update_indexes([self])
+            for name in existing:
+                if name not in expected:
+                    self.drop_column(name)
+            for name, (type_, required) in expected.iteritems():
+                if name not in existing:
+                    cursor.execute('ALTER TABLE "%s" ADD COLUMN "%s" %s'
+                        % (table_name, name, type_))
+                    existing[name] = (type_, False)
+                if backend.name() == 'sqlite':
+                    # SQLite columns are not typed and the required fields
+                    # are checked by the model
+                    continue
+                _, not_null = existing[name]
+                if name in converted:
+                    # The converted column has no not null constraint
+                    not_null = False
+                if required != not_null:
+                    self.alter_column_required(name, required)
+            self.update_indexes([self])
+            self.update_sequence_cache([self])
+        # The columns of the renamed fields match their name
+        survey_field = SurveyField.__table__()
+        cursor.execute(*survey_field.update(
+                [survey_field.previous_column], [Null],
+                where=(survey_field.survey == self.id)
+                & (survey_field.previous_column != Null)))
+
+        self.update_model_version([self])
+        Class = DynamicModel.build_model(self.id)
+        DynamicModel.__register_class__(Class, 'survey')
+        if self.summary:
+            Summary.rebuild([self])
+
+    def rename_column(self, old, new):
+        'Rename the column of a renamed field keeping its responses'
+        cursor = Transaction().connection.cursor()
+        cursor.execute('ALTER TABLE "survey_%s" RENAME COLUMN "%s" TO "%s"'
+            % (self.id, old, new))
+
+    def drop_column(self, name):
+        'Drop the column of a removed field'
+        cursor = Transaction().connection.cursor()
+        if backend.name() == 'sqlite':
+            import sqlite3
+            if sqlite3.sqlite_version_info < (3, 35, 0):
+                # Older SQLite can not drop columns
+                return
+        cursor.execute('ALTER TABLE "survey_%s" DROP COLUMN "%s"'
+            % (self.id, name))
+
+    def alter_column_types(self, types, batch_size=10000):
+        '''Change the type of the columns without locking the table during
+        the conversion: the values are converted by batches of ids into new
+        columns, each batch in its own transaction, and the new columns
+        replace the old ones in the current transaction.
+        It must be called before the current transaction uses the table.
+        :param types: dict of column name and new SQL type
+        '''
+        DatabaseOperationalError = backend.get('DatabaseOperationalError')
+        transaction = Transaction()
+        table = Table('survey_%s' % self.id)
+        if not types:
+            return
+
+        # The responses written since are converted again by the swap and
+        # the transactions already running write with their start date
+        cursor = transaction.connection.cursor()
+        cursor.execute('SELECT LEAST(MIN(xact_start), NOW()) '
+            'FROM pg_stat_activity WHERE datname = current_database()')
+        start, = cursor.fetchone()
+        for name, type_ in types.iteritems():
+            column = Column(table, name)
+            converted = Column(table, name + '__migrate')
+            with transaction.new_transaction() as batch_transaction:
+                cursor = batch_transaction.connection.cursor()
+                # Fail instead of waiting forever on the lock of a
+                # transaction which uses the table, like the current one
+                cursor.execute('SET LOCAL lock_timeout = \'%ss\''
+                    % _LOCK_TIMEOUT)
+                try:
+                    # Remove the column left by a failed migration
+                    cursor.execute('ALTER TABLE "%s" '
+                        'DROP COLUMN IF EXISTS "%s"'
+                        % (table._name, converted.name))
+                    cursor.execute('ALTER TABLE "%s" ADD COLUMN "%s" %s'
+                        % (table._name, converted.name, type_))
+                except DatabaseOperationalError:
+                    batch_transaction.rollback()
+                    self.raise_user_error('table_locked', {
+                            'survey': self.rec_name,
+                            })
+                batch_transaction.commit()
+                cursor.execute(*table.select(Max(table.id)))
+                max_id = cursor.fetchone()[0] or 0
+                try:
+                    offset = 0
+                    while offset < max_id:
+                        cursor.execute(*table.update([converted],
+                                [Cast(column, type_)],
+                                where=(table.id > offset)
+                                & (table.id <= offset + batch_size)))
+                        batch_transaction.commit()
+                        offset += batch_size
+                except Exception:
+                    batch_transaction.rollback()
+                    cursor.execute('ALTER TABLE "%s" DROP COLUMN "%s"'
+                        % (table._name, converted.name))
+                    batch_transaction.commit()
+                    self.raise_user_error('invalid_column_type', {
+                            'column': name,
+                            'type': type_,
+                            'survey': self.rec_name,
+                            })
+
+        cursor = transaction.connection.cursor()
+        # Block the writes until the end of the transaction
+        cursor.execute('LOCK TABLE "%s" IN EXCLUSIVE MODE' % table._name)
+        for name, type_ in types.iteritems():
+            column = Column(table, name)
+            converted = Column(table, name + '__migrate')
+            cursor.execute(*table.update([converted], [Cast(column, type_)],
+                    where=((converted == Null) & (column != Null))
+                    | (table.write_date >= start)))
+            cursor.execute('ALTER TABLE "%s" DROP COLUMN "%s"'
+                % (table._name, name))
+            cursor.execute('ALTER TABLE "%s" RENAME COLUMN "%s" TO "%s"'
+                % (table._name, converted.name, name))
+
+    def alter_column_required(self, name, required):
+        'Add or remove the not null constraint of a column'
+        cursor = Transaction().connection.cursor()
+        table = Table('survey_%s' % self.id)
+        if required:
+            cursor.execute(*table.select(table.id,
+                    where=Column(table, name) == Null, limit=1))
+            if cursor.fetchone():
+                self.raise_user_error('required_column_with_null', {
+                        'column': name,
+                        'survey': self.rec_name,
+                        })
+        cursor.execute('ALTER TABLE "%s" ALTER COLUMN "%s" %s NOT NULL'
+            % (table._name, name, 'SET' if required else 'DROP'))
+
+    @classmethod
+    def table_columns(cls, survey_id):
+        '''Return the column names of the survey table or None if missing
+        They are read from the catalog so the table is not locked.
+        '''
+        TableHandler = backend.get('TableHandler')
+        table_name = 'survey_%s' % survey_id
+        if not TableHandler.table_exist(table_name):
+            return None
+        cursor = Transaction().connection.cursor()
+        if backend.name() == 'sqlite':
+            cursor.execute('PRAGMA table_info("%s")' % table_name)
+            return [r[1] for r in cursor.fetchall()]
+        cursor.execute('SELECT column_name '
+            'FROM information_schema.columns '
+            'WHERE table_name = %s ORDER BY ordinal_position',
+            (table_name,))
+        return [n for n, in cursor.fetchall()]
+
+    def get_indexes(self, columns):
+        '''Return a dict of index name and its CREATE INDEX statement
+        create_date and many2one columns are always indexed, the submission
+        key has a unique index, the other indexes are defined by the fields
+        and the survey indexes.
+        :param columns: existing column names of the table
+        '''
+        table_name = 'survey_%s' % self.id
+        definitions = [(('create_date',), 'btree')]
         for field in self.fields_:
-            if field.type_ == 'one2many':
+            if field.index:
+                definitions.append(((field_name(field.name),), field.index))
+            elif field.type_ == 'many2one':
+                definitions.append(((field_name(field.name),), 'btree'))
+        for index in self.indexes:
+            definitions.append((tuple(index.get_columns()),
+                    'partial' if index.partial else 'btree'))
+        if self.submission_key:
+            definitions.append((('submission_key',), 'unique'))
+
+        indexes = {}
+        for index_columns, method in definitions:
+            if not index_columns or not set(index_columns) <= set(columns):
                 continue
-            else:
-                query += ', %s %s' % (slugify(field.name),
-                    field_type[field.type_])
-            if field.required:
-                query += ' NOT NULL'
-            if field.type_ == 'many2one':
-                self.add_dependency(field)
-        query += ');'
-        cursor.execute(query)
+            name = '%s_%s_%s_idx' % (table_name, '_'.join(index_columns),
+                method)
+            if len(name) > 63:
+                # Longer identifiers are truncated by PostgreSQL
+                name = '%s_%s_idx' % (table_name,
+                    hashlib.md5(name).hexdigest()[:16])
+            query = 'CREATE %sINDEX "%s" ON "%s"' % (
+                'UNIQUE ' if method == 'unique' else '', name, table_name)
+            if method == 'hash' and backend.name() != 'sqlite':
+                query += ' USING hash'
+            query += ' (%s)' % ', '.join('"%s"' % c for c in index_columns)
+            if method == 'partial':
+                query += ' WHERE %s' % ' AND '.join('"%s" IS NOT NULL' % c
+                    for c in index_columns)
+            indexes[name] = query
+        return indexes
+
+    @classmethod
+    def table_indexes(cls, survey_id):
+        'Return the names of the indexes created on the survey table'
+        cursor = Transaction().connection.cursor()
+        table_name = 'survey_%s' % survey_id
+        if backend.name() == 'sqlite':
+            cursor.execute('SELECT name FROM sqlite_master '
+                'WHERE type = \'index\' AND tbl_name = ?', (table_name,))
+        else:
+            cursor.execute('SELECT indexname FROM pg_indexes '
+                'WHERE tablename = %s', (table_name,))
+        return set(name for name, in cursor.fetchall()
+            if name.startswith(table_name + '_') and name.endswith('_idx'))
+
+    @classmethod
+    def update_indexes(cls, surveys, concurrently=None):
+        '''Create and drop the indexes of the survey tables to match the
+        definitions of the fields and of the survey indexes
+        On PostgreSQL, the indexes are updated after the end of the
+        transaction and built concurrently so the writes to the tables are
+        not blocked during the build.
+        :param concurrently: True to update the indexes now without locking
+            the tables, it must run outside of a transaction block
+        '''
+        transaction = Transaction()
+        cursor = transaction.connection.cursor()
+        if concurrently is None and backend.name() != 'sqlite':
+            pending = transaction.cache.get('survey.update_indexes')
+            if pending is None:
+                pending = transaction.cache['survey.update_indexes'] = set()
+                transaction.atexit(cls._update_indexes_concurrently,
+                    transaction.database.name, pending)
+            pending.update(s.id for s in surveys)
+            return
+        for survey in surveys:
+            columns = cls.table_columns(survey.id)
+            if columns is None:
+                continue
+            indexes = survey.get_indexes(columns)
+            existing = cls.table_indexes(survey.id)
+            # Partitioned tables can not be indexed concurrently
+            concurrent = (concurrently
+                and not cls.table_partitioned(survey.id))
+            for name in existing - set(indexes):
+                cursor.execute('DROP INDEX %s"%s"'
+                    % ('CONCURRENTLY ' if concurrent else '', name))
+            for name in set(indexes) - existing:
+                query = indexes[name]
+                if concurrent:
+                    query = query.replace('INDEX', 'INDEX CONCURRENTLY', 1)
+                try:
+                    cursor.execute(query)
+                except Exception:
+                    if concurrent:
+                        # Remove the invalid index left by the failed build
+                        cursor.execute('DROP INDEX CONCURRENTLY IF EXISTS '
+                            '"%s"' % name)
+                    raise
+
+    @classmethod
+    def _update_indexes_concurrently(cls, database_name, survey_ids):
+        '''Update the indexes of the surveys in an autocommit transaction
+        Nothing is done if the transaction of the changes was rolled back.
+        '''
+        if not survey_ids:
+            return
+        try:
+            with Transaction(new=True).start(database_name, 0,
+                    autocommit=True):
+                with Transaction().set_context(active_test=False):
+                    surveys = cls.search([
+                            ('id', 'in', sorted(survey_ids)),
+                            ])
+                cls.update_indexes(surveys, concurrently=True)
+        except Exception:
+            logger.error('survey indexes of %s not updated',
+                sorted(survey_ids), exc_info=True)
+
+    def partition_bounds(self, date):
+        '''Return the first day of the partition period containing the date
+        and the first day of the next period
+        '''
+        if self.partitioning == 'week':
+            start = date - datetime.timedelta(days=date.weekday())
+            return start, start + datetime.timedelta(days=7)
+        start = date.replace(day=1)
+        return start, (start + datetime.timedelta(days=31)).replace(day=1)
+
+    @classmethod
+    def table_partitioned(cls, survey_id):
+        'Return True if the survey table is partitioned'
+        if backend.name() == 'sqlite':
+            return False
+        cursor = Transaction().connection.cursor()
+        cursor.execute('SELECT 1 FROM pg_partitioned_table p '
+            'JOIN pg_class c ON c.oid = p.partrelid '
+            'WHERE c.relname = %s', ('survey_%s' % survey_id,))
+        return bool(cursor.fetchone())
+
+    @classmethod
+    def table_partitions(cls, survey_id):
+        '''Return a dict of the first day and the name of the period
+        partitions attached to the survey table
+        '''
+        if backend.name() == 'sqlite':
+            return {}
+        cursor = Transaction().connection.cursor()
+        cursor.execute('SELECT c.relname FROM pg_inherits i '
+            'JOIN pg_class c ON c.oid = i.inhrelid '
+            'JOIN pg_class p ON p.oid = i.inhparent '
+            'WHERE p.relname = %s', ('survey_%s' % survey_id,))
+        partitions = {}
+        for name, in cursor.fetchall():
+            match = _partition_re.match(name)
+            if match:
+                start = datetime.datetime.strptime(match.group(1), '%Y%m%d')
+                partitions[start.date()] = name
+        return partitions
+
+    @classmethod
+    def update_partitions(cls, surveys=None, ahead=2):
+        '''Create the partitions of the current and next periods and expire
+        the partitions older than the kept ones
+        Without surveys, all the partitioned surveys are updated as done by
+        the scheduled action.
+        :param ahead: number of next periods created in advance
+        '''
+        Summary = Pool().get('survey.summary')
+        cursor = Transaction().connection.cursor()
+
+        if backend.name() == 'sqlite':
+            # SQLite has no partitions
+            return
+        if surveys is None:
+            with Transaction().set_context(active_test=False):
+                surveys = cls.search([
+                        ('partitioning', '!=', None),
+                        ('storage', '=', 'table'),
+                        ])
+        today = datetime.datetime.utcnow().date()
+        for survey in surveys:
+            if (not survey.partitioning
+                    or not cls.table_partitioned(survey.id)):
+                continue
+            table_name = 'survey_%s' % survey.id
+            partitions = cls.table_partitions(survey.id)
+            current, end = survey.partition_bounds(today)
+            start = current
+            for _ in range(ahead + 1):
+                if start not in partitions:
+                    survey.create_partition(start, end)
+                start, end = survey.partition_bounds(end)
+
+            if not survey.partitions_kept:
+                continue
+            past = sorted((d for d in partitions if d < current),
+                reverse=True)
+            expired = past[survey.partitions_kept:]
+            for start in expired:
+                if survey.partition_expiry == 'drop':
+                    cursor.execute('DROP TABLE "%s"' % partitions[start])
+                else:
+                    cursor.execute('ALTER TABLE "%s" DETACH PARTITION "%s"'
+                        % (table_name, partitions[start]))
+            if expired and survey.summary:
+                Summary.rebuild([survey])
+
+    def create_partition(self, start, end):
+        '''Create the partition of the period
+        The responses of the period already stored in the default partition
+        are moved into the new partition as PostgreSQL refuses to create it
+        otherwise.
+        '''
+        TableHandler = backend.get('TableHandler')
+        cursor = Transaction().connection.cursor()
+        table_name = 'survey_%s' % self.id
+        name = '%s_p%s' % (table_name, start.strftime('%Y%m%d'))
+        default = table_name + '_default'
+        bounds = 'FROM (\'%s\') TO (\'%s\')' % (
+            start.isoformat(), end.isoformat())
+        where = 'create_date >= %s AND create_date < %s'
+        moved = False
+        if TableHandler.table_exist(default):
+            cursor.execute('SELECT 1 FROM "%s" WHERE %s LIMIT 1'
+                % (default, where), (start, end))
+            moved = bool(cursor.fetchone())
+        if not moved:
+            cursor.execute('CREATE TABLE "%s" PARTITION OF "%s" '
+                'FOR VALUES %s' % (name, table_name, bounds))
+            return
+        columns = ', '.join('"%s"' % c
+            for c in self.table_columns(self.id))
+        cursor.execute('ALTER TABLE "%s" DETACH PARTITION "%s"'
+            % (table_name, default))
+        cursor.execute('CREATE TABLE "%s" PARTITION OF "%s" '
+            'FOR VALUES %s' % (name, table_name, bounds))
+        cursor.execute('INSERT INTO "%s" (%s) SELECT %s FROM "%s" WHERE %s'
+            % (name, columns, columns, default, where), (start, end))
+        cursor.execute('DELETE FROM "%s" WHERE %s' % (default, where),
+            (start, end))
+        cursor.execute('ALTER TABLE "%s" ATTACH PARTITION "%s" DEFAULT'
+            % (table_name, default))
 
     def add_dependency(self, field):
         pool = Pool()
@@ -320,25 +1992,38 @@ class Survey(ModelSQL, ModelView):
             with open(path + '/tryton.cfg', 'a+') as f:
                 f.write('    %s\n' % module_depends)
 
-    def create_action_window(self):
+    def get_action_window(self):
+        'Return the unsaved action window of the survey'
         ActionWindow = Pool().get('ir.action.act_window')
         action_window = ActionWindow()
         action_window.name = self.name
-        action_window.res_model = 'survey.%s' % self.id
+        if self.storage == 'shared':
+            action_window.res_model = 'survey.response'
+            action_window.domain = PYSONEncoder().encode(
+                [('survey', '=', self.id)])
+            action_window.context = PYSONEncoder().encode(
+                {'survey': self.id})
+        else:
+            action_window.res_model = 'survey.%s' % self.id
+            # The list view shows the estimated number of responses
+            action_window.context = PYSONEncoder().encode(
+                {'estimated_count': True})
         action_window.survey = self.id
-        action_window.save()
         return action_window
 
-    def create_action_window_view(self, action, view):
+    @staticmethod
+    def get_action_window_view(action, view):
+        'Return the unsaved link between the action window and the view'
         ActView = Pool().get('ir.action.act_window.view')
         act_view = ActView()
         act_view.sequence = 16
         act_view.active = True
-        act_view.act_window = action.id
-        act_view.view = view.id
-        act_view.save()
+        act_view.act_window = action
+        act_view.view = view
+        return act_view
 
-    def create_view(self, type_):
+    def get_view(self, type_):
+        'Return the unsaved view of the survey'
         View = Pool().get('ir.ui.view')
         view = View()
         view.name = self.name
@@ -347,72 +2032,106 @@ class Survey(ModelSQL, ModelView):
         view.type = type_
         view.priority = 16
         view.survey = self.id
+        return view
+
+    def create_view(self, type_):
+        view = self.get_view(type_)
         view.save()
         return view
 
-    def create_menu(self, langs):
-        pool = Pool()
-        Menu = pool.get('ir.ui.menu')
-        ModelData = pool.get('ir.model.data')
+    def get_menu(self, parent):
+        'Return the unsaved menu of the survey'
+        Menu = Pool().get('ir.ui.menu')
         menu = Menu()
         menu.name = self.name
-        menu.parent = Menu(ModelData.get_id('survey', 'menu_survey'))
-        menu.survey = self
+        menu.parent = parent
         menu.icon = 'tryton-list'
         menu.survey = self.id
-        menu.save()
-
-        if langs:
-            for lang in langs:
-                with Transaction().set_context(language=lang.code,
-                        fuzzy_translation=False):
-                    data, = self.read([self], fields_names=['name'])
-                    Menu.write([menu], data)
         return menu
 
-    def create_action_keyword(self, action, menu, keyword):
+    @staticmethod
+    def get_action_keyword(action, menu, keyword):
+        'Return the unsaved keyword opening the action from the menu'
         ActionKeyword = Pool().get('ir.action.keyword')
         action_keyword = ActionKeyword()
         action_keyword.keyword = keyword
         action_keyword.action = action
         action_keyword.model = 'ir.ui.menu,%s' % menu.id
-        action_keyword.save()
         return action_keyword
 
     @classmethod
     @ModelView.button
     def create_menus(cls, surveys):
-        'Regenerates all actions and menu entries'
+        '''Regenerates all actions and menu entries
+        The records of all the surveys are created with one call per model
+        and the menus are translated with one write per language.
+        '''
         pool = Pool()
         Lang = pool.get('ir.lang')
+        ActionWindow = pool.get('ir.action.act_window')
+        ActView = pool.get('ir.action.act_window.view')
+        View = pool.get('ir.ui.view')
+        Menu = pool.get('ir.ui.menu')
+        ActionKeyword = pool.get('ir.action.keyword')
+        ModelData = pool.get('ir.model.data')
         langs = Lang.search([
             ('translatable', '=', True),
             ])
-        cls.remove_menus(surveys)
-        for survey in surveys:
-            survey.create_table()
-
-            Class = DynamicModel.__create_class__(survey.id)
-            DynamicModel.__setup_class__(Class)
-            pool.add(Class, type='model')
-            DynamicModel.__post_setup_class__(Class)
-            DynamicModel.__register_class__(Class, 'survey')
-
-            action_window = survey.create_action_window()
-            tree_view = survey.create_view('tree')
-            form_view = survey.create_view('form')
-            survey.create_action_window_view(action_window, tree_view)
-            survey.create_action_window_view(action_window, form_view)
-            menu = survey.create_menu(langs)
-            survey.create_action_keyword(action_window.action, menu,
-                'tree_open')
+        with phase('create_menus'):
+            with phase('delete_menus'):
+                cls.delete_menus(surveys)
+            for survey in surveys:
+                with phase('migrate_table', survey.id):
+                    survey.migrate_table()
+
+            with phase('action_windows'):
+                action_windows = [s.get_action_window() for s in surveys]
+                ActionWindow.save(action_windows)
+            with phase('views'):
+                # The shared responses use the views of survey.response
+                views = {}
+                for survey in surveys:
+                    if survey.storage == 'table':
+                        views[survey] = [survey.get_view('tree'),
+                            survey.get_view('form')]
+                View.save(sum(views.values(), []))
+                act_views = []
+                for survey, action_window in zip(surveys, action_windows):
+                    for view in views.get(survey, []):
+                        act_views.append(
+                            cls.get_action_window_view(action_window, view))
+                ActView.save(act_views)
+            with phase('menus'):
+                parent = Menu(ModelData.get_id('survey', 'menu_survey'))
+                menus = [s.get_menu(parent) for s in surveys]
+                Menu.save(menus)
 
+            with phase('translations'):
+                for lang in langs:
+                    with Transaction().set_context(language=lang.code,
+                            fuzzy_translation=False):
+                        names = dict((d['id'], d['name'])
+                            for d in cls.read([s.id for s in surveys],
+                                ['name']))
+                        args = []
+                        for survey, menu in zip(surveys, menus):
+                            args.extend([[menu], {'name': names[survey.id]}])
+                        Menu.write(*args)
+
+            with phase('action_keywords'):
+                ActionKeyword.save([
+                        cls.get_action_keyword(a.action, m, 'tree_open')
+                        for a, m in zip(action_windows, menus)])
         return 'reload menu'
 
     @classmethod
     def drop_table(cls, surveys):
+        pool = Pool()
+        DynamicModel = pool.get('DynamicModel')
         cursor = Transaction().connection.cursor()
+        cls.update_model_version(surveys)
         for survey in surveys:
+            DynamicModel.remove_model(survey.id)
             table = 'survey_%s' % survey.id
             cursor.execute("DROP TABLE IF EXISTS %s " % table)
             try:
@@ -426,20 +2145,13 @@ class Survey(ModelSQL, ModelView):
     @ModelView.button
     def remove_menus(cls, surveys):
         'Remove all menus and actions created'
-        pool = Pool()
-        ActionWindow = pool.get('ir.action.act_window')
-        View = pool.get('ir.ui.view')
-        Menu = pool.get('ir.ui.menu')
-
-        action_windows = []
-        views = []
-        menus = []
+        DynamicModel = Pool().get('DynamicModel')
         for survey in surveys:
             has_surveys = False
             try:
-                Survey = pool.get('survey.%s' % survey.id)
+                Survey = DynamicModel.get_model(survey.id)
                 try:
-                    has_surveys = Survey.search([])
+                    has_surveys = Survey.search([], limit=1)
                 except:
                     cursor = Transaction().connection.cursor()
                     cursor.rollback()
@@ -448,15 +2160,66 @@ class Survey(ModelSQL, ModelView):
             if has_surveys:
                 cls.raise_user_error('survey_with_data',
                     error_args=(survey.id,))
-            action_windows += survey.action_windows
-            views += survey.views
-            menus += survey.menus
-        Menu.delete(menus)
-        View.delete(views)
-        ActionWindow.delete(action_windows)
+        cls.delete_menus(surveys)
         cls.drop_table(surveys)
         return 'reload menu'
 
+    @classmethod
+    def delete_menus(cls, surveys):
+        'Delete the menus, actions and views of the surveys in bulk'
+        pool = Pool()
+        ActionWindow = pool.get('ir.action.act_window')
+        View = pool.get('ir.ui.view')
+        Menu = pool.get('ir.ui.menu')
+
+        domain = [('survey', 'in', [s.id for s in surveys])]
+        with Transaction().set_context(active_test=False):
+            Menu.delete(Menu.search(domain))
+            View.delete(View.search(domain))
+            ActionWindow.delete(ActionWindow.search(domain))
+
+    @classmethod
+    @ModelView.button
+    def migrate_tables(cls, surveys):
+        'Alter the tables of the surveys to match their fields'
+        for survey in surveys:
+            survey.migrate_table()
+
+    @classmethod
+    @ModelView.button
+    def rebuild_summary(cls, surveys):
+        'Recompute the live summary from the responses'
+        Summary = Pool().get('survey.summary')
+        Summary.rebuild(surveys)
+
+    @classmethod
+    def archive_responses(cls, surveys=None, batch_size=1000):
+        '''Archive the responses older than the retention days
+        Without surveys, all the surveys with a retention are archived as
+        done by the scheduled action.
+        :return: the list of the created archives
+        '''
+        Archive = Pool().get('survey.archive')
+        if surveys is None:
+            with Transaction().set_context(active_test=False):
+                surveys = cls.search([
+                        ('retention_days', '!=', None),
+                        ('storage', '=', 'table'),
+                        ])
+        now = datetime.datetime.now()
+        archives = []
+        for survey in surveys:
+            if not survey.retention_days or survey.storage != 'table':
+                continue
+            if cls.table_columns(survey.id) is None:
+                continue
+            archive = Archive.archive(survey,
+                now - datetime.timedelta(days=survey.retention_days),
+                batch_size=batch_size)
+            if archive:
+                archives.append(archive)
+        return archives
+
     @staticmethod
     def default_active():
         return True
@@ -468,12 +2231,339 @@ class Survey(ModelSQL, ModelView):
             return self.name
 
     @classmethod
-    def save_data(cls, survey, data):
-        '''Get values from a survey
+    def save_data(cls, survey, data, batch_size=1000, errors=None):
+        '''Save responses of a survey in bulk
+        Responses are validated by batch against the survey fields and
+        inserted with multi-row INSERTs or with COPY on PostgreSQL. The
+        responses of the surveys with shared storage are inserted in
+        survey_response. The live summary of the survey is incremented after
+        each batch.
         :param survey: obj
-        :param data: dict
+        :param data: dict or iterable of dicts
+        :param batch_size: number of responses inserted at once
+        :param errors: list extended with the error reports of the invalid
+            responses which are skipped, otherwise the first invalid
+            response raises an error
+        :return: number of saved responses
         '''
-        return True
+        pool = Pool()
+        DynamicModel = pool.get('DynamicModel')
+        Summary = pool.get('survey.summary')
+        SurveyResponse = pool.get('survey.response')
+        transaction = Transaction()
+        database = transaction.database
+        cursor = transaction.connection.cursor()
+
+        if isinstance(data, dict):
+            data = [data]
+        definitions = DynamicModel.load_schemas([survey.id]).get(
+            survey.id, [])
+        validator = DynamicModel.get_validator(survey.id)
+        names = [d['name'] for d in definitions]
+        shared = survey.storage == 'shared'
+        keyed = bool(survey.submission_key) and not shared
+        if shared:
+            table = SurveyResponse.__table__()
+            columns = [table.create_date, table.create_uid, table.survey,
+                table.answers]
+        else:
+            table = Table('survey_%s' % survey.id)
+            columns = [Column(table, 'create_date'),
+                Column(table, 'create_uid')]
+            columns += [Column(table, n) for n in names]
+            if keyed:
+                columns.append(Column(table, 'submission_key'))
+        summarized = Summary.summarized(survey.id)
+
+        # COPY can not ignore the conflicts
+        use_copy = (backend.name() == 'postgresql'
+            and hasattr(cursor, 'copy_expert') and not shared and not keyed)
+        if not use_copy:
+            if not database.has_multirow_insert():
+                batch_size = 1
+            elif backend.name() == 'sqlite':
+                # SQLite limits the number of parameters of a query
+                batch_size = min(batch_size, 999 // len(columns))
+
+        now = datetime.datetime.now()
+        count = number = 0
+        data = iter(data)
+        while True:
+            responses = list(islice(data, batch_size))
+            if not responses:
+                break
+            if keyed:
+                keys = [r.get('submission_key') or None for r in responses]
+                responses = [dict((n, v) for n, v in r.iteritems()
+                        if n != 'submission_key') for r in responses]
+            rows, batch_errors = validator.validate(responses, number + 1)
+            if keyed:
+                invalid = set(e['response'] - number - 1
+                    for e in batch_errors)
+                keys = [k for i, k in enumerate(keys) if i not in invalid]
+            number += len(responses)
+            if batch_errors:
+                if errors is None:
+                    cls.response_error(survey, batch_errors[0], definitions)
+                for error in batch_errors:
+                    error['message'] = cls.response_error(survey, error,
+                        definitions, raise_exception=False)
+                errors.extend(batch_errors)
+            if not rows:
+                continue
+            values = []
+            converted = []
+            for row in rows:
+                if shared:
+                    answers = dict((n, v) for n, v in zip(names, row)
+                        if v is not None)
+                    values.append([now, transaction.user, survey.id,
+                            SurveyResponse.answers.sql_format(answers)])
+                else:
+                    values.append([now, transaction.user] + row)
+                if summarized:
+                    converted.append(dict(zip(names, row), create_date=now))
+            if keyed:
+                for row, key in zip(values, keys):
+                    row.append(key)
+                count += cls._save_submissions(survey, table, columns,
+                    values, summarized)
+                continue
+            count += len(rows)
+            if use_copy:
+                cls._copy_responses(table, columns, values)
+            else:
+                cursor.execute(*table.insert(columns, values))
+            if summarized:
+                Summary.apply_deltas(survey.id, Summary.get_deltas(
+                        definitions, converted))
+        if count:
+            DynamicModel.clear_keysets(survey.id)
+        return count
+
+    @classmethod
+    def _save_submissions(cls, survey, table, columns, values, summarized):
+        '''Insert the values ignoring the already stored submission keys
+        and return the number of inserted responses
+        '''
+        Summary = Pool().get('survey.summary')
+        transaction = Transaction()
+        cursor = transaction.connection.cursor()
+        id_ = Column(table, 'id')
+        if not summarized:
+            return cls._insert_ignore(table, columns, values).rowcount
+        if transaction.database.has_returning():
+            ids = [i for i, in cls._insert_ignore(table, columns, values,
+                    returning=[id_]).fetchall()]
+        else:
+            # The inserted responses follow the last one and have the
+            # creation date of the batch
+            cursor.execute(*table.select(Max(id_)))
+            last, = cursor.fetchone()
+            cls._insert_ignore(table, columns, values)
+            cursor.execute(*table.select(id_,
+                    where=(id_ > (last or 0))
+                    & (Column(table, 'create_date') == values[0][0])))
+            ids = [i for i, in cursor.fetchall()]
+        Summary.add_responses(survey.id, ids)
+        return len(ids)
+
+    @classmethod
+    def _insert_ignore(cls, table, columns, values, returning=None):
+        '''Insert the values ignoring the rows which conflict with a unique
+        index and return the cursor
+        '''
+        cursor = Transaction().connection.cursor()
+        query, params = tuple(table.insert(columns, values,
+                returning=returning))
+        if backend.name() == 'sqlite':
+            query = 'INSERT OR IGNORE' + query[len('INSERT'):]
+        else:
+            insert, returning_sql = query, ''
+            if returning:
+                insert, _, returning_sql = query.rpartition(' RETURNING ')
+                returning_sql = ' RETURNING ' + returning_sql
+            query = insert + ' ON CONFLICT DO NOTHING' + returning_sql
+        cursor.execute(query, params)
+        return cursor
+
+    @classmethod
+    def convert_response(cls, survey, definitions, response, number=1):
+        '''Return the column values of a response
+        :param definitions: field definitions as returned by load_schemas
+        :param response: dict of field name and value
+        :param number: position of the response used in error messages
+        '''
+        rows, errors = ResponseValidator(definitions).validate([response],
+            number)
+        if errors:
+            cls.response_error(survey, errors[0], definitions)
+        return rows[0]
+
+    @classmethod
+    def response_error(cls, survey, error, definitions=None,
+            raise_exception=True):
+        '''Raise the error of an error report of a response or return its
+        message
+        :param definitions: field definitions as returned by load_schemas
+        '''
+        DynamicModel = Pool().get('DynamicModel')
+        if definitions is None:
+            definitions = DynamicModel.load_schemas([survey.id]).get(
+                survey.id, [])
+        strings = dict((d['name'], d['kwargs']['string'])
+            for d in definitions)
+        return cls.raise_user_error({
+                'unknown': 'unknown_response_field',
+                'missing': 'missing_response_value',
+                'invalid': 'invalid_response_value',
+                'email': 'invalid_response_email',
+                'url': 'invalid_response_url',
+                }[error['error']], {
+                'response': error['response'],
+                'field': strings.get(error['field'], error['field']),
+                'value': error['value'],
+                'survey': survey.rec_name,
+                }, raise_exception=raise_exception)
+
+    @classmethod
+    def _copy_responses(cls, table, columns, values):
+        'Insert the values with COPY'
+        cursor = Transaction().connection.cursor()
+        data = StringIO()
+        for row in values:
+            data.write('\t'.join(copy_format(v) for v in row).encode(
+                    'utf-8'))
+            data.write('\n')
+        data.seek(0)
+        cursor.copy_expert('COPY "%s" (%s) FROM STDIN' % (table._name,
+                ', '.join('"%s"' % c.name for c in columns)), data)
+
+    @classmethod
+    def read_data(cls, survey, names=None, chunk_size=1000, labels=True,
+            columnar=False):
+        '''Yield the responses of a survey by chunks
+        A server-side cursor is used on PostgreSQL and batched fetches on the
+        other backends, so memory does not depend on the table size.
+        :param survey: obj
+        :param names: list of field names or None for all fields
+        :param chunk_size: number of responses of each chunk
+        :param labels: replace selection keys and many2one ids by the labels
+            and record names
+        :param columnar: yield a dict of field name and values instead of a
+            list of dicts
+        '''
+        pool = Pool()
+        DynamicModel = pool.get('DynamicModel')
+        SurveyResponse = pool.get('survey.response')
+        connection = Transaction().connection
+
+        definitions = DynamicModel.load_schemas([survey.id]).get(
+            survey.id, [])
+        if names is not None:
+            by_name = dict((d['name'], d) for d in definitions)
+            definitions = [by_name[n] for n in names]
+        keys = ['id', 'create_date'] + [d['name'] for d in definitions]
+        if survey.storage == 'shared':
+            table = SurveyResponse.__table__()
+            query = table.select(table.id, table.create_date, table.answers,
+                where=table.survey == survey.id,
+                order_by=table.id.asc)
+        else:
+            table = Table('survey_%s' % survey.id)
+            query = table.select(*[Column(table, k) for k in keys],
+                order_by=table.id.asc)
+
+        if backend.name() == 'postgresql':
+            cursor = connection.cursor('survey_%s_read_data' % survey.id)
+            cursor.itersize = chunk_size
+        else:
+            cursor = connection.cursor()
+        cursor.execute(*query)
+        try:
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                if survey.storage == 'shared':
+                    responses = SurveyResponse.answers_responses(keys, rows)
+                else:
+                    responses = [dict(zip(keys, r)) for r in rows]
+                if labels:
+                    cls.label_responses(definitions, responses)
+                if columnar:
+                    yield dict((k, [r[k] for r in responses]) for k in keys)
+                else:
+                    yield responses
+        finally:
+            cursor.close()
+
+    @classmethod
+    def label_responses(cls, definitions, responses):
+        '''Replace in place selection keys by their label and many2one ids
+        by the record name with one read per target model
+        '''
+        DynamicModel = Pool().get('DynamicModel')
+        targets = {}
+        for definition in definitions:
+            if definition['type'] == 'many2one':
+                targets.setdefault(definition['kwargs']['model_name'],
+                    set()).update(r[definition['name']] for r in responses
+                    if r[definition['name']] is not None)
+        rec_names = DynamicModel.rec_names(targets)
+        for definition in definitions:
+            name = definition['name']
+            kwargs = definition['kwargs']
+            if definition['type'] == 'selection':
+                selection = dict((k, l) for k, l in kwargs['selection'])
+                for response in responses:
+                    if response[name] is not None:
+                        response[name] = selection.get(response[name],
+                            response[name])
+            elif definition['type'] == 'many2one':
+                for response in responses:
+                    if response[name] is not None:
+                        response[name] = rec_names.get(
+                            (kwargs['model_name'], response[name]))
+
+    @classmethod
+    def export_data(cls, survey, fileobj, format='csv', names=None,
+            chunk_size=1000, labels=True):
+        '''Write the responses of a survey in a file by chunks
+        :param survey: obj
+        :param fileobj: file object opened in binary mode
+        :param format: csv, jsonl or columns (a JSON object of field name
+            and values per chunk)
+        :return: number of exported responses
+        '''
+        DynamicModel = Pool().get('DynamicModel')
+        if names is None:
+            names = [d['name'] for d in DynamicModel.load_schemas(
+                    [survey.id]).get(survey.id, [])]
+        keys = ['id', 'create_date'] + list(names)
+        if format == 'csv':
+            writer = csv.writer(fileobj)
+            writer.writerow(keys)
+
+        count = 0
+        for chunk in cls.read_data(survey, names=names,
+                chunk_size=chunk_size, labels=labels,
+                columnar=format == 'columns'):
+            if format == 'columns':
+                fileobj.write(json.dumps(chunk, default=json_default,
+                        separators=(',', ':')))
+                fileobj.write('\n')
+                count += len(chunk['id'])
+                continue
+            for response in chunk:
+                if format == 'csv':
+                    writer.writerow([csv_format(response[k]) for k in keys])
+                elif format == 'jsonl':
+                    fileobj.write(json.dumps(response, default=json_default,
+                            separators=(',', ':'), sort_keys=True))
+                    fileobj.write('\n')
+            count += len(chunk)
+        return count
 
 
 class SurveyField(DictSchemaMixin, ModelSQL, ModelView):
@@ -515,6 +2605,17 @@ class SurveyField(DictSchemaMixin, ModelSQL, ModelView):
         }, depends=['type_'],
         help='Target Model.')
     target_value = fields.Integer('Value')
+    index = fields.Selection([
+            (None, ''),
+            ('btree', 'B-Tree'),
+            ('hash', 'Hash'),
+            ('partial', 'Partial'),
+            ], 'Index',
+        help='Index the column of the responses.\n'
+        'Partial indexes only contain the responses with a value.')
+    previous_column = fields.Char('Previous Column', readonly=True,
+        help='Column of the responses before the field was renamed, it is '
+        'renamed by the next migration of the table.')
 
     @staticmethod
     def default_sequence():
@@ -524,6 +2625,44 @@ class SurveyField(DictSchemaMixin, ModelSQL, ModelView):
     def default_tree_view():
         return True
 
+    @classmethod
+    def create(cls, vlist):
+        Survey = Pool().get('survey.survey')
+        records = super(SurveyField, cls).create(vlist)
+        surveys = [r.survey for r in records if r.survey]
+        Survey.update_schema_version(surveys)
+        Survey.update_indexes(list(set(surveys)))
+        return records
+
+    @classmethod
+    def write(cls, *args):
+        Survey = Pool().get('survey.survey')
+        records = sum(args[::2], [])
+        surveys = [r.survey for r in records if r.survey]
+        columns = dict((r.id, r.previous_column or field_name(r.name))
+            for r in records)
+        super(SurveyField, cls).write(*args)
+        # Keep the column of the renamed fields for the migration
+        renamed = {}
+        for record in cls.browse(records):
+            if (not record.previous_column
+                    and field_name(record.name) != columns[record.id]):
+                renamed.setdefault(columns[record.id], []).append(record)
+        for column, fields_ in renamed.iteritems():
+            super(SurveyField, cls).write(fields_,
+                {'previous_column': column})
+        surveys += [r.survey for r in records if r.survey]
+        Survey.update_schema_version(surveys)
+        Survey.update_indexes(list(set(surveys)))
+
+    @classmethod
+    def delete(cls, records):
+        Survey = Pool().get('survey.survey')
+        surveys = [r.survey for r in records if r.survey]
+        super(SurveyField, cls).delete(records)
+        Survey.update_schema_version(surveys)
+        Survey.update_indexes(list(set(surveys)))
+
     @classmethod
     def __setup__(cls):
         super(SurveyField, cls).__setup__()
@@ -535,18 +2674,118 @@ class SurveyField(DictSchemaMixin, ModelSQL, ModelView):
             cls.selection.states['required'] |= Eval('type_') == 'selection'
         else:
             cls.selection.states['required'] = Eval('type_') == 'selection'
+        cls._error_messages.update({
+                'shared_field_name': 'The name "%(name)s" of the field of '
+                    'survey "%(survey)s" must be "%(expected)s" because the '
+                    'survey has a shared storage.',
+                })
+
+    @classmethod
+    def validate(cls, records):
+        super(SurveyField, cls).validate(records)
+        for record in records:
+            record.check_shared_name()
+
+    def check_shared_name(self):
+        '''Check the name of the field of a shared survey is the key of its
+        answers'''
+        if (self.survey and self.survey.storage == 'shared'
+                and self.name != field_name(self.name)):
+            self.raise_user_error('shared_field_name', {
+                    'name': self.name,
+                    'survey': self.survey.rec_name,
+                    'expected': field_name(self.name),
+                    })
 
     def get_rec_name(self, name):
         if self.sequence:
             return self.sequence.rec_name
 
 
+class SurveyIndex(ModelSQL, ModelView):
+    'Survey Index'
+    __name__ = 'survey.index'
+    survey = fields.Many2One('survey.survey', 'Survey', required=True,
+        ondelete='CASCADE', select=True)
+    columns = fields.Char('Fields', required=True,
+        help='Names of the fields separated by commas.')
+    partial = fields.Boolean('Partial',
+        help='Only index the responses with a value for all the fields.')
+
+    @classmethod
+    def __setup__(cls):
+        super(SurveyIndex, cls).__setup__()
+        cls._error_messages.update({
+                'unknown_index_field': 'The index "%(index)s" uses the '
+                    'unknown field "%(field)s" of survey "%(survey)s".',
+                })
+
+    @classmethod
+    def validate(cls, indexes):
+        super(SurveyIndex, cls).validate(indexes)
+        for index in indexes:
+            index.check_columns()
+
+    def check_columns(self):
+        names = set(field_name(f.name) for f in self.survey.fields_)
+        names.add('create_date')
+        for column in self.get_columns():
+            if column not in names:
+                self.raise_user_error('unknown_index_field', {
+                        'index': self.columns,
+                        'field': column,
+                        'survey': self.survey.rec_name,
+                        })
+
+    def get_columns(self):
+        'Return the column names of the index'
+        return [field_name(c.strip()) for c in self.columns.split(',')
+            if c.strip()]
+
+    @classmethod
+    def create(cls, vlist):
+        Survey = Pool().get('survey.survey')
+        indexes = super(SurveyIndex, cls).create(vlist)
+        Survey.update_indexes(list(set(i.survey for i in indexes)))
+        return indexes
+
+    @classmethod
+    def write(cls, *args):
+        Survey = Pool().get('survey.survey')
+        indexes = sum(args[::2], [])
+        surveys = set(i.survey for i in indexes)
+        super(SurveyIndex, cls).write(*args)
+        surveys.update(i.survey for i in indexes)
+        Survey.update_indexes(list(surveys))
+
+    @classmethod
+    def delete(cls, indexes):
+        Survey = Pool().get('survey.survey')
+        surveys = list(set(i.survey for i in indexes))
+        super(SurveyIndex, cls).delete(indexes)
+        Survey.update_indexes(surveys)
+
+
 class ActWindow:
     __metaclass__ = PoolMeta
     __name__ = 'ir.action.act_window'
 
     survey = fields.Many2One('survey.survey', 'Survey', ondelete='CASCADE')
 
+    @classmethod
+    def read(cls, ids, fields_names=None):
+        DynamicModel = Pool().get('DynamicModel')
+        result = super(ActWindow, cls).read(ids, fields_names=fields_names)
+        # Build the survey models before the client opens them
+        for values in result:
+            res_model = values.get('res_model')
+            if res_model and _survey_model_re.match(res_model):
+                try:
+                    DynamicModel.get_model(int(res_model.split('.')[1]))
+                except KeyError:
+                    pass
+        return result
+
 
 class View:
     __metaclass__ = PoolMeta
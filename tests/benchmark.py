@@ -0,0 +1,464 @@
+#!/usr/bin/env python
+# This file is part of the survey module for Tryton.
+# The COPYRIGHT file at the top level of this repository contains the full
+# copyright notices and license terms.
+'''Benchmarks of the survey module
+
+Without database, they run on a temporary SQLite database where the module
+is activated:
+
+    python tests/benchmark.py -o results.json
+
+or against an existing database where the module is activated:
+
+    python tests/benchmark.py -c trytond.conf -d DATABASE concurrent_inserts
+'''
+import argparse
+import datetime
+import inspect
+import json
+import platform
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from decimal import Decimal
+
+from sql import Table
+
+from trytond import backend
+from trytond.config import config
+from trytond.pool import Pool
+from trytond.transaction import Transaction
+
+
+def create_database(path, name='benchmark', lang='en'):
+    'Create a SQLite database in the path with the survey module activated'
+    config.set('database', 'uri', 'sqlite://')
+    config.set('database', 'path', path)
+    Database = backend.get('Database')
+    with Transaction().start(None, 0, close=True, autocommit=True,
+            _nocache=True) as transaction:
+        transaction.database.create(transaction.connection, name)
+    with Transaction().start(name, 0, _nocache=True) as transaction, \
+            transaction.connection.cursor() as cursor:
+        Database(name).init()
+        ir_configuration = Table('ir_configuration')
+        cursor.execute(*ir_configuration.insert(
+                [ir_configuration.language], [[lang]]))
+    Pool(name).init(update=['res', 'ir', 'survey'], lang=[lang])
+    return name
+
+
+def latencies(durations):
+    'Return the statistics in milliseconds of the durations in seconds'
+    durations = sorted(durations)
+    if not durations:
+        return {}
+    return {
+        'count': len(durations),
+        'mean_ms': 1000 * sum(durations) / len(durations),
+        'median_ms': 1000 * durations[len(durations) // 2],
+        'p95_ms': 1000 * durations[int(len(durations) * 0.95)
+            if len(durations) > 1 else 0],
+        'max_ms': 1000 * durations[-1],
+        }
+
+
+def sample_value(type_, i):
+    'Return a value of the field type for the i-th response'
+    if type_ == 'boolean':
+        return bool(i % 2)
+    elif type_ == 'integer':
+        return i
+    elif type_ == 'char':
+        return 'value %s' % (i % 100)
+    elif type_ == 'float':
+        return i / 4.
+    elif type_ == 'numeric':
+        return Decimal(i) / 4
+    elif type_ == 'date':
+        return datetime.date(2018, 1, 1) + datetime.timedelta(days=i % 365)
+    elif type_ == 'datetime':
+        return datetime.datetime(2018, 1, 1) + datetime.timedelta(hours=i)
+    elif type_ == 'selection':
+        return 'a' if i % 3 else 'b'
+    elif type_ == 'many2one':
+        return 1
+
+
+def create_surveys(database, name, surveys, fields, tables=True,
+        types=None):
+    '''Create the surveys with fields cycling over the field types, all by
+    default, and return their ids and the type of each field name
+    '''
+    pool = Pool(database)
+    with Transaction().start(database, 0) as transaction:
+        Survey = pool.get('survey.survey')
+        Model = pool.get('ir.model')
+        user_model, = Model.search([('model', '=', 'res.user')])
+        types = sorted(types or Survey.column_types())
+        columns = {}
+        vlist = []
+        for i in range(surveys):
+            values = []
+            for j in range(fields):
+                type_ = types[j % len(types)]
+                field = {
+                    'name': 'Field %s' % j,
+                    'string': 'Field %s' % j,
+                    'type_': type_,
+                    'sequence': j,
+                    }
+                if type_ == 'selection':
+                    field['selection'] = 'a: A\nb: B'
+                elif type_ == 'many2one':
+                    field['target_model'] = user_model.id
+                elif type_ in ('float', 'numeric'):
+                    field['digits'] = 2
+                values.append(field)
+                columns['field_%s' % j] = type_
+            vlist.append({
+                    'name': '%s %s' % (name, i),
+                    'fields_': [('create', values)],
+                    })
+        records = Survey.create(vlist)
+        transaction.commit()
+        if tables:
+            for survey in records:
+                survey.create_table()
+                transaction.commit()
+        return [s.id for s in records], columns
+
+
+def delete_surveys(database, survey_ids):
+    pool = Pool(database)
+    with Transaction().start(database, 0) as transaction:
+        Survey = pool.get('survey.survey')
+        Survey.delete(Survey.browse(survey_ids))
+        transaction.commit()
+
+
+def create_survey(database, name):
+    'Create a survey with its table and return its id'
+    pool = Pool(database)
+    with Transaction().start(database, 0) as transaction:
+        Survey = pool.get('survey.survey')
+        survey, = Survey.create([{
+                    'name': name,
+                    'fields_': [('create', [{
+                                    'name': 'Age',
+                                    'string': 'Age',
+                                    'type_': 'integer',
+                                    }, {
+                                    'name': 'Colour',
+                                    'string': 'Colour',
+                                    'type_': 'selection',
+                                    'selection': 'red: Red\nblue: Blue',
+                                    }])],
+                    }])
+        survey.create_table()
+        transaction.commit()
+        return survey.id
+
+
+def delete_survey(database, survey_id):
+    pool = Pool(database)
+    with Transaction().start(database, 0) as transaction:
+        Survey = pool.get('survey.survey')
+        Survey.delete([Survey(survey_id)])
+        transaction.commit()
+
+
+def concurrent_inserts(database, threads=8, rows=200, caches=(1, 32)):
+    '''Insert responses one per transaction from concurrent threads for each
+    sequence cache size
+    '''
+    pool = Pool(database)
+
+    def set_sequence_cache(cache):
+        with Transaction().start(database, 0) as transaction:
+            Configuration = pool.get('survey.configuration')
+            configuration = Configuration(1)
+            previous = configuration.sequence_cache
+            Configuration.write([configuration], {
+                    'sequence_cache': cache,
+                    })
+            transaction.commit()
+        return previous
+
+    results = []
+    previous = None
+    for cache in caches:
+        value = set_sequence_cache(cache)
+        if previous is None:
+            previous = value
+        survey_id = create_survey(database,
+            'Benchmark concurrent inserts %s' % cache)
+        errors = []
+
+        def insert():
+            for i in range(rows):
+                try:
+                    with Transaction().start(database, 0) as transaction:
+                        Model = pool.get('DynamicModel').get_model(survey_id)
+                        Model.create([{
+                                    'age': i,
+                                    'colour': 'red' if i % 2 else 'blue',
+                                    }])
+                        transaction.commit()
+                except Exception:
+                    errors.append(i)
+
+        workers = [threading.Thread(target=insert) for _ in range(threads)]
+        start = time.time()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        duration = time.time() - start
+        delete_survey(database, survey_id)
+
+        count = threads * rows - len(errors)
+        results.append({
+                'sequence_cache': cache,
+                'threads': threads,
+                'rows': count,
+                'errors': len(errors),
+                'seconds': duration,
+                'rows_per_second': count / duration if duration else None,
+                })
+    set_sequence_cache(previous)
+    return results
+
+
+def pool_setup(database, surveys=10, fields=18):
+    'Measure the setup and registration of the survey models by the pool'
+    pool = Pool(database)
+    survey_ids, _ = create_surveys(database, 'Benchmark pool', surveys,
+        fields)
+    result = {'surveys': surveys, 'fields': fields}
+    try:
+        with Transaction().start(database, 0) as transaction:
+            DynamicModel = pool.get('DynamicModel')
+            DynamicModel._model_versions_cache.clear()
+            for name, method, args in [
+                    ('setup', DynamicModel.__setup__, ()),
+                    ('post_setup', DynamicModel.__post_setup__, ()),
+                    ('register', DynamicModel.__register__, ('survey',)),
+                    ]:
+                start = time.time()
+                method(*args)
+                result['%s_seconds' % name] = time.time() - start
+            transaction.rollback()
+
+        Pool.stop(database)
+        start = time.time()
+        Pool(database).init()
+        result['pool_init_seconds'] = time.time() - start
+    finally:
+        delete_surveys(database, survey_ids)
+    return result
+
+
+def fields_view_get(database, surveys=10, fields=18):
+    'Measure the latency of the views of the survey models'
+    pool = Pool(database)
+    survey_ids, _ = create_surveys(database, 'Benchmark views', surveys,
+        fields, tables=False)
+    result = {'surveys': surveys, 'fields': fields}
+    try:
+        with Transaction().start(database, 0) as transaction:
+            Survey = pool.get('survey.survey')
+            Survey.create_menus(Survey.browse(survey_ids))
+            transaction.commit()
+        with Transaction().start(database, 0, readonly=True):
+            DynamicModel = pool.get('DynamicModel')
+            for view_type in ['tree', 'form']:
+                cold, warm = [], []
+                for survey_id in survey_ids:
+                    Model = DynamicModel.get_model(survey_id)
+                    with Transaction().set_context(survey=survey_id):
+                        DynamicModel._fields_view_get_cache.clear()
+                        for durations in [cold, warm]:
+                            start = time.time()
+                            Model.fields_view_get(view_type=view_type)
+                            durations.append(time.time() - start)
+                result[view_type] = {
+                    'cold': latencies(cold),
+                    'warm': latencies(warm),
+                    }
+    finally:
+        delete_surveys(database, survey_ids)
+    return result
+
+
+def menus(database, surveys=10, fields=18):
+    'Measure the creation and removal of the menus of the surveys'
+    pool = Pool(database)
+    survey_ids, _ = create_surveys(database, 'Benchmark menus', surveys,
+        fields, tables=False)
+    result = {'surveys': surveys, 'fields': fields}
+    try:
+        for name in ['create_menus', 'remove_menus']:
+            with Transaction().start(database, 0) as transaction:
+                Survey = pool.get('survey.survey')
+                start = time.time()
+                getattr(Survey, name)(Survey.browse(survey_ids))
+                transaction.commit()
+                result['%s_seconds' % name] = time.time() - start
+    finally:
+        delete_surveys(database, survey_ids)
+    return result
+
+
+def inserts(database, fields=18, rows=1000):
+    'Measure the throughput of single-row and bulk inserts'
+    pool = Pool(database)
+    (survey_id,), columns = create_surveys(database, 'Benchmark inserts', 1,
+        fields)
+    result = {'fields': fields, 'rows': rows}
+    try:
+        responses = [dict((n, sample_value(t, i))
+                for n, t in columns.iteritems()) for i in range(rows)]
+        with Transaction().start(database, 0) as transaction:
+            Model = pool.get('DynamicModel').get_model(survey_id)
+            durations = []
+            for response in responses:
+                start = time.time()
+                Model.create([response])
+                durations.append(time.time() - start)
+            transaction.commit()
+            result['single'] = latencies(durations)
+            result['single']['rows_per_second'] = rows / sum(durations)
+
+        with Transaction().start(database, 0) as transaction:
+            Survey = pool.get('survey.survey')
+            start = time.time()
+            Survey.save_data(Survey(survey_id), responses)
+            transaction.commit()
+            duration = time.time() - start
+            result['bulk'] = {
+                'seconds': duration,
+                'rows_per_second': rows / duration if duration else None,
+                }
+    finally:
+        delete_surveys(database, [survey_id])
+    return result
+
+
+def searches(database, fields=18, rows=1000, queries=100):
+    'Measure the latency of searches on indexed and not indexed columns'
+    pool = Pool(database)
+    (survey_id,), columns = create_surveys(database, 'Benchmark searches',
+        1, fields)
+    result = {'fields': fields, 'rows': rows}
+    try:
+        with Transaction().start(database, 0) as transaction:
+            Survey = pool.get('survey.survey')
+            Survey.save_data(Survey(survey_id), (dict(
+                        (n, sample_value(t, i))
+                        for n, t in columns.iteritems())
+                    for i in range(rows)))
+            transaction.commit()
+
+        names = dict((t, n) for n, t in sorted(columns.iteritems(),
+                reverse=True))
+        with Transaction().start(database, 0, readonly=True):
+            Model = pool.get('DynamicModel').get_model(survey_id)
+            for name, domain in [
+                    ('indexed', [(names.get('many2one', 'id'), '=', 1)]),
+                    ('not_indexed', [(names.get('integer', 'id'), '>=',
+                                rows // 2)]),
+                    ]:
+                durations = []
+                for i in range(queries):
+                    start = time.time()
+                    records = Model.search(domain, limit=100)
+                    Model.read([r.id for r in records], list(columns))
+                    durations.append(time.time() - start)
+                result[name] = latencies(durations)
+                result[name]['queries_per_second'] = (
+                    queries / sum(durations))
+    finally:
+        delete_surveys(database, [survey_id])
+    return result
+
+
+BENCHMARKS = {
+    'concurrent_inserts': concurrent_inserts,
+    'pool_setup': pool_setup,
+    'fields_view_get': fields_view_get,
+    'menus': menus,
+    'inserts': inserts,
+    'searches': searches,
+    }
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-c', '--config', dest='config',
+        help='trytond configuration file')
+    parser.add_argument('-d', '--database', dest='database',
+        help='existing database, a temporary SQLite database by default')
+    parser.add_argument('-o', '--output', dest='output',
+        help='JSON file of the results, standard output by default')
+    parser.add_argument('-n', '--surveys', dest='surveys', type=int,
+        default=10, help='number of generated surveys')
+    parser.add_argument('-m', '--fields', dest='fields', type=int,
+        default=18, help='number of fields of each generated survey')
+    parser.add_argument('-r', '--rows', dest='rows', type=int, default=1000,
+        help='number of inserted responses')
+    parser.add_argument('benchmarks', nargs='*', metavar='BENCHMARK',
+        choices=sorted(BENCHMARKS) + [[]],
+        help='benchmarks to run, all by default')
+    options = parser.parse_args(args)
+
+    if options.config:
+        config.update_etc(options.config)
+    Pool.start()
+    directory = None
+    if options.database:
+        database = options.database
+        with Transaction().start(database, 0, readonly=True):
+            Pool(database).init()
+    else:
+        directory = tempfile.mkdtemp()
+        database = create_database(directory)
+
+    parameters = {
+        'surveys': options.surveys,
+        'fields': options.fields,
+        'rows': options.rows,
+        }
+    results = {
+        'metadata': {
+            'backend': backend.name(),
+            'python': platform.python_version(),
+            'date': datetime.datetime.utcnow().isoformat(),
+            'parameters': parameters,
+            },
+        }
+    try:
+        for name in options.benchmarks or sorted(BENCHMARKS):
+            benchmark = BENCHMARKS[name]
+            arguments = inspect.getargspec(benchmark).args
+            results[name] = benchmark(database, **dict(
+                    (k, v) for k, v in parameters.iteritems()
+                    if k in arguments))
+    finally:
+        if directory:
+            Pool.stop(database)
+            shutil.rmtree(directory)
+    if options.output:
+        with open(options.output, 'w') as fileobj:
+            json.dump(results, fileobj, indent=2, sort_keys=True)
+    else:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+# This file is part of the survey module for Tryton.
+# The COPYRIGHT file at the top level of this repository contains the full
+# copyright notices and license terms.
+'''Load test of the survey module simulating concurrent respondents
+
+Each worker, a thread or a process, runs operations on the model of a
+generated survey, each one in its own transaction, and the throughput, the
+latency percentiles and the lock or serialization failures are reported.
+
+Without database, it runs on a temporary SQLite database:
+
+    python tests/loadtest.py --workers 8 --operations 200 -o load.json
+
+or against a throwaway database:
+
+    python tests/loadtest.py -c trytond.conf -d DATABASE --processes
+'''
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from trytond import backend
+from trytond.config import config
+from trytond.pool import Pool
+from trytond.transaction import Transaction
+
+from benchmark import create_database, create_surveys, delete_surveys, \
+    sample_value
+
+OPERATIONS = ('create', 'write', 'search')
+# SQLSTATE of PostgreSQL
+SERIALIZATION_FAILURES = ('40001',)
+LOCK_FAILURES = ('40P01', '55P03')
+
+
+def parse_mix(value):
+    'Return the weight of each operation from "create=60,write=20,..."'
+    mix = {}
+    for item in value.split(','):
+        name, weight = item.split('=')
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(
+                'unknown operation "%s"' % name)
+        mix[name] = int(weight)
+    return mix
+
+
+def classify(exception):
+    'Return the kind of failure of the exception'
+    code = getattr(exception, 'pgcode', None)
+    if code in SERIALIZATION_FAILURES:
+        return 'serialization'
+    elif code in LOCK_FAILURES or 'locked' in str(exception):
+        return 'lock'
+    return 'error'
+
+
+def percentiles(durations, values=(50, 90, 99)):
+    'Return the percentiles in milliseconds of the durations in seconds'
+    durations = sorted(durations)
+    if not durations:
+        return {}
+    result = dict(('p%s_ms' % p,
+            1000 * durations[min(len(durations) - 1,
+                    len(durations) * p // 100)])
+        for p in values)
+    result['max_ms'] = 1000 * durations[-1]
+    return result
+
+
+def run_worker(database, survey_id, operations, mix, rows, seed):
+    '''Run the operations on the survey model and return the samples of
+    operation, outcome and duration
+    :param rows: number of responses created before the load
+    '''
+    pool = Pool(database)
+    rng = random.Random(seed)
+    with Transaction().start(database, 0, readonly=True):
+        DynamicModel = pool.get('DynamicModel')
+        columns = dict((d['name'], d['type'])
+            for d in DynamicModel.load_schemas([survey_id])[survey_id])
+    names = sorted(columns)
+    choices = sum(([n] * mix.get(n, 0) for n in OPERATIONS), [])
+
+    samples = []
+    for i in range(operations):
+        operation = rng.choice(choices)
+        values = dict((n, sample_value(t, rng.randint(0, 1000)))
+            for n, t in columns.iteritems())
+        start = time.time()
+        try:
+            with Transaction().start(database, 0) as transaction:
+                Model = pool.get('DynamicModel').get_model(survey_id)
+                if operation == 'create':
+                    Model.create([values])
+                elif operation == 'write':
+                    records = Model.search([
+                            ('id', '>=', rng.randint(1, max(rows, 1))),
+                            ], order=[('id', 'ASC')], limit=1)
+                    Model.write(records, values)
+                else:
+                    name = rng.choice(names)
+                    records = Model.search([
+                            (name, '=', values[name]),
+                            ], limit=20)
+                    Model.read([r.id for r in records], names)
+                transaction.commit()
+            outcome = 'ok'
+        except Exception as exception:
+            outcome = classify(exception)
+        samples.append((operation, outcome, time.time() - start))
+    return samples
+
+
+def run_threads(database, survey_id, workers, operations, mix, rows):
+    'Run the workers in threads and return all their samples'
+    samples = []
+
+    def target(seed):
+        samples.extend(run_worker(database, survey_id, operations, mix,
+                rows, seed))
+    threads = [threading.Thread(target=target, args=(i,))
+        for i in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples
+
+
+def run_processes(database, survey_id, workers, operations, mix, rows,
+        options):
+    'Run the workers in processes and return all their samples'
+    command = [sys.executable, os.path.abspath(__file__),
+        '--worker', str(survey_id), '--operations', str(operations),
+        '--mix', ','.join('%s=%s' % i for i in mix.iteritems()),
+        '--rows', str(rows), '-d', database]
+    if options.config:
+        command += ['-c', options.config]
+    if options.path:
+        command += ['--path', options.path]
+    processes = [subprocess.Popen(command + ['--seed', str(i)],
+            stdout=subprocess.PIPE) for i in range(workers)]
+    samples = []
+    for process in processes:
+        output, _ = process.communicate()
+        if process.returncode:
+            raise RuntimeError('worker failed with %s' % process.returncode)
+        samples.extend(tuple(s) for s in json.loads(output))
+    return samples
+
+
+def report(samples, duration):
+    'Return the throughput, latencies and failures of the samples'
+    result = {
+        'seconds': duration,
+        'operations': len(samples),
+        'throughput': (len([s for s in samples if s[1] == 'ok'])
+            / duration if duration else None),
+        }
+    for operation in OPERATIONS:
+        durations = [d for o, _, d in samples if o == operation]
+        if not durations:
+            continue
+        outcomes = [r for o, r, _ in samples if o == operation]
+        result[operation] = {
+            'count': len(durations),
+            'latency': percentiles(
+                [d for o, r, d in samples if o == operation and r == 'ok']),
+            }
+        for outcome in ['ok', 'lock', 'serialization', 'error']:
+            result[operation][outcome] = outcomes.count(outcome)
+    return result
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-c', '--config', dest='config',
+        help='trytond configuration file')
+    parser.add_argument('-d', '--database', dest='database',
+        help='throwaway database, a temporary SQLite database by default')
+    parser.add_argument('-o', '--output', dest='output',
+        help='JSON file of the report, standard output by default')
+    parser.add_argument('-w', '--workers', dest='workers', type=int,
+        default=8, help='number of concurrent respondents')
+    parser.add_argument('--processes', dest='processes',
+        action='store_true', help='run the workers in processes')
+    parser.add_argument('-n', '--operations', dest='operations', type=int,
+        default=100, help='number of operations of each worker')
+    parser.add_argument('--mix', dest='mix', type=parse_mix,
+        default=parse_mix('create=60,write=20,search=20'),
+        help='weight of each operation')
+    parser.add_argument('-m', '--fields', dest='fields', type=int,
+        default=9, help='number of fields of the survey')
+    parser.add_argument('--types', dest='types',
+        help='comma separated field types, all by default')
+    parser.add_argument('-r', '--rows', dest='rows', type=int, default=1000,
+        help='number of responses created before the load')
+    parser.add_argument('--worker', dest='worker', type=int,
+        help=argparse.SUPPRESS)
+    parser.add_argument('--seed', dest='seed', type=int, default=0,
+        help=argparse.SUPPRESS)
+    parser.add_argument('--path', dest='path', help=argparse.SUPPRESS)
+    options = parser.parse_args(args)
+
+    if options.config:
+        config.update_etc(options.config)
+    if options.path:
+        config.set('database', 'uri', 'sqlite://')
+        config.set('database', 'path', options.path)
+    Pool.start()
+
+    if options.worker:
+        # Run as a worker process of the load test
+        Pool(options.database).init()
+        json.dump(run_worker(options.database, options.worker,
+                options.operations, options.mix, options.rows, options.seed),
+            sys.stdout)
+        return
+
+    if options.database:
+        database = options.database
+        with Transaction().start(database, 0, readonly=True):
+            Pool(database).init()
+    else:
+        options.path = tempfile.mkdtemp()
+        database = create_database(options.path)
+
+    types = options.types.split(',') if options.types else None
+    try:
+        (survey_id,), columns = create_surveys(database, 'Load test', 1,
+            options.fields, types=types)
+        try:
+            pool = Pool(database)
+            with Transaction().start(database, 0) as transaction:
+                Survey = pool.get('survey.survey')
+                Survey.save_data(Survey(survey_id), (dict(
+                            (n, sample_value(t, i))
+                            for n, t in columns.iteritems())
+                        for i in range(options.rows)))
+                transaction.commit()
+
+            start = time.time()
+            if options.processes:
+                samples = run_processes(database, survey_id,
+                    options.workers, options.operations, options.mix,
+                    options.rows, options)
+            else:
+                samples = run_threads(database, survey_id, options.workers,
+                    options.operations, options.mix, options.rows)
+            duration = time.time() - start
+        finally:
+            delete_surveys(database, [survey_id])
+    finally:
+        if not options.database:
+            Pool.stop(database)
+            shutil.rmtree(options.path)
+
+    result = report(samples, duration)
+    result['metadata'] = {
+        'backend': backend.name(),
+        'python': platform.python_version(),
+        'date': datetime.datetime.utcnow().isoformat(),
+        'workers': options.workers,
+        'mode': 'processes' if options.processes else 'threads',
+        'mix': options.mix,
+        'fields': options.fields,
+        'types': sorted(set(columns.values())),
+        'rows': options.rows,
+        }
+    if options.output:
+        with open(options.output, 'w') as fileobj:
+            json.dump(result, fileobj, indent=2, sort_keys=True)
+    else:
+        json.dump(result, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
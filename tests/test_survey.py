@@ -2,14 +2,978 @@
 # The COPYRIGHT file at the top level of this repository contains the full
 # copyright notices and license terms.
 import unittest
+import json
+import datetime
+import os
+import shutil
+import tempfile
+from StringIO import StringIO
 import trytond.tests.test_tryton
-from trytond.tests.test_tryton import ModuleTestCase
+from trytond.tests.test_tryton import ModuleTestCase, with_transaction
+from trytond.pool import Pool
+from trytond.transaction import Transaction
+from trytond.model import fields
+from trytond.exceptions import UserError
+from trytond.config import config
+from trytond import backend
+from sql import Table
+
+from trytond.modules.survey.survey import copy_format
+from trytond.modules.survey.instrument import _counting
 
 
 class SurveyCase(ModuleTestCase):
     'Test Survey module'
     module = 'survey'
 
+    def create_survey(self, name='Survey'):
+        pool = Pool()
+        Survey = pool.get('survey.survey')
+        Model = pool.get('ir.model')
+
+        user_model, = Model.search([('model', '=', 'res.user')])
+        survey, = Survey.create([{
+                    'name': name,
+                    'fields_': [('create', [{
+                                    'name': 'Age',
+                                    'string': 'Age',
+                                    'type_': 'integer',
+                                    'sequence': 1,
+                                    }, {
+                                    'name': 'Colour',
+                                    'string': 'Colour',
+                                    'type_': 'selection',
+                                    'selection': 'red: Red\nblue: Blue',
+                                    'sequence': 2,
+                                    }, {
+                                    'name': 'Interviewer',
+                                    'string': 'Interviewer',
+                                    'type_': 'many2one',
+                                    'target_model': user_model.id,
+                                    'sequence': 3,
+                                    }])],
+                    }])
+        return survey
+
+    @with_transaction()
+    def delete_survey(self, survey_id):
+        Survey = Pool().get('survey.survey')
+        Survey.delete([Survey(survey_id)])
+        Transaction().commit()
+
+    @with_transaction()
+    def test_load_schemas(self):
+        'Test load schemas'
+        pool = Pool()
+        DynamicModel = pool.get('DynamicModel')
+
+        self.assertTrue(DynamicModel.module_survey_installed())
+        survey = self.create_survey()
+        empty = self.create_survey('Empty')
+        empty.fields_ = []
+        empty.save()
+
+        rows = DynamicModel.load_field_rows()
+        self.assertEqual(list(rows.keys()), [survey.id, empty.id])
+        self.assertEqual([r['name'] for r in rows[survey.id]],
+            ['Age', 'Colour', 'Interviewer'])
+        self.assertEqual(rows[survey.id][2]['model_name'], 'res.user')
+        self.assertEqual(rows[empty.id], [])
+        self.assertEqual(DynamicModel.load_field_rows([]), {})
+
+        schemas = DynamicModel.load_schemas()
+        self.assertEqual(list(schemas.keys()), [survey.id, empty.id])
+        self.assertEqual([d['name'] for d in schemas[survey.id]],
+            ['age', 'colour', 'interviewer'])
+        self.assertEqual(schemas[empty.id], [])
+
+        result = DynamicModel.get_fields(survey.id, schemas[survey.id])
+        self.assertIsInstance(result['age'], fields.Integer)
+        self.assertEqual(result['colour'].selection,
+            [('red', 'Red'), ('blue', 'Blue'), (None, '')])
+        self.assertEqual(result['interviewer'].model_name, 'res.user')
+
+    @with_transaction()
+    def test_schema_cache(self):
+        'Test schema cache'
+        pool = Pool()
+        DynamicModel = pool.get('DynamicModel')
+        Survey = pool.get('survey.survey')
+        SurveyField = pool.get('survey.field')
+
+        survey = self.create_survey()
+        values, = Survey.read([survey.id],
+            ['schema_version', 'schema_cache'])
+        version = values['schema_version']
+        self.assertEqual(json.loads(values['schema_cache'])['version'],
+            version)
+
+        # Loading the schemas never writes
+        table = Survey.__table__()
+        cursor = Transaction().connection.cursor()
+        cursor.execute(*table.update([table.schema_cache], [None],
+                where=table.id == survey.id))
+        schema = DynamicModel.load_schemas([survey.id])[survey.id]
+        self.assertEqual([d['name'] for d in schema],
+            ['age', 'colour', 'interviewer'])
+        values, = Survey.read([survey.id], ['schema_cache'])
+        self.assertFalse(values['schema_cache'])
+
+        field = survey.fields_[0]
+        field.name = 'Years'
+        field.save()
+        values, = Survey.read([survey.id], ['schema_version'])
+        self.assertGreater(values['schema_version'], version)
+
+        schema = DynamicModel.load_schemas([survey.id])[survey.id]
+        self.assertEqual(schema[0]['name'], 'years')
+        SurveyField.delete([field])
+        schema = DynamicModel.load_schemas([survey.id])[survey.id]
+        self.assertEqual([d['name'] for d in schema],
+            ['colour', 'interviewer'])
+
+    @with_transaction()
+    def test_lazy_model(self):
+        'Test survey model built on first access'
+        pool = Pool()
+        DynamicModel = pool.get('DynamicModel')
+        ActWindow = pool.get('ir.action.act_window')
+
+        survey = self.create_survey()
+        DynamicModel.remove_model(survey.id)
+        Model = DynamicModel.get_model(survey.id)
+        self.assertEqual(Model.__name__, 'survey.%s' % survey.id)
+        self.assertIn('colour', Model._fields)
+        self.assertIs(DynamicModel.get_model(survey.id), Model)
+        self.assertIs(pool.get('survey.%s' % survey.id), Model)
+
+        # Opening the action of the survey builds its model
+        DynamicModel.remove_model(survey.id)
+        action_window, = ActWindow.create([{
+                    'name': survey.name,
+                    'res_model': 'survey.%s' % survey.id,
+                    }])
+        ActWindow.read([action_window.id], ['res_model'])
+        self.assertIsNot(pool.get('survey.%s' % survey.id), Model)
+
+        DynamicModel.remove_model(survey.id)
+        with self.assertRaises(KeyError):
+            DynamicModel.get_model(survey.id + 1)
+
+    @with_transaction()
+    def test_model_version(self):
+        'Test survey model built again when its version changes'
+        pool = Pool()
+        Survey = pool.get('survey.survey')
+        DynamicModel = pool.get('DynamicModel')
+
+        survey = self.create_survey()
+        Model = DynamicModel.get_model(survey.id)
+        self.assertIs(DynamicModel.get_model(survey.id), Model)
+
+        # Simulate the change of the model by another process
+        table = Survey.__table__()
+        cursor = Transaction().connection.cursor()
+        cursor.execute(*table.update([table.model_version], [42],
+                where=table.id == survey.id))
+        self.assertIs(DynamicModel.get_model(survey.id), Model)
+        DynamicModel._model_versions_cache.clear()
+        NewModel = DynamicModel.get_model(survey.id)
+        self.assertIsNot(NewModel, Model)
+        self.assertEqual(NewModel._model_version, 42)
+
+        Survey.delete([survey])
+        with self.assertRaises(KeyError):
+            DynamicModel.get_model(survey.id)
+
+    @with_transaction()
+    def test_fields_view_get(self):
+        'Test survey fields_view_get'
+        pool = Pool()
+        DynamicModel = pool.get('DynamicModel')
+        SurveyField = pool.get('survey.field')
+
+        survey = self.create_survey()
+        tree_view = survey.create_view('tree')
+        survey.create_view('form')
+        Model = DynamicModel.get_model(survey.id)
+
+        result = Model.fields_view_get(tree_view.id, 'tree')
+        self.assertEqual(result['model'], Model.__name__)
+        self.assertIn('<field name="colour"/>', result['arch'])
+        self.assertEqual(set(result['fields']),
+            {'age', 'colour', 'interviewer'})
+        self.assertIs(Model.fields_view_get(tree_view.id, 'tree'), result)
+
+        with Transaction().set_context(survey=survey.id):
+            form = Model.fields_view_get(view_type='form')
+        self.assertIn('<label name="age"/>', form['arch'])
+
+        field, = SurveyField.search([
+                ('survey', '=', survey.id),
+                ('name', '=', 'Colour'),
+                ])
+        field.tree_view = False
+        field.save()
+        result = Model.fields_view_get(tree_view.id, 'tree')
+        self.assertNotIn('<field name="colour"/>', result['arch'])
+        DynamicModel.remove_model(survey.id)
+
+    @with_transaction()
+    def test_save_data(self):
+        'Test save data'
+        pool = Pool()
+        DynamicModel = pool.get('DynamicModel')
+        Survey = pool.get('survey.survey')
+
+        survey = self.create_survey()
+        # SQLite commits the transaction before DDL statements
+        survey.create_table()
+        self.addCleanup(self.delete_survey, survey.id)
+        Model = DynamicModel.get_model(survey.id)
+
+        self.assertEqual(Survey.save_data(survey, {'age': 30}), 1)
+        self.assertEqual(Survey.save_data(survey, ({
+                            'age': str(i),
+                            'colour': 'red' if i % 2 else 'blue',
+                            'interviewer': 1,
+                            } for i in range(250)), batch_size=100), 250)
+        self.assertEqual(Model.search([], count=True), 251)
+        self.assertEqual(Model.search([('colour', '=', 'red')], count=True),
+            125)
+        response, = Model.search([('age', '=', 249)])
+        self.assertEqual(response.interviewer.id, 1)
+
+        for data in [{'colour': 'green'}, {'age': 'old'}, {'name': 'X'}]:
+            with self.assertRaises(UserError):
+                Survey.save_data(survey, data)
+
+        # The COPY format keeps the precision of floats
+        self.assertEqual(copy_format(1.2345678901234567),
+            u'1.2345678901234567')
+
+    @with_transaction()
+    def test_validator(self):
+        'Test validation of the responses by batch'
+        pool = Pool()
+        Survey = pool.get('survey.survey')
+        SurveyField = pool.get('survey.field')
+        DynamicModel = pool.get('DynamicModel')
+
+        survey = self.create_survey()
+        SurveyField.write([f for f in survey.fields_ if f.name == 'Age'], {
+                'default_value': '18',
+                })
+        SurveyField.create([{
+                    'survey': survey.id,
+                    'name': 'Email',
+                    'string': 'Email',
+                    'type_': 'char',
+                    'email': True,
+                    'sequence': 4,
+                    }, {
+                    'survey': survey.id,
+                    'name': 'Website',
+                    'string': 'Website',
+                    'type_': 'char',
+                    'url': True,
+                    'sequence': 5,
+                    }])
+        survey.create_table()
+        self.addCleanup(self.delete_survey, survey.id)
+        Model = DynamicModel.get_model(survey.id)
+
+        validator = DynamicModel.get_validator(survey.id)
+        self.assertIs(DynamicModel.get_validator(survey.id), validator)
+        errors = []
+        self.assertEqual(Survey.save_data(survey, [
+                    {'email': 'a@example.com', 'website': 'http://a.org'},
+                    {'email': 'example.com', 'colour': 'green'},
+                    {'website': 'a.org', 'name': 'X'},
+                    {'age': 30},
+                    ], errors=errors), 2)
+        self.assertEqual([(e['response'], e['field'], e['error'])
+                for e in errors], [
+                (2, 'colour', 'invalid'),
+                (2, 'email', 'email'),
+                (3, 'name', 'unknown'),
+                (3, 'website', 'url'),
+                ])
+        self.assertIn('example.com', errors[1]['message'])
+        self.assertEqual(sorted(r.age for r in Model.search([])), [18, 30])
+        self.assertEqual(Model.default_get(['age'])['age'], 18)
+        with self.assertRaises(UserError):
+            Model.create([{'email': 'example.com'}])
+
+        SurveyField.write([f for f in survey.fields_ if f.name == 'Age'], {
+                'default_value': '21',
+                })
+        self.assertIsNot(DynamicModel.get_validator(survey.id), validator)
+
+    @with_transaction()
+    def test_submission_key(self):
+        'Test retried submissions are ignored'
+        pool = Pool()
+        DynamicModel = pool.get('DynamicModel')
+        Survey = pool.get('survey.survey')
+        SurveySummary = pool.get('survey.summary')
+
+        survey = self.create_survey()
+        Survey.write([survey], {'submission_key': True, 'summary': True})
+        survey.create_table()
+        self.addCleanup(self.delete_survey, survey.id)
+        Model = DynamicModel.get_model(survey.id)
+
+        self.assertEqual(Survey.save_data(survey, [
+                    {'age': 1, 'submission_key': 'a'},
+                    {'age': 2, 'submission_key': 'b'},
+                    {'age': 3},
+                    {'age': 4, 'submission_key': 'a'},
+                    ]), 3)
+        self.assertEqual(Survey.save_data(survey, [
+                    {'age': 5, 'submission_key': 'b'},
+                    {'age': 6, 'submission_key': 'c'},
+                    ]), 1)
+        response, = Model.create([{'age': 7, 'submission_key': 'd'}])
+        retry, other = Model.create([
+                {'age': 8, 'submission_key': 'd'},
+                {'age': 9},
+                ])
+        self.assertEqual(retry, response)
+        self.assertEqual(other.age, 9)
+        first, second, third = Model.create([
+                {'age': 10, 'submission_key': 'e'},
+                {'age': 11, 'submission_key': 'e'},
+                {'age': 12, 'submission_key': 'a'},
+                ])
+        self.assertEqual(first, second)
+        self.assertEqual(first.age, 10)
+        self.assertEqual(third.age, 1)
+        self.assertEqual(sorted(r.age for r in Model.search([])),
+            [1, 2, 3, 6, 7, 9, 10])
+        self.assertEqual(SurveySummary.get_summary(survey)['responses'], 7)
+
+        Survey.write([survey], {'submission_key': False})
+        Survey.migrate_tables([survey])
+        self.assertNotIn('submission_key', Survey.table_columns(survey.id))
+        Survey.write([survey], {'partitioning': 'month'})
+        with self.assertRaises(UserError):
+            Survey.write([survey], {'submission_key': True})
+
+    @with_transaction()
+    def test_import(self):
+        'Test import responses'
+        pool = Pool()
+        DynamicModel = pool.get('DynamicModel')
+        SurveyImport = pool.get('survey.import')
+
+        survey = self.create_survey()
+        survey.create_table()
+        self.addCleanup(self.delete_survey, survey.id)
+        Model = DynamicModel.get_model(survey.id)
+
+        import_ = SurveyImport(survey=survey, path='responses.csv',
+            chunk_size=2)
+        import_.save()
+        lines = ['Age,colour,Interviewer', '20,red, Administrator ',
+            '21,Blue,1', '22,green,', '23,,', '24,red,']
+        with self.assertRaises(UserError):
+            import_.import_file(StringIO('\n'.join(lines)))
+        import_ = SurveyImport(import_.id)
+        self.assertEqual(import_.state, 'failed')
+        self.assertEqual(import_.processed, 2)
+        self.assertEqual(Model.search([], count=True), 2)
+
+        lines[3] = '22,blue,'
+        import_.import_file(StringIO('\n'.join(lines)))
+        self.assertEqual(import_.state, 'done')
+        self.assertEqual(import_.processed, 5)
+        self.assertEqual(Model.search([], count=True), 5)
+        self.assertEqual(Model.search([('colour', '=', 'blue')], count=True),
+            2)
+        self.assertEqual(Model.search([('interviewer', '=', 1)], count=True),
+            2)
+
+    @with_transaction()
+    def test_export(self):
+        'Test export responses'
+        pool = Pool()
+        Survey = pool.get('survey.survey')
+
+        survey = self.create_survey()
+        survey.create_table()
+        self.addCleanup(self.delete_survey, survey.id)
+        Survey.save_data(survey, [{
+                    'age': i,
+                    'colour': 'red' if i % 2 else None,
+                    'interviewer': 1 if i % 3 else None,
+                    } for i in range(25)])
+
+        chunks = list(Survey.read_data(survey, chunk_size=10))
+        self.assertEqual([len(c) for c in chunks], [10, 10, 5])
+        self.assertEqual(chunks[0][1]['colour'], 'Red')
+        self.assertEqual(chunks[0][1]['interviewer'], 'Administrator')
+        self.assertEqual(chunks[0][0]['interviewer'], None)
+
+        data = StringIO()
+        self.assertEqual(Survey.export_data(survey, data, chunk_size=10), 25)
+        lines = data.getvalue().splitlines()
+        self.assertEqual(lines[0], 'id,create_date,age,colour,interviewer')
+        self.assertTrue(lines[2].endswith(',1,Red,Administrator'))
+
+        data = StringIO()
+        Survey.export_data(survey, data, format='jsonl', names=['age'],
+            labels=False)
+        lines = data.getvalue().splitlines()
+        self.assertEqual(len(lines), 25)
+        self.assertEqual(json.loads(lines[3])['age'], 3)
+
+        data = StringIO()
+        Survey.export_data(survey, data, format='columns', chunk_size=20,
+            names=['colour'], labels=False)
+        chunks = [json.loads(l) for l in data.getvalue().splitlines()]
+        self.assertEqual([len(c['id']) for c in chunks], [20, 5])
+        self.assertEqual(chunks[1]['colour'][:2], [None, 'red'])
+
+    @with_transaction()
+    def test_statistics(self):
+        'Test survey statistics'
+        pool = Pool()
+        Survey = pool.get('survey.survey')
+        SurveyField = pool.get('survey.field')
+        SurveyResult = pool.get('survey.result')
+
+        survey = self.create_survey()
+        survey.fields_ += (SurveyField(name='Visit', string='Visit',
+                type_='date', sequence=4),)
+        survey.save()
+        survey.create_table()
+        self.addCleanup(self.delete_survey, survey.id)
+        Survey.save_data(survey, [{
+                    'age': i,
+                    'colour': 'red' if i % 2 else 'blue',
+                    'interviewer': 1 if i < 5 else None,
+                    'visit': datetime.date(2018, i % 3 + 1, i),
+                    } for i in range(1, 11)])
+
+        result = SurveyResult.compute(survey)
+        self.assertEqual(result['colour'],
+            {'count': 10, 'distribution': {'red': 5, 'blue': 5}})
+        self.assertEqual(result['interviewer']['distribution'],
+            {1: 4, None: 6})
+        age = result['age']
+        self.assertEqual((age['count'], age['min'], age['max'], age['sum']),
+            (10, 1, 10, 55))
+        self.assertEqual(age['mean'], 5.5)
+        self.assertEqual(age['percentiles'], {25: 3, 50: 5, 75: 8})
+        visit = result['visit']
+        self.assertEqual(visit['min'], datetime.date(2018, 1, 3))
+        self.assertEqual(visit['histogram'], [
+                (datetime.date(2018, 1, 1), 3),
+                (datetime.date(2018, 2, 1), 4),
+                (datetime.date(2018, 3, 1), 3),
+                ])
+
+        result = SurveyResult.compute(survey, names=['age'],
+            group_by='colour', percentiles=(50,))
+        self.assertEqual(set(result), {'age'})
+        self.assertEqual(result['age']['red']['max'], 9)
+        self.assertEqual(result['age']['blue']['percentiles'], {50: 6})
+
+        with Transaction().set_context(survey=survey.id):
+            results = SurveyResult.search([('field', '=', 'colour')])
+            self.assertEqual([(r.value, r.count) for r in results],
+                [('blue', 5), ('red', 5)])
+        self.assertEqual(SurveyResult.search([]), [])
+
+    @with_transaction()
+    def test_cross(self):
+        'Test cross-survey queries'
+        pool = Pool()
+        Survey = pool.get('survey.survey')
+        SurveyField = pool.get('survey.field')
+        SurveyCross = pool.get('survey.cross')
+
+        first = self.create_survey('First')
+        second = self.create_survey('Second')
+        # The same name with another type is not common
+        SurveyField.write([second.fields_[1]], {'type_': 'char'})
+        for i, survey in enumerate([first, second]):
+            survey.create_table()
+            self.addCleanup(self.delete_survey, survey.id)
+            Survey.save_data(survey, [{'age': 10 * i + j}
+                    for j in range(5)])
+        surveys = [first, second]
+
+        self.assertEqual(list(SurveyCross.common_fields(surveys)),
+            ['age', 'interviewer'])
+        with self.assertRaises(UserError):
+            SurveyCross.union(surveys, ['colour'])
+
+        responses = SurveyCross.search_responses(surveys, ['age'],
+            domain=[('age', '>=', 3), ('age', '<', 12)],
+            order=[('age', 'DESC')], limit=3)
+        self.assertEqual([r['age'] for r in responses], [11, 10, 4])
+        self.assertEqual(responses[0]['survey'], second.id)
+
+        result = SurveyCross.aggregate(surveys, ['age'])
+        self.assertEqual([(r['survey'], r['count'], r['age']['max'])
+                for r in result], [(first.id, 5, 4), (second.id, 5, 14)])
+        result, = SurveyCross.aggregate(surveys, ['age'], group_by=[],
+            domain=[('age', 'in', [1, 2, 11])])
+        self.assertEqual((result['count'], result['age']['sum']), (3, 14))
+
+        with Transaction().set_context(surveys=[first.id, second.id],
+                field='age'):
+            self.assertEqual(SurveyCross.search([], count=True), 10)
+            responses = SurveyCross.search([('number', '>', 12)])
+            self.assertEqual([r.value for r in responses], ['13', '14'])
+        self.assertEqual(SurveyCross.search([]), [])
+
+    @with_transaction()
+    def test_summary(self):
+        'Test live summary'
+        pool = Pool()
+        DynamicModel = pool.get('DynamicModel')
+        Survey = pool.get('survey.survey')
+        SurveySummary = pool.get('survey.summary')
+
+        survey = self.create_survey()
+        survey.create_table()
+        self.addCleanup(self.delete_survey, survey.id)
+        Model = DynamicModel.get_model(survey.id)
+        Survey.save_data(survey, [{'age': 10, 'colour': 'red'}])
+        Survey.write([survey], {'summary': True})
+
+        Survey.save_data(survey, [{
+                    'age': i,
+                    'colour': 'blue',
+                    'interviewer': 1,
+                    } for i in range(1, 5)])
+        response, = Model.create([{'age': 5, 'colour': 'red'}])
+        Model.write([response], {'age': 15, 'colour': 'blue'})
+        Model.delete(Model.search([('age', '=', 1)]))
+
+        summary = SurveySummary.get_summary(survey)
+        self.assertEqual(summary['responses'], 5)
+        self.assertEqual(sum(summary['days'].values()), 5)
+        self.assertEqual(summary['colour']['distribution'],
+            {'red': 1, 'blue': 4})
+        self.assertEqual(summary['interviewer']['distribution'],
+            {1: 3, None: 2})
+        self.assertEqual((summary['age']['count'], summary['age']['sum']),
+            (5, 34))
+
+        Survey.rebuild_summary([survey])
+        self.assertEqual(SurveySummary.get_summary(survey), summary)
+
+        # Each key has one row
+        for _ in range(2):
+            SurveySummary.apply_deltas(survey.id, {
+                    ('colour', 'green'): [1, None],
+                    ('interviewer', None): [1, None],
+                    })
+        self.assertEqual(SurveySummary.search_count([
+                    ('survey', '=', survey.id),
+                    ['OR',
+                        [('field', '=', 'colour'), ('key', '=', 'green')],
+                        [('field', '=', 'interviewer'), ('key', '=', None)],
+                        ],
+                    ]), 2)
+        summary = SurveySummary.get_summary(survey)
+        self.assertEqual(summary['colour']['distribution']['green'], 2)
+        self.assertEqual(summary['interviewer']['distribution'][None], 4)
+
+    @with_transaction()
+    def test_keyset(self):
+        'Test keyset pagination and estimated count'
+        pool = Pool()
+        DynamicModel = pool.get('DynamicModel')
+        Survey = pool.get('survey.survey')
+
+        survey = self.create_survey()
+        survey.create_table()
+        self.addCleanup(self.delete_survey, survey.id)
+        Model = DynamicModel.get_model(survey.id)
+        Survey.write([survey], {'summary': True})
+        Survey.save_data(survey, [{'age': i} for i in range(25)])
+        ids = [r.id for r in Model.search([], order=[('id', 'DESC')])]
+
+        pages = [Model.search([], offset=o, limit=10, order=[('id', 'DESC')])
+            for o in range(0, 30, 10)]
+        self.assertEqual([r.id for p in pages for r in p], ids)
+        self.assertIn(pages[0][-1].id,
+            [k[0] for k in Model._keysets.values()])
+        Survey.save_data(survey, [{'age': 25}])
+        self.assertFalse(Model._keysets)
+        Model.delete(Model.search([('age', '=', 25)]))
+
+        records, key = Model.search_keyset([('age', '>=', 5)], limit=10,
+            order=[('create_date', 'ASC')])
+        records2, _ = Model.search_keyset([('age', '>=', 5)], after=key,
+            limit=10, order=[('create_date', 'ASC')])
+        self.assertEqual([r.age for r in records + records2], range(5, 25))
+        self.assertEqual(key, (records[-1].create_date, records[-1].id))
+        with self.assertRaises(ValueError):
+            Model.search_keyset([], order=[('age', 'ASC')])
+
+        # The counter of the summary is used without domain
+        cursor = Transaction().connection.cursor()
+        table = Table('survey_%s' % survey.id)
+        cursor.execute(*table.insert([table.age], [[100]]))
+        self.assertEqual(Model.search_count([]), 26)
+        with Transaction().set_context(estimated_count=True):
+            self.assertEqual(Model.search_count([]), 25)
+            self.assertEqual(Model.search_count([('age', '>=', 0)]), 26)
+            with Transaction().set_context(exact_count=True):
+                self.assertEqual(Model.search_count([]), 26)
+
+    @with_transaction()
+    def test_rec_names(self):
+        'Test record names of many2one fields'
+        pool = Pool()
+        DynamicModel = pool.get('DynamicModel')
+        Survey = pool.get('survey.survey')
+        User = pool.get('res.user')
+
+        survey = self.create_survey()
+        survey.create_table()
+        self.addCleanup(self.delete_survey, survey.id)
+        Model = DynamicModel.get_model(survey.id)
+        Survey.save_data(survey, [{'interviewer': 1 if i % 2 else None}
+                for i in range(4)])
+        admin = User(1)
+
+        rows = Model.read([r.id for r in Model.search([])],
+            ['age', 'interviewer.rec_name'])
+        self.assertEqual([r['interviewer.rec_name'] for r in rows],
+            [None, admin.rec_name] * 2)
+        self.assertEqual(set(rows[0]), {'id', 'age', 'interviewer.rec_name'})
+        cache = Transaction().get_cache()['survey.rec_names']
+        self.assertEqual(cache[('res.user', 1)], admin.rec_name)
+
+        responses, = Survey.read_data(survey, names=['interviewer'])
+        self.assertEqual([r['interviewer'] for r in responses],
+            [None, admin.rec_name] * 2)
+
+    @with_transaction()
+    def test_indexes(self):
+        'Test survey table indexes'
+        pool = Pool()
+        Survey = pool.get('survey.survey')
+        SurveyField = pool.get('survey.field')
+        SurveyIndex = pool.get('survey.index')
+
+        survey = self.create_survey()
+        survey.create_table()
+        self.addCleanup(self.delete_survey, survey.id)
+        table = 'survey_%s' % survey.id
+        self.assertEqual(Survey.table_indexes(survey.id), {
+                '%s_create_date_btree_idx' % table,
+                '%s_interviewer_btree_idx' % table,
+                })
+
+        age, colour, interviewer = survey.fields_
+        SurveyField.write([age], {'index': 'partial'},
+            [interviewer], {'index': 'hash'})
+        index, = SurveyIndex.create([{
+                    'survey': survey.id,
+                    'columns': 'Colour, age',
+                    }])
+        self.assertEqual(Survey.table_indexes(survey.id), {
+                '%s_create_date_btree_idx' % table,
+                '%s_age_partial_idx' % table,
+                '%s_interviewer_hash_idx' % table,
+                '%s_colour_age_btree_idx' % table,
+                })
+
+        SurveyIndex.delete([index])
+        SurveyField.delete([interviewer])
+        self.assertEqual(Survey.table_indexes(survey.id), {
+                '%s_create_date_btree_idx' % table,
+                '%s_age_partial_idx' % table,
+                })
+
+        with self.assertRaises(UserError):
+            SurveyIndex.create([{
+                        'survey': survey.id,
+                        'columns': 'age, size',
+                        }])
+
+    @with_transaction()
+    def test_migrate_table(self):
+        'Test migrate survey table'
+        pool = Pool()
+        DynamicModel = pool.get('DynamicModel')
+        Survey = pool.get('survey.survey')
+        SurveyField = pool.get('survey.field')
+
+        survey = self.create_survey()
+        survey.create_table()
+        self.addCleanup(self.delete_survey, survey.id)
+        Survey.save_data(survey, [{'age': i, 'colour': 'red'}
+                for i in range(10)])
+
+        age, colour, interviewer = survey.fields_
+        colour.name = 'Shade'
+        colour.save()
+        self.assertEqual(colour.previous_column, 'colour')
+        SurveyField.delete([interviewer])
+        SurveyField.create([{
+                    'survey': survey.id,
+                    'name': 'Height',
+                    'string': 'Height',
+                    'type_': 'float',
+                    'digits': 2,
+                    }])
+        survey = Survey(survey.id)
+        survey.migrate_table()
+
+        self.assertEqual(list(Survey.table_definition(survey.id).keys()),
+            ['age', 'shade', 'height'])
+        self.assertEqual(SurveyField.read([colour.id], ['previous_column']),
+            [{'id': colour.id, 'previous_column': None}])
+        Model = DynamicModel.get_model(survey.id)
+        self.assertIn('height', Model._fields)
+        self.assertNotIn('interviewer', Model._fields)
+        # The responses of the renamed field are kept
+        self.assertEqual(Model.search([('shade', '=', 'red')], count=True),
+            10)
+        Survey.save_data(survey, {'age': 1, 'height': 1.75})
+        self.assertEqual(Model.search([('height', '>', 1)], count=True), 1)
+
+    @unittest.skipIf(backend.name() == 'sqlite',
+        'SQLite columns are not typed')
+    @with_transaction()
+    def test_migrate_column_type(self):
+        'Test migrate the type of a survey column'
+        pool = Pool()
+        DynamicModel = pool.get('DynamicModel')
+        Survey = pool.get('survey.survey')
+        transaction = Transaction()
+
+        survey = self.create_survey()
+        survey.create_table()
+        Survey.save_data(survey, [{'age': i} for i in range(5)])
+        # The values are converted in other transactions
+        transaction.commit()
+        self.addCleanup(self.delete_survey, survey.id)
+
+        # Reading the columns does not lock the table for the conversion
+        self.assertIn('age', Survey.table_columns(survey.id))
+        age = survey.fields_[0]
+        age.type_ = 'char'
+        age.required = True
+        age.save()
+        survey = Survey(survey.id)
+        survey.migrate_table(batch_size=2)
+
+        self.assertEqual(Survey.table_definition(survey.id)['age'],
+            ('character varying', True))
+        Model = DynamicModel.get_model(survey.id)
+        self.assertEqual(Model.search([('age', '=', '3')], count=True), 1)
+
+    @with_transaction()
+    def test_partitions(self):
+        'Test partitioned survey table'
+        pool = Pool()
+        DynamicModel = pool.get('DynamicModel')
+        Survey = pool.get('survey.survey')
+
+        survey = self.create_survey()
+        survey.partitioning = 'month'
+        survey.partitions_kept = 3
+        survey.save()
+        self.assertEqual(survey.partition_bounds(datetime.date(2018, 12, 31)),
+            (datetime.date(2018, 12, 1), datetime.date(2019, 1, 1)))
+        survey.partitioning = 'week'
+        self.assertEqual(survey.partition_bounds(datetime.date(2018, 3, 1)),
+            (datetime.date(2018, 2, 26), datetime.date(2018, 3, 5)))
+        survey.partitioning = 'month'
+
+        survey.create_table()
+        self.addCleanup(self.delete_survey, survey.id)
+        Survey.update_partitions()
+        Survey.save_data(survey, [{'age': i} for i in range(5)])
+        Model = DynamicModel.get_model(survey.id)
+        self.assertEqual(Model.search([], count=True), 5)
+
+    @with_transaction()
+    def test_archive(self):
+        'Test archive and restore responses'
+        pool = Pool()
+        DynamicModel = pool.get('DynamicModel')
+        Survey = pool.get('survey.survey')
+        SurveySummary = pool.get('survey.summary')
+        Configuration = pool.get('survey.configuration')
+
+        survey = self.create_survey()
+        survey.create_table()
+        self.addCleanup(self.delete_survey, survey.id)
+        Model = DynamicModel.get_model(survey.id)
+        Survey.write([survey], {
+                'summary': True,
+                'retention_days': 30,
+                })
+        Survey.save_data(survey, [{'age': i, 'colour': 'red'}
+                for i in range(10)])
+        table = Table('survey_%s' % survey.id)
+        cursor = Transaction().connection.cursor()
+        cursor.execute(*table.update([table.create_date],
+                [datetime.datetime(2018, 1, 1)], where=table.age < 6))
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        configuration = Configuration(1)
+        configuration.archive_path = directory
+        configuration.save()
+
+        for storage in ['table', 'file']:
+            Survey.write([survey], {'archive_storage': storage})
+            archive, = Survey.archive_responses(batch_size=4)
+            self.assertEqual((archive.count, archive.state), (6, 'archived'))
+            self.assertEqual(Model.search([], count=True), 4)
+            self.assertEqual(SurveySummary.get_summary(survey)['responses'],
+                4)
+            self.assertEqual(Survey.archive_responses(), [])
+            if storage == 'file':
+                self.assertTrue(os.path.exists(archive.path))
+
+            archive.restore_responses(batch_size=4)
+            self.assertEqual(archive.state, 'restored')
+            self.assertEqual(Model.search([], count=True), 10)
+            self.assertEqual(Model.search([('age', '<', 6)], count=True), 6)
+            self.assertEqual(SurveySummary.get_summary(survey)['responses'],
+                10)
+
+    @with_transaction()
+    def test_create_menus(self):
+        'Test create and remove menus of surveys'
+        pool = Pool()
+        DynamicModel = pool.get('DynamicModel')
+        Survey = pool.get('survey.survey')
+        Menu = pool.get('ir.ui.menu')
+        ActionKeyword = pool.get('ir.action.keyword')
+
+        surveys = [self.create_survey('Survey %s' % i) for i in range(3)]
+        for survey in surveys:
+            self.addCleanup(self.delete_survey, survey.id)
+        Survey.create_menus(surveys)
+
+        for survey in surveys:
+            survey = Survey(survey.id)
+            menu, = survey.menus
+            self.assertEqual(menu.name, survey.name)
+            self.assertEqual(len(survey.views), 2)
+            action_window, = survey.action_windows
+            self.assertEqual([v.view.type
+                    for v in action_window.act_window_views],
+                ['tree', 'form'])
+            keyword, = ActionKeyword.search([
+                    ('model', '=', 'ir.ui.menu,%s' % menu.id),
+                    ])
+            self.assertEqual(keyword.action, action_window.action)
+            DynamicModel.get_model(survey.id)
+
+        Survey.create_menus(surveys)
+        self.assertEqual(Menu.search([
+                    ('survey', 'in', [s.id for s in surveys]),
+                    ], count=True), 3)
+        Survey.remove_menus(surveys)
+        self.assertEqual(Menu.search([
+                    ('survey', 'in', [s.id for s in surveys]),
+                    ], count=True), 0)
+
+    @with_transaction()
+    def test_instrument(self):
+        'Test timings of the survey operations'
+        pool = Pool()
+        DynamicModel = pool.get('DynamicModel')
+        Survey = pool.get('survey.survey')
+        SurveyTiming = pool.get('survey.timing')
+
+        if not config.has_section('survey'):
+            config.add_section('survey')
+        config.set('survey', 'instrument', 'True')
+        self.addCleanup(config.remove_option, 'survey', 'instrument')
+
+        survey = self.create_survey()
+        self.addCleanup(self.delete_survey, survey.id)
+        Survey.create_menus([survey])
+        Model = DynamicModel.get_model(survey.id)
+        with Transaction().set_context(survey=survey.id):
+            Model.fields_view_get(view_type='tree')
+
+        summary = SurveyTiming.summary()
+        for name in ['create_menus', 'migrate_table', 'create_table',
+                'menus', 'setup', 'register', 'fields_view_get']:
+            self.assertIn(name, summary)
+        self.assertGreater(summary['create_table']['queries'], 0)
+        timing, = SurveyTiming.search([
+                ('phase', '=', 'create_table'),
+                ])
+        self.assertEqual(timing.survey, survey.id)
+        self.assertEqual(timing.parent_phase, 'migrate_table')
+        menus = SurveyTiming.summary([('parent_phase', '=', 'create_menus')])
+        self.assertNotIn('create_table', menus)
+        # The queries are only counted during the phases
+        self.assertEqual(_counting['phases'], 0)
+        self.assertIsNone(_counting['cursor'])
+
+    @with_transaction()
+    def test_shared_storage(self):
+        'Test surveys with shared storage'
+        pool = Pool()
+        Survey = pool.get('survey.survey')
+        SurveyField = pool.get('survey.field')
+        SurveyResponse = pool.get('survey.response')
+        SurveySummary = pool.get('survey.summary')
+        DynamicModel = pool.get('DynamicModel')
+
+        survey = self.create_survey()
+        # The names of the fields are the keys of the answers
+        with self.assertRaises(UserError):
+            Survey.write([survey], {'storage': 'shared'})
+        for field in survey.fields_:
+            SurveyField.write([field], {'name': field.name.lower()})
+        survey = Survey(survey.id)
+        Survey.write([survey], {'storage': 'shared', 'summary': True})
+        Survey.create_menus([survey])
+        self.assertNotIn(survey.id, DynamicModel.model_versions())
+        with self.assertRaises(KeyError):
+            DynamicModel.get_model(survey.id)
+        action_window, = survey.action_windows
+        self.assertEqual(action_window.res_model, 'survey.response')
+
+        self.assertEqual(Survey.save_data(survey, [{
+                            'age': i,
+                            'colour': 'red' if i % 2 else 'blue',
+                            'interviewer': 1 if i % 3 else None,
+                            } for i in range(10)]), 10)
+        with Transaction().set_context(survey=survey.id):
+            response, = SurveyResponse.create([{
+                        'answers': {'Age': 10, 'colour': 'red'},
+                        }])
+        self.assertEqual(response.survey, survey)
+        self.assertEqual(response.answers, {'age': 10, 'colour': 'red'})
+
+        responses, = Survey.read_data(survey, labels=False)
+        self.assertEqual(len(responses), 11)
+        self.assertEqual(responses[1]['colour'], 'red')
+        self.assertEqual(responses[0]['interviewer'], None)
+
+        found = SurveyResponse.search_answers(survey,
+            {'colour': 'red', 'interviewer': 1})
+        self.assertEqual(len(found), 3)
+
+        SurveyResponse.delete([response])
+        summary = SurveySummary.get_summary(survey)
+        self.assertEqual(summary['responses'], 10)
+        self.assertEqual(summary['colour']['distribution'],
+            {'red': 5, 'blue': 5})
+        Survey.rebuild_summary([survey])
+        self.assertEqual(SurveySummary.get_summary(survey), summary)
+
 
 def suite():
     suite = trytond.tests.test_tryton.suite()